@@ -0,0 +1,563 @@
+import hashlib
+import secrets
+from functools import wraps
+import json
+import time
+from datetime import datetime
+from flask import Blueprint, jsonify, request, abort, url_for, current_app, Response, stream_with_context, send_file
+from flask_login import current_user
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from importer import clean_fields, import_records, RowError
+from models import db, User, Asset, ArchivedAsset, ApiToken, Attachment, Job, is_name_conflict
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from pagination import InvalidCursor
+from search import parse_filters
+from changes import change_to_dict, latest_cursor, wait_for_changes
+from bulk import bulk_delete, bulk_update, BulkError
+from jobs import enqueue, job_to_dict, can_view, result_file
+from exporter import FORMATS as EXPORT_FORMATS
+from reports import asset_report
+from attachments import AttachmentTooLarge, add_attachment, attachment_to_dict, send_attachment
+from archive import ArchiveError, asset_page, retire_asset, unretire_asset, restore_archived
+from facets import FacetError, clean_tags, clean_attributes, set_facets, facet_summary, tag_names, attribute_values
+
+# Versioned JSON API for integration scripts. Requests authenticate with an
+# "Authorization: Bearer <token>" header (see load_user_from_token in auth.py), so no
+# login round trip or session cookie is needed. Every asset carries an ETag derived
+# from its row version, letting pollers revalidate with If-None-Match and get a 304.
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Creates a token for user and returns the raw value, which is never stored
+def create_token(user, name):
+    token = secrets.token_urlsafe(32)
+    db.session.add(ApiToken(user_id=user.id, name=name, token_hash=hash_token(token)))
+    db.session.commit()
+    return token
+
+
+# Returns the user owning a raw token, or None
+def authenticate_token(token):
+    api_token = ApiToken.query.filter_by(token_hash=hash_token(token)).first()
+    return api_token.user if api_token else None
+
+
+def api_login_required(f):
+    # Like login_required, but answers 401 with JSON instead of redirecting to the login page
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            abort(401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def api_admin_required(f):
+    @wraps(f)
+    @api_login_required
+    def decorated_function(*args, **kwargs):
+        if current_user.role != 'admin':
+            abort(403)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@api.errorhandler(HTTPException)
+def handle_http_error(error):
+    response = jsonify(error=error.description)
+    response.status_code = error.code
+    return response
+
+
+def asset_etag(asset):
+    return '%d-%d' % (asset.id, asset.version)
+
+
+def asset_to_dict(asset):
+    return {
+        'id': asset.id,
+        'name': asset.name,
+        'description': asset.description,
+        'owner_id': asset.owner_id,
+        'created_by': asset.created_by,
+        'date_created': asset.date_created.isoformat() if asset.date_created else None,
+        'updated_at': asset.updated_at.isoformat() if asset.updated_at else None,
+        'version': asset.version,
+        'retired_at': asset.retired_at.isoformat() if asset.retired_at else None,
+        'tags': tag_names(asset),
+        'attributes': attribute_values(asset),
+    }
+
+
+# An archived asset under the id it had; archive_id is what restoring it takes
+def archived_asset_to_dict(archived):
+    return dict(asset_to_dict(archived), id=archived.asset_id, archive_id=archived.id, archived=True,
+                archived_at=archived.archived_at.isoformat())
+
+
+# Builds a single-asset response carrying ETag and Last-Modified, answering 304 when
+# the client's If-None-Match / If-Modified-Since validators still match
+def asset_response(asset, status=200):
+    response = jsonify(asset_to_dict(asset))
+    response.status_code = status
+    response.set_etag(asset_etag(asset))
+    response.last_modified = asset.updated_at or asset.date_created
+    if status == 200:
+        response.make_conditional(request)
+    return response
+
+
+def _json_body():
+    data = request.get_json(silent=True)
+    if data is None:
+        abort(400, description='Expected a JSON request body.')
+    return data
+
+
+def _check_if_match(asset):
+    # Optimistic concurrency: a write carrying If-Match must target the current version
+    if request.if_match and not request.if_match.contains(asset_etag(asset)):
+        abort(412, description='The asset was modified since it was fetched.')
+
+
+def _owner_id(data):
+    if 'owner_id' not in data:
+        return None
+    if current_user.role != 'admin':
+        abort(403, description='Only admins can change asset owners.')
+    owner = db.session.get(User, data['owner_id']) if isinstance(data['owner_id'], int) else None
+    if owner is None:
+        abort(400, description='Unknown owner_id.')
+    return owner.id
+
+
+# The "tags" list and "attributes" object of a request body, None for those it leaves out
+def _facets(data):
+    try:
+        tags = clean_tags(data['tags']) if 'tags' in data else None
+        attributes = clean_attributes(data['attributes']) if 'attributes' in data else None
+    except FacetError as exc:
+        abort(400, description=str(exc))
+    return tags, attributes
+
+
+# Request filters given as a JSON object; a list value (e.g. "tag") matches all its items
+def _filter_args(raw):
+    args = MultiDict()
+    for key, value in raw.items():
+        for item in value if isinstance(value, list) else [value]:
+            args.add(key, str(item))
+    return parse_filters(args)
+
+
+def _name_conflict(exc):
+    db.session.rollback()
+    if not is_name_conflict(exc):
+        raise exc
+    abort(409, description='An asset with this name already exists.')
+
+
+# Another request wrote the asset between loading it and this write: its version no longer
+# matched, so the UPDATE or DELETE found no row
+def _changed_meanwhile():
+    db.session.rollback()
+    abort(412 if request.if_match else 409, description='The asset was changed by another request; fetch it and try again.')
+
+
+def _commit():
+    # Relies on the unique index on asset.name instead of querying for duplicates first
+    try:
+        db.session.commit()
+    except IntegrityError as exc:
+        _name_conflict(exc)
+    except StaleDataError:
+        _changed_meanwhile()
+
+
+@api.route('/assets')
+@api_login_required
+# Lists assets one keyset page at a time, accepting the same filters as /assets
+# (?archived=include or ?archived=only for archived assets)
+def list_assets():
+    per_page = request.args.get('per_page', current_app.config['ASSETS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['ASSETS_MAX_PER_PAGE']))
+    filters = parse_filters(request.args)
+    try:
+        assets, next_cursor = asset_page(filters, cursor=request.args.get('cursor'), per_page=per_page,
+                                         with_facets=True)
+    except InvalidCursor:
+        abort(400, description='Invalid cursor.')
+    items = [archived_asset_to_dict(asset) if isinstance(asset, ArchivedAsset) else asset_to_dict(asset)
+             for asset in assets]
+    response = jsonify(items=items, next_cursor=next_cursor)
+    # The page ETag changes whenever any asset on it changes version, or rows come and go
+    fingerprint = ','.join('%s-%d' % (item.get('archive_id', ''), item['version']) if item.get('archived')
+                           else '%d-%d' % (item['id'], item['version']) for item in items)
+    fingerprint += '|' + (next_cursor or '')
+    response.set_etag(hashlib.sha1(fingerprint.encode()).hexdigest(), weak=True)
+    return response.make_conditional(request)
+
+
+@api.route('/assets/<int:asset_id>')
+@api_login_required
+def get_asset(asset_id):
+    return asset_response(db.get_or_404(Asset, asset_id))
+
+
+@api.route('/assets', methods=['POST'])
+@api_login_required
+def create_asset():
+    data = _json_body()
+    try:
+        fields = clean_fields(data)
+    except RowError as exc:
+        abort(400, description=str(exc))
+    tags, attributes = _facets(data)
+    asset = Asset(owner_id=_owner_id(data) or current_user.id, created_by=current_user.username, **fields)
+    db.session.add(asset)
+    try:
+        db.session.flush()
+    except IntegrityError as exc:
+        _name_conflict(exc)
+    set_facets(asset.id, tags=tags or [], attributes=attributes or {})
+    _commit()
+    response = asset_response(asset, status=201)
+    response.headers['Location'] = url_for('api.get_asset', asset_id=asset.id)
+    return response
+
+
+@api.route('/assets/bulk', methods=['POST'])
+@api_login_required
+# Creates many assets from a JSON array using the bulk importer's batched INSERTs
+def bulk_create_assets():
+    data = _json_body()
+    if not isinstance(data, list):
+        abort(400, description='Expected a JSON array of assets.')
+    if current_user.role != 'admin' and any(isinstance(item, dict) and ('owner_id' in item or 'owner' in item) for item in data):
+        abort(403, description='Only admins can set asset owners.')
+    owner = db.session.get(User, current_user.id)
+    result = import_records(enumerate(data), owner, batch_size=current_app.config['IMPORT_BATCH_SIZE'])
+    status = 201 if result.inserted else 400
+    return jsonify(inserted=result.inserted, failed=result.failed,
+                   errors=[{'index': index, 'error': message} for index, message in result.errors]), status
+
+
+# The selection of a bulk request: {"ids": [...]} and/or {"filter": {...}} using the asset list filters
+def _bulk_selection(data):
+    ids = data.get('ids')
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)):
+        abort(400, description='ids must be a list of integers.')
+    raw = data.get('filter')
+    if raw is not None and not isinstance(raw, dict):
+        abort(400, description='filter must be an object.')
+    filters = _filter_args(raw or {})
+    return {'ids': ids, 'filters': filters, 'dry_run': bool(data.get('dry_run')),
+            'chunk_size': current_app.config['BULK_CHUNK_SIZE']}
+
+
+@api.route('/assets/bulk-delete', methods=['POST'])
+@api_admin_required
+# Deletes the selected assets in chunked transactions; "dry_run": true only counts them
+def bulk_delete_assets():
+    data = _json_body()
+    if not isinstance(data, dict):
+        abort(400, description='Expected a JSON object.')
+    try:
+        result = bulk_delete(**_bulk_selection(data))
+    except BulkError as exc:
+        abort(400, description=str(exc))
+    return jsonify(result.to_dict())
+
+
+@api.route('/assets/bulk-update', methods=['POST'])
+@api_admin_required
+# Sets owner_id and/or description ("set") on the selected assets in chunked transactions
+def bulk_update_assets():
+    data = _json_body()
+    if not isinstance(data, dict) or not isinstance(data.get('set'), dict):
+        abort(400, description='Expected a JSON object with a "set" object.')
+    try:
+        result = bulk_update(data['set'], **_bulk_selection(data))
+    except BulkError as exc:
+        abort(400, description=str(exc))
+    return jsonify(result.to_dict())
+
+
+@api.route('/assets/<int:asset_id>', methods=['PATCH'])
+@api_login_required
+def update_asset(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    _check_if_match(asset)
+    data = _json_body()
+    try:
+        fields = clean_fields(data, partial=True)
+    except RowError as exc:
+        abort(400, description=str(exc))
+    owner_id = _owner_id(data)
+    if owner_id is not None:
+        fields['owner_id'] = owner_id
+    tags, attributes = _facets(data)
+    for key, value in fields.items():
+        setattr(asset, key, value)
+    # "tags" and "attributes" replace the asset's whole set; changing them bumps updated_at
+    if set_facets(asset.id, tags=tags, attributes=attributes):
+        asset.updated_at = datetime.utcnow()
+    _commit()
+    return asset_response(asset)
+
+
+@api.route('/assets/<int:asset_id>', methods=['DELETE'])
+@api_admin_required
+def delete_asset(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    _check_if_match(asset)
+    db.session.delete(asset)
+    _commit()
+    return '', 204
+
+
+@api.route('/assets/<int:asset_id>/retire', methods=['POST'])
+@api_admin_required
+# Marks an asset as retired; `flask assets archive` moves it to the archive later
+def retire(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    _check_if_match(asset)
+    try:
+        retire_asset(asset)
+    except StaleDataError:
+        _changed_meanwhile()
+    return asset_response(asset)
+
+
+@api.route('/assets/<int:asset_id>/unretire', methods=['POST'])
+@api_admin_required
+def unretire(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    _check_if_match(asset)
+    try:
+        unretire_asset(asset)
+    except StaleDataError:
+        _changed_meanwhile()
+    return asset_response(asset)
+
+
+@api.route('/archive/<int:archive_id>')
+@api_login_required
+def get_archived_asset(archive_id):
+    return jsonify(archived_asset_to_dict(db.get_or_404(ArchivedAsset, archive_id)))
+
+
+@api.route('/archive/<int:archive_id>/restore', methods=['POST'])
+@api_admin_required
+# Moves an archived asset back to the asset table; 409 when its name has been taken
+def restore(archive_id):
+    archived = db.get_or_404(ArchivedAsset, archive_id)
+    try:
+        asset = restore_archived(archived)
+    except ArchiveError as exc:
+        abort(409, description=str(exc))
+    response = asset_response(asset, status=201)
+    response.headers['Location'] = url_for('api.get_asset', asset_id=asset.id)
+    return response
+
+
+@api.route('/assets/<int:asset_id>/attachments')
+@api_login_required
+def list_attachments(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    return jsonify({'items': [attachment_to_dict(attachment) for attachment in asset.attachments]})
+
+
+@api.route('/assets/<int:asset_id>/attachments', methods=['POST'])
+@api_login_required
+# Attaches the raw request body, named by ?filename=; it is streamed to the blob store
+# without being read into memory. Answers 201, or 200 when the file was already attached.
+def upload_attachment(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    filename = request.args.get('filename')
+    if not filename:
+        abort(400, description='Name the file with ?filename=.')
+    if (request.content_length or 0) > current_app.config['ATTACHMENT_MAX_SIZE']:
+        abort(413)
+    try:
+        attachment, created = add_attachment(asset, request.stream, filename, request.mimetype, current_user)
+    except AttachmentTooLarge as exc:
+        abort(413, description=str(exc))
+    response = jsonify(attachment_to_dict(attachment))
+    response.headers['Location'] = url_for('api.get_attachment', attachment_id=attachment.id)
+    if created:
+        response.status_code = 201
+    return response
+
+
+@api.route('/attachments/<int:attachment_id>')
+@api_login_required
+def get_attachment(attachment_id):
+    return jsonify(attachment_to_dict(db.get_or_404(Attachment, attachment_id)))
+
+
+@api.route('/attachments/<int:attachment_id>/content')
+@api_login_required
+def get_attachment_content(attachment_id):
+    return send_attachment(db.get_or_404(Attachment, attachment_id), download=True)
+
+
+@api.route('/attachments/<int:attachment_id>', methods=['DELETE'])
+@api_login_required
+def delete_attachment(attachment_id):
+    attachment = db.get_or_404(Attachment, attachment_id)
+    if current_user.role != 'admin' and attachment.uploaded_by_id != current_user.id:
+        abort(403)
+    db.session.delete(attachment)
+    db.session.commit()
+    return '', 204
+
+
+@api.route('/facets')
+@api_login_required
+# Tag and attribute values with their asset counts, for building filters
+def get_facets():
+    return jsonify(facets=facet_summary(parse_filters(request.args)))
+
+
+@api.route('/reports/assets')
+@api_login_required
+# The report as of refreshed_at; 503 until the summaries are first built
+def get_asset_report():
+    report = asset_report()
+    if report is None:
+        abort(503, description='The report summaries have not been built yet.')
+    return jsonify(report)
+
+
+@api.route('/jobs/export', methods=['POST'])
+@api_login_required
+# Queues an export of the assets matching "filter" to a file; poll the job for its result
+def queue_export():
+    data = _json_body()
+    if not isinstance(data, dict):
+        abort(400, description='Expected a JSON object.')
+    fmt = data.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        abort(400, description='Unsupported export format: %s' % fmt)
+    raw = data.get('filter') or {}
+    if not isinstance(raw, dict):
+        abort(400, description='filter must be an object.')
+    filters = _filter_args(raw)
+    job = enqueue('export', {'filters': filters, 'format': fmt, 'gzip': bool(data.get('gzip')),
+                             'chunk_size': current_app.config['EXPORT_CHUNK_SIZE']}, user=current_user)
+    response = jsonify(job_to_dict(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.get_job', job_id=job.id)
+    return response
+
+
+@api.route('/jobs/report', methods=['POST'])
+@api_admin_required
+# Queues a refresh of the report summaries, or a rebuild with {"rebuild": true}
+def queue_report():
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        abort(400, description='Expected a JSON object.')
+    job = enqueue('report', {'rebuild': bool(data.get('rebuild'))}, user=current_user)
+    response = jsonify(job_to_dict(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.get_job', job_id=job.id)
+    return response
+
+
+def _visible_job(job_id):
+    job = db.get_or_404(Job, job_id)
+    if not can_view(job, current_user):
+        abort(404)
+    return job
+
+
+@api.route('/jobs/<int:job_id>')
+@api_login_required
+def get_job(job_id):
+    job = _visible_job(job_id)
+    data = job_to_dict(job)
+    if job.status == 'succeeded' and job.result_path:
+        data['result_url'] = url_for('api.get_job_result', job_id=job.id)
+    return jsonify(data)
+
+
+@api.route('/jobs/<int:job_id>/result')
+@api_login_required
+def get_job_result(job_id):
+    job = _visible_job(job_id)
+    path = result_file(job)
+    if job.status != 'succeeded' or path is None:
+        abort(404, description='This job has no result file.')
+    return send_file(path, as_attachment=True)
+
+
+def _change_cursor(value):
+    if value in (None, ''):
+        return 0
+    if value == 'latest':
+        return latest_cursor()
+    try:
+        cursor = int(value)
+    except ValueError:
+        abort(400, description='Invalid cursor.')
+    if cursor < 0:
+        abort(400, description='Invalid cursor.')
+    return cursor
+
+
+@api.route('/changes')
+@api_login_required
+# Returns asset changes after ?cursor= (0 for the whole log, "latest" for none). With
+# ?wait=N the request is held for up to N seconds until a change arrives (long-poll).
+def list_changes():
+    cursor = _change_cursor(request.args.get('cursor'))
+    limit = max(1, min(request.args.get('limit', 100, type=int), current_app.config['ASSETS_MAX_PER_PAGE']))
+    wait = max(0.0, min(request.args.get('wait', 0, type=float), current_app.config['CHANGE_FEED_MAX_WAIT']))
+    changes = wait_for_changes(cursor, limit, timeout=wait, poll_interval=current_app.config['CHANGE_FEED_POLL_INTERVAL'])
+    return jsonify(changes=[change_to_dict(change) for change in changes],
+                   next_cursor=changes[-1].id if changes else cursor,
+                   has_more=len(changes) == limit)
+
+
+@api.route('/changes/stream')
+@api_login_required
+# Server-Sent Events version of /changes. Each event's id is its cursor, so an
+# EventSource that reconnects resumes from Last-Event-ID. The stream ends after
+# CHANGE_FEED_STREAM_SECONDS and clients reconnect; 0, the default, turns it off.
+def stream_changes():
+    config = current_app.config
+    if not config['CHANGE_FEED_STREAM_SECONDS']:
+        abort(404, description='The change stream is turned off; poll /api/v1/changes instead.')
+    cursor = _change_cursor(request.headers.get('Last-Event-ID') or request.args.get('cursor'))
+
+    def events(cursor):
+        started = last_sent = time.monotonic()
+        yield 'retry: 2000\n\n'
+        while time.monotonic() - started < config['CHANGE_FEED_STREAM_SECONDS']:
+            remaining = config['CHANGE_FEED_STREAM_SECONDS'] - (time.monotonic() - started)
+            changes = wait_for_changes(cursor, 100, timeout=min(config['CHANGE_FEED_HEARTBEAT'], remaining),
+                                       poll_interval=config['CHANGE_FEED_POLL_INTERVAL'])
+            for change in changes:
+                cursor = change.id
+                yield 'id: %d\nevent: change\ndata: %s\n\n' % (change.id, json.dumps(change_to_dict(change)))
+            if changes:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= config['CHANGE_FEED_HEARTBEAT']:
+                # Comment line keeping proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            db.session.rollback()
+
+    response = Response(stream_with_context(events(cursor)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,143 +1,162 @@
-from flask import Flask, render_template, redirect, url_for, flash, abort
-from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from models import db, User, Asset
-from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
-from forms import RegistrationForm, LoginForm, AssetForm
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask import Flask
 from dotenv import load_dotenv
 import os
 
 # Load environment variables from .env file
 load_dotenv()
-app = Flask(__name__)
-# Set secret key for secure sessions
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_key')  
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///assets.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SESSION_COOKIE_SECURE'] = True  # Use HTTPS to securely transmit cookies
-app.config['SESSION_COOKIE_HTTPONLY'] = True  # Prevent JavaScript access to session cookies
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # Enforce SameSite policy to protect against CSRF
 
-# Initialize the database with the Flask app and enable migrations
-db.init_app(app)
-migrate = Migrate(app, db)
 
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+# Settings read from the environment; create_app(config) overrides them
+def env_config():
+    return {
+        # Set secret key for secure sessions
+        'SECRET_KEY': os.getenv('SECRET_KEY', 'default_key'),
+        'SQLALCHEMY_DATABASE_URI': os.getenv('DATABASE_URL', 'sqlite:///assets.db'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SESSION_COOKIE_SECURE': True,  # Use HTTPS to securely transmit cookies
+        'SESSION_COOKIE_HTTPONLY': True,  # Prevent JavaScript access to session cookies
+        'SESSION_COOKIE_SAMESITE': 'Lax',  # Enforce SameSite policy to protect against CSRF
+        'ASSETS_PER_PAGE': int(os.getenv('ASSETS_PER_PAGE', 50)),  # Default page size of the asset list
+        'ASSETS_MAX_PER_PAGE': int(os.getenv('ASSETS_MAX_PER_PAGE', 500)),  # Upper bound for ?per_page=
+        'STREAM_TEMPLATES': os.getenv('STREAM_TEMPLATES', '1') != '0',  # Stream the asset list pages as they render
+        # Engine profile (auto picks sqlite or postgres tuning from the URL, none keeps the defaults)
+        'DATABASE_PROFILE': os.getenv('DATABASE_PROFILE', 'auto'),
+        # Optional read replica used by the home page and asset list
+        'DATABASE_REPLICA_URL': os.getenv('DATABASE_REPLICA_URL'),
+        # Cached dashboard aggregates for the home page
+        'DASHBOARD_STATS_TTL': int(os.getenv('DASHBOARD_STATS_TTL', 300)),
+        'IMPORT_BATCH_SIZE': int(os.getenv('IMPORT_BATCH_SIZE', 5000)),  # Rows per INSERT transaction
+        'EXPORT_CHUNK_SIZE': int(os.getenv('EXPORT_CHUNK_SIZE', 5000)),  # Rows fetched per round trip
+        'BULK_CHUNK_SIZE': int(os.getenv('BULK_CHUNK_SIZE', 1000)),  # Rows per transaction of bulk delete/update
+        # Change feed long-poll and Server-Sent Events limits, in seconds. A waiting client holds
+        # a whole sync worker, so waits are short and the stream is off (0) by default; raise
+        # them only with threaded or gevent workers
+        'CHANGE_FEED_MAX_WAIT': int(os.getenv('CHANGE_FEED_MAX_WAIT', 5)),
+        'CHANGE_FEED_POLL_INTERVAL': float(os.getenv('CHANGE_FEED_POLL_INTERVAL', 1)),
+        'CHANGE_FEED_HEARTBEAT': int(os.getenv('CHANGE_FEED_HEARTBEAT', 15)),
+        'CHANGE_FEED_STREAM_SECONDS': int(os.getenv('CHANGE_FEED_STREAM_SECONDS', 0)),
+        # Request, SQL and template timings on /metrics, for admins only; SLOW_REQUEST_MS logs slow requests with their SQL
+        'METRICS_ENABLED': os.getenv('METRICS_ENABLED', '0') != '0',
+        'SLOW_REQUEST_MS': int(os.getenv('SLOW_REQUEST_MS', 0)),
+        # Password hashing algorithm and cost (e.g. scrypt:32768:8:1, pbkdf2:sha256:600000, argon2), and its thread pool
+        'PASSWORD_HASH_METHOD': os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1'),
+        'PASSWORD_HASH_WORKERS': int(os.getenv('PASSWORD_HASH_WORKERS', 2)),
+        'PASSWORD_HASH_QUEUE': int(os.getenv('PASSWORD_HASH_QUEUE', 16)),
+        # Logged-in user identities cached per worker, so page views skip the user table
+        'USER_CACHE_TTL': int(os.getenv('USER_CACHE_TTL', 300)),
+        # Token-bucket limits on login and registration attempts, shared by the workers of a host
+        'RATE_LIMIT_ENABLED': os.getenv('RATE_LIMIT_ENABLED', '1') != '0',
+        'RATE_LIMITS': {route: os.getenv('RATE_LIMIT_' + route.upper()) for route in ('login', 'register')
+                        if os.getenv('RATE_LIMIT_' + route.upper())},  # e.g. RATE_LIMIT_LOGIN='ip=20/minute,username=5/minute'
+        # Proxies in front of the app whose X-Forwarded-For to trust, so limits see client addresses
+        'PROXY_FIX_X_FOR': int(os.getenv('PROXY_FIX_X_FOR', 0)),
+        # Rows per chunk when report summaries are rebuilt or caught up with the change feed
+        'REPORT_CHUNK_SIZE': int(os.getenv('REPORT_CHUNK_SIZE', 50000)),
+        # Attachment files (default instance/attachments) and the largest upload accepted, in MB
+        'ATTACHMENT_DIR': os.getenv('ATTACHMENT_DIR'),
+        'ATTACHMENT_MAX_SIZE': int(os.getenv('ATTACHMENT_MAX_MB', 100)) * 1024 * 1024,
+        # Retired assets move from the asset table to asset_archive after this many days
+        'ARCHIVE_AFTER_DAYS': int(os.getenv('ARCHIVE_AFTER_DAYS', 30)),
+        # Attribute keys offered as filters on the asset list, with their values counted
+        'FACET_ATTRIBUTES': [key.strip() for key in os.getenv('FACET_ATTRIBUTES', 'location,category').split(',')
+                             if key.strip()],
+        # Rendered asset table rows cached per worker (0 turns it off), and optionally whole
+        # table pages, which other workers' changes reach only after PAGE_CACHE_TTL seconds
+        'FRAGMENT_CACHE_SIZE': int(os.getenv('FRAGMENT_CACHE_SIZE', 20000)),
+        'PAGE_CACHE_SIZE': int(os.getenv('PAGE_CACHE_SIZE', 0)),
+        'PAGE_CACHE_TTL': int(os.getenv('PAGE_CACHE_TTL', 30)),
+        # Online backfills: rows per batch, and the pause after each batch as a multiple of its duration
+        'BACKFILL_BATCH_SIZE': int(os.getenv('BACKFILL_BATCH_SIZE', 1000)),
+        'BACKFILL_THROTTLE': float(os.getenv('BACKFILL_THROTTLE', 1)),
+        # Background jobs: result files live under JOB_DIR (default instance/jobs)
+        'JOB_WORKER_PROCESSES': int(os.getenv('JOB_WORKER_PROCESSES', 2)),
+        'JOB_MAX_ATTEMPTS': int(os.getenv('JOB_MAX_ATTEMPTS', 3)),
+        # gzip/brotli compression of HTML and JSON responses
+        'COMPRESS_ENABLED': os.getenv('COMPRESS_ENABLED', '1') != '0',
+        'COMPRESS_LEVEL': int(os.getenv('COMPRESS_LEVEL', 6)),
+        # Content-hashed static URLs, cached by browsers for a year
+        'STATIC_FINGERPRINT': os.getenv('STATIC_FINGERPRINT', '1') != '0',
+    }
+
+
+# Builds the application. Models, views and extensions are imported here rather than at
+# module level, so importing app stays cheap and each test gets its own instance.
+def create_app(config=None):
+    from flask_migrate import Migrate
+    from models import db
+    from db_profiles import DatabaseProfiles
+    from stats import DashboardStats
+    from metrics import Metrics
+    from passwords import PasswordHasher
+    from user_cache import UserCache
+    from compression import Compression
+    from static_assets import StaticAssets
+    from jobs import JobQueue
+    from ratelimit import RateLimiter
+    from reports import Reports
+    from attachments import AttachmentStore
+    from backfill import Backfills
+    from archive import Archive
+    from facets import Facets
+    from fragments import FragmentCache
+    from auth import auth, login_manager
+    from assets import assets
+    from api import api
+    from cli import assets_cli, api_cli, changes_cli, static_cli, jobs_cli, reports_cli, attachments_cli, backfill_cli
+
+    app = Flask(__name__)
+    app.config.update(env_config())
+    app.config.update(config or {})
+
+    # Initialize the database with the Flask app and enable migrations
+    DatabaseProfiles(app, db)
+    Migrate(app, db)
+    DashboardStats(app)
+    Metrics(app)
+    PasswordHasher(app)
+    UserCache(app)
+    Compression(app)
+    StaticAssets(app)
+    JobQueue(app)
+    RateLimiter(app)
+    Reports(app)
+    AttachmentStore(app)
+    Backfills(app)
+    Archive(app)
+    Facets(app)
+    FragmentCache(app)
+    login_manager.init_app(app)
+
+    if app.config.get('PROXY_FIX_X_FOR'):
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+    app.register_blueprint(auth)
+    app.register_blueprint(assets)
+    app.register_blueprint(api)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(api_cli)
+    app.cli.add_command(changes_cli)
+    app.cli.add_command(static_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(reports_cli)
+    app.cli.add_command(attachments_cli)
+    app.cli.add_command(backfill_cli)
+    return app
+
+
+# `app` for `flask --app app`, gunicorn's app:app and scripts, built on first access
+def __getattr__(name):
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-@login_manager.user_loader
-# Function to load a user from the database by user ID
-def load_user(user_id):
-    return db.session.get(User, int(user_id))
-
-def admin_required(f):
-    # Decorator to require admin role for accessing certain views
-    @wraps(f)
-    @login_required
-    def decorated_function(*args, **kwargs):
-        if current_user.role != 'admin':
-            # Aborts with 403 Forbidden if the user is not an admin
-            abort(403)
-        return f(*args, **kwargs)
-    return decorated_function
-
-@app.route('/')
-@login_required
-# Home route showing the number of assets and the most recent asset
-def home():
-    total_assets = Asset.query.count()
-    recent_asset = Asset.query.order_by(Asset.date_created.desc()).first()
-    return render_template('index.html', total_assets=total_assets, recent_asset=recent_asset)
-
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    # Login route for user authentication
-    form = LoginForm()
-    if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
-        if user and check_password_hash(user.password, form.password.data):
-            login_user(user)
-            flash('Logged in successfully.', 'success')
-            return redirect(url_for('home'))
-        else:
-            flash('Invalid credentials.', 'danger')
-    return render_template('login.html', form=form)
-
-@app.route('/logout')
-@login_required
-# Route to log out the user
-def logout():
-    logout_user()
-    flash('Logged out successfully.', 'success')
-    return redirect(url_for('login'))
-
-@app.route('/register', methods=['GET', 'POST'])
-# Route for user registration
-def register():
-    form = RegistrationForm()
-    if form.validate_on_submit():
-        hashed_password = generate_password_hash(form.password.data, method='pbkdf2:sha256')
-        user = User(username=form.username.data, password=hashed_password, role='user')
-        db.session.add(user)
-        db.session.commit()
-        flash('Registration successful.', 'success')
-        return redirect(url_for('login'))
-    return render_template('register.html', form=form)
-
-@app.route('/assets/new', methods=['GET', 'POST'])
-@login_required
-# Route for creating a new asset
-def new_asset():
-    form = AssetForm()
-    if form.validate_on_submit():
-        # Check for existing asset name
-        existing_asset = Asset.query.filter_by(name=form.name.data).first()
-        if existing_asset:
-            flash('An asset with this name already exists. Please choose a different name.', 'warning')
-            return render_template('new_asset.html', form=form)
-
-        asset = Asset(name=form.name.data, description=form.description.data, owner_id=current_user.id, created_by=current_user.username)
-        db.session.add(asset)
-        db.session.commit()
-        flash('Asset created successfully.', 'success')
-        return redirect(url_for('list_assets'))
-    return render_template('new_asset.html', form=form)
-
-@app.route('/assets')
-@login_required
-# Route that lists all assets
-def list_assets():
-    assets = Asset.query.all()
-    return render_template('list_assets.html', assets=assets)
-
-@app.route('/assets/edit/<int:asset_id>', methods=['GET', 'POST'])
-@login_required
-# Route to edit an asset based on its id
-def edit_asset(asset_id):
-    asset = Asset.query.get_or_404(asset_id)
-    form = AssetForm(obj=asset, original_name=asset.name)  # Pass original_name to the form
-    if form.validate_on_submit():
-        asset.name = form.name.data
-        asset.description = form.description.data
-        db.session.commit()
-        flash('Asset updated successfully.', 'success')
-        return redirect(url_for('list_assets'))
-    return render_template('edit_asset.html', form=form)
-
-@app.route('/assets/delete/<int:asset_id>', methods=['POST'])
-@admin_required
-# Route to delete an asset; admin access required
-def delete_asset(asset_id):
-    asset = Asset.query.get_or_404(asset_id)
-    db.session.delete(asset)
-    db.session.commit()
-    flash('Asset deleted successfully.', 'success')
-    return redirect(url_for('list_assets'))
 
 if __name__ == "__main__":
+    from models import db, User
+    from werkzeug.security import generate_password_hash
+    app = create_app()
     with app.app_context():
         # Ensure tables exist
         db.create_all()
@@ -152,4 +171,4 @@ if __name__ == "__main__":
 
         db.session.commit()
     # Start the Flask app
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, Asset, ArchivedAsset, Attachment, is_name_conflict
+from changes import FIELDS, record_changes
+from owners import adjust_asset_counts, owner_deltas
+from facets import remove_facets, set_facets
+from pagination import keyset_page, union_keyset_page
+from search import apply_filters, sort_order
+
+# Hot/cold tiering of assets. Retiring an asset only stamps retired_at; it stays in the
+# asset list, marked as retired, and can be taken back. `flask assets archive` (run from
+# cron) then moves assets retired more than ARCHIVE_AFTER_DAYS ago to asset_archive,
+# ARCHIVE_CHUNK_SIZE rows per transaction, so the asset table and its indexes only hold
+# assets in use. Each move is logged as a delete on the change feed, and a restore as a
+# create, so owner counts, reports and feed consumers only ever count live assets.
+#
+# Attachment rows, tags and attributes are folded into the archived row as JSON (the
+# attachment files stay in the blob store, and the facet counts drop the asset); the
+# asset's FTS entries go with the deleted row through the triggers.
+# Listings take ?archived=include to page through both tables in one order, or
+# ?archived=only for the archive alone.
+
+COLUMNS = [Asset.id, Asset.version, Asset.retired_at] + [getattr(Asset, field) for field in FIELDS]
+
+ATTACHMENT_FIELDS = ('sha256', 'filename', 'content_type', 'size', 'uploaded_by_id', 'uploaded_at')
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+class Archive:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Retired assets can be taken back from the live list for this long
+        app.config.setdefault('ARCHIVE_AFTER_DAYS', 30)
+        app.config.setdefault('ARCHIVE_CHUNK_SIZE', 1000)
+        app.extensions['archive'] = self
+
+
+def retire_asset(asset):
+    if asset.retired_at is None:
+        asset.retired_at = datetime.utcnow()
+        db.session.commit()
+
+
+# Takes back a retirement that the archive mover has not acted on yet
+def unretire_asset(asset):
+    if asset.retired_at is not None:
+        asset.retired_at = None
+        db.session.commit()
+
+
+def _attachments_by_asset(ids):
+    attachments = {}
+    columns = [getattr(Attachment, field) for field in ATTACHMENT_FIELDS]
+    rows = db.session.execute(select(Attachment.asset_id, *columns).where(Attachment.asset_id.in_(ids))
+                              .order_by(Attachment.id))
+    for row in rows:
+        attachment = {field: getattr(row, field) for field in ATTACHMENT_FIELDS}
+        attachment['uploaded_at'] = attachment['uploaded_at'].isoformat()
+        attachments.setdefault(row.asset_id, []).append(attachment)
+    return attachments
+
+
+def _attribute_list(attributes):
+    if not attributes:
+        return None
+    # Key order matters: search.py matches '"key": ..., "value": ...' in the JSON text
+    return [{'key': key, 'value': value, 'kind': kind} for key, (value, kind) in sorted(attributes.items())]
+
+
+# Moves assets retired before `before` (default ARCHIVE_AFTER_DAYS ago) to the archive;
+# returns how many were moved, or would be on a dry run
+def archive_retired(before=None, chunk_size=None, dry_run=False):
+    config = current_app.config
+    before = before or datetime.utcnow() - timedelta(days=config['ARCHIVE_AFTER_DAYS'])
+    chunk_size = chunk_size or config['ARCHIVE_CHUNK_SIZE']
+    due = Asset.retired_at < before
+    if dry_run:
+        count = db.session.query(func.count(Asset.id)).filter(due).scalar()
+        db.session.rollback()
+        return count
+    moved = 0
+    try:
+        while True:
+            # Moved rows leave the table, so each chunk is simply the oldest retirements left
+            query = select(*COLUMNS).where(due).order_by(Asset.retired_at, Asset.id).limit(chunk_size)
+            rows = [row._asdict() for row in db.session.execute(query.with_for_update())]
+            if not rows:
+                break
+            ids = [row['id'] for row in rows]
+            attachments = _attachments_by_asset(ids)
+            tags, attributes = remove_facets(ids)
+            now = datetime.utcnow()
+            db.session.execute(insert(ArchivedAsset), [
+                dict({field: row[field] for field in FIELDS}, asset_id=row['id'], version=row['version'],
+                     retired_at=row['retired_at'], archived_at=now, attachments=attachments.get(row['id']),
+                     tags=sorted(tags[row['id']]) if row['id'] in tags else None,
+                     attributes=_attribute_list(attributes.get(row['id'])))
+                for row in rows
+            ])
+            db.session.execute(delete(Attachment).where(Attachment.asset_id.in_(ids))
+                               .execution_options(synchronize_session=False))
+            db.session.execute(delete(Asset).where(Asset.id.in_(ids)).execution_options(synchronize_session=False))
+            record_changes('delete', rows)
+            adjust_asset_counts(owner_deltas(rows, -1))
+            db.session.commit()
+            moved += len(rows)
+    finally:
+        db.session.rollback()
+    return moved
+
+
+# Moves an archived asset back into the asset table, with its attachments, tags and
+# attributes, and returns it. It keeps its old id unless a new asset has taken that id
+# meanwhile.
+def restore_archived(archived):
+    if db.session.query(Asset.id).filter_by(name=archived.name).first() is not None:
+        raise ArchiveError('An asset named "%s" already exists; rename it before restoring this one.' % archived.name)
+    row = {field: getattr(archived, field) for field in FIELDS}
+    # The version continues from the archived one, so clients holding an old ETag see a change
+    row.update(version=archived.version + 1, updated_at=datetime.utcnow(), retired_at=None)
+    if db.session.get(Asset, archived.asset_id) is None:
+        row['id'] = archived.asset_id
+    try:
+        result = db.session.execute(insert(Asset.__table__).values(**row))
+        row['id'] = result.inserted_primary_key[0]
+        if archived.attachments:
+            db.session.execute(insert(Attachment.__table__), [
+                dict(attachment, asset_id=row['id'], uploaded_at=datetime.fromisoformat(attachment['uploaded_at']))
+                for attachment in archived.attachments
+            ])
+        set_facets(row['id'], tags=archived.tags or [],
+                   attributes={attribute['key']: (attribute['value'], attribute['kind'])
+                               for attribute in archived.attributes or []})
+        db.session.execute(delete(ArchivedAsset).where(ArchivedAsset.id == archived.id)
+                           .execution_options(synchronize_session=False))
+        record_changes('create', [row])
+        adjust_asset_counts(owner_deltas([row]))
+        db.session.commit()
+    except IntegrityError as exc:
+        db.session.rollback()
+        if not is_name_conflict(exc):
+            raise
+        raise ArchiveError('An asset named "%s" already exists; rename it before restoring this one.' % archived.name)
+    return db.session.get(Asset, row['id'])
+
+
+# Sha256 of every attachment file an archived asset still refers to
+def archived_blobs():
+    blobs = set()
+    rows = db.session.execute(select(ArchivedAsset.attachments).where(ArchivedAsset.attachments.isnot(None))
+                              .execution_options(yield_per=1000))
+    for attachments, in rows:
+        blobs.update(attachment['sha256'] for attachment in attachments or ())
+    return blobs
+
+
+def _load(model, with_owner, with_facets):
+    query = model.query
+    if with_owner:
+        query = query.options(joinedload(model.owner))
+    if with_facets and model is Asset:
+        query = query.options(selectinload(Asset.tags), selectinload(Asset.attributes))
+    return query
+
+
+# One keyset page of assets matching filters, from the asset table, the archive or both
+# (see the archived filter in search.py). Archived rows are ArchivedAsset objects.
+# with_owner and with_facets load owners, tags and attributes along with the page.
+def asset_page(filters, cursor=None, per_page=50, with_owner=False, with_facets=False):
+    archived = filters.get('archived')
+    if archived != 'include':
+        model = ArchivedAsset if archived == 'only' else Asset
+        query = _load(model, with_owner, with_facets)
+        return keyset_page(apply_filters(query, filters, model), sort_order(filters, model), cursor=cursor,
+                           per_page=per_page)
+    models = (Asset, ArchivedAsset)
+    order = [(column.key, descending) for column, descending in sort_order(filters)]
+    selects = [apply_filters(select(*[getattr(model, key) for key, _ in order]), filters, model) for model in models]
+    rows, next_cursor = union_keyset_page(db.session, selects, order, cursor=cursor, per_page=per_page)
+    # The page's rows are loaded with one query per table
+    loaded = []
+    for source, model in enumerate(models):
+        ids = [row.id for row in rows if row.source == source]
+        query = _load(model, with_owner, with_facets)
+        loaded.append({obj.id: obj for obj in query.filter(model.id.in_(ids))} if ids else {})
+    return [loaded[row.source][row.id] for row in rows], next_cursor
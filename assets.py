@@ -0,0 +1,406 @@
+from datetime import datetime
+from flask import (Blueprint, render_template, redirect, url_for, flash, abort, request, current_app,
+                   get_flashed_messages, stream_template, Response, stream_with_context, jsonify, send_file)
+from flask_login import login_required, current_user
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from models import db, User, Asset, ArchivedAsset, Attachment, Job, is_name_conflict
+from forms import AssetForm, ImportForm, BulkActionForm, AttachmentForm
+from auth import admin_required
+from pagination import keyset_page, InvalidCursor
+from search import parse_filters
+from stats import get_stats
+from importer import import_assets, detect_format, ImportFailed
+from exporter import export_assets, ExportFailed, FORMATS as EXPORT_FORMATS
+from compression import gzip_stream
+from db_profiles import read_only
+from bulk import bulk_delete, bulk_reassign, bulk_set_description, BulkError
+from jobs import enqueue, enqueue_import, job_to_dict, can_view, result_file
+from reports import asset_report
+from attachments import (THUMBNAIL_SIZES, AttachmentTooLarge, add_attachment, send_attachment, make_thumbnail,
+                         is_image)
+from archive import ArchiveError, asset_page, retire_asset, unretire_asset, restore_archived
+from facets import set_facets, format_attribute_lines, facet_summary, toggle_filter
+from fragments import get_fragment_cache, filters_key
+
+# The home page and the asset pages: list, create, edit, delete, import and export
+assets = Blueprint('assets', __name__)
+
+# Renders a template as a generator so the response starts before the whole page is rendered
+# (STREAM_TEMPLATES = False renders the whole page first)
+def render_streamed(template_name, **context):
+    if not current_app.config['STREAM_TEMPLATES']:
+        return render_template(template_name, **context)
+    # Pop flashed messages now: the session cookie is written before a streamed body is generated
+    get_flashed_messages(with_categories=True)
+    # stream_template wraps the Jinja generator in stream_with_context
+    return stream_template(template_name, **context)
+
+@assets.route('/')
+@login_required
+@read_only
+# Home route showing asset totals, the most recent asset and per-owner/per-day counts
+def home():
+    stats = get_stats()
+    return render_template('index.html', total_assets=stats.total(), recent_asset=stats.recent(),
+                           top_owners=stats.top_owners_list(), daily_counts=stats.daily_series())
+
+@assets.route('/assets/new', methods=['GET', 'POST'])
+@login_required
+# Route for creating a new asset
+def new_asset():
+    form = AssetForm()
+    if form.validate_on_submit():
+        asset = Asset(name=form.name.data, description=form.description.data, owner_id=current_user.id, created_by=current_user.username)
+        db.session.add(asset)
+        # The unique index on asset.name is the real check; the form validator only
+        # catches the common case early, and a concurrent create can still race it
+        try:
+            db.session.flush()
+            set_facets(asset.id, tags=form.tags, attributes=form.attributes)
+            db.session.commit()
+        except IntegrityError as exc:
+            db.session.rollback()
+            if not is_name_conflict(exc):
+                raise
+            flash('An asset with this name already exists. Please choose a different name.', 'warning')
+            return render_template('new_asset.html', form=form)
+        flash('Asset created successfully.', 'success')
+        return redirect(url_for('assets.list_assets'))
+    return render_template('new_asset.html', form=form)
+
+# Page size from ?per_page=, clamped to ASSETS_MAX_PER_PAGE
+def _per_page():
+    per_page = request.args.get('per_page', current_app.config['ASSETS_PER_PAGE'], type=int)
+    return max(1, min(per_page, current_app.config['ASSETS_MAX_PER_PAGE']))
+
+# The rendered rows and next cursor of the requested page, from the fragment cache
+def _asset_rows(filters, per_page, bulk=False, selected=()):
+    cursor = request.args.get('cursor')
+    def load():
+        try:
+            return asset_page(filters, cursor=cursor, per_page=per_page, with_owner=True, with_facets=True)
+        except InvalidCursor:
+            abort(400)
+    return get_fragment_cache().page((filters_key(filters), cursor, per_page), load, current_user.role,
+                                     bulk=bulk, selected=selected)
+
+@assets.route('/assets')
+@login_required
+@read_only
+# Route that lists assets one keyset page at a time, with optional search, filters and sort,
+# and the tag and attribute facets with their precomputed counts
+def list_assets():
+    return _render_list(BulkActionForm() if current_user.role == 'admin' else None)
+
+def _render_list(bulk_form, selected=()):
+    per_page = _per_page()
+    filters = parse_filters(request.args)
+    rows, next_cursor = _asset_rows(filters, per_page, bulk=bulk_form is not None, selected=set(selected))
+    return render_streamed('list_assets.html', rows=rows, next_cursor=next_cursor, is_first_page=not request.args.get('cursor'),
+                           per_page=per_page, filters=filters, page_args=filters, bulk_form=bulk_form,
+                           facets=facet_summary(filters), toggle_filter=toggle_filter)
+
+@assets.route('/assets/bulk', methods=['POST'])
+@admin_required
+# Route applying one action to the checked assets, or to all assets matching the list filters
+# carried in the query string. Preview reports what would change and keeps the selection.
+def bulk_assets():
+    form = BulkActionForm()
+    filters = parse_filters(request.args)
+    ids = request.form.getlist('ids', type=int)
+    if not form.validate_on_submit():
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error, 'danger')
+        return _render_list(form, ids)
+    selection = {'ids': ids, 'filters': None} if form.scope.data == 'selected' else {'ids': None, 'filters': filters}
+    if form.scope.data == 'selected' and not ids:
+        flash('Select at least one asset.', 'warning')
+        return _render_list(form, ids)
+    dry_run = form.preview.data
+    chunk_size = current_app.config['BULK_CHUNK_SIZE']
+    try:
+        if form.action.data == 'delete':
+            result = bulk_delete(dry_run=dry_run, chunk_size=chunk_size, **selection)
+        elif form.action.data == 'reassign':
+            result = bulk_reassign(form.owner_id.data, dry_run=dry_run, chunk_size=chunk_size, **selection)
+        else:
+            result = bulk_set_description(form.description.data, dry_run=dry_run, chunk_size=chunk_size, **selection)
+    except BulkError as exc:
+        flash(str(exc), 'danger')
+        return _render_list(form, ids)
+    if dry_run:
+        flash(result.summary(), 'info')
+        return _render_list(form, ids)
+    flash(result.summary(), 'success')
+    return redirect(url_for('assets.list_assets', **filters))
+
+@assets.route('/owners')
+@login_required
+@read_only
+# Route listing users by the number of assets they own, read from the denormalised User.asset_count
+def owners():
+    per_page = _per_page()
+    try:
+        users, next_cursor = keyset_page(User.query, [(User.asset_count, True), (User.id, False)],
+                                         cursor=request.args.get('cursor'), per_page=per_page)
+    except InvalidCursor:
+        abort(400)
+    return render_template('owners.html', users=users, next_cursor=next_cursor,
+                           is_first_page=not request.args.get('cursor'), per_page=per_page)
+
+@assets.route('/owners/<int:user_id>')
+@login_required
+@read_only
+# Route listing the assets one user owns
+def owner_assets(user_id):
+    owner = db.get_or_404(User, user_id)
+    return _render_owner_assets(owner, page_args={'user_id': owner.id})
+
+@assets.route('/assets/mine')
+@login_required
+@read_only
+# Route listing the assets the logged-in user owns
+def my_assets():
+    owner = db.session.get(User, current_user.id)
+    return _render_owner_assets(owner, page_args={})
+
+def _render_owner_assets(owner, page_args):
+    per_page = _per_page()
+    filters = parse_filters(request.args)
+    filters['owner_id'] = owner.id
+    rows, next_cursor = _asset_rows(filters, per_page)
+    # The owner filter is part of the URL already
+    page_args = dict({key: value for key, value in filters.items() if key != 'owner_id'}, **page_args)
+    return render_streamed('owner_assets.html', owner=owner, rows=rows, next_cursor=next_cursor,
+                           is_first_page=not request.args.get('cursor'), per_page=per_page, filters=filters,
+                           page_args=page_args)
+
+@assets.route('/reports')
+@login_required
+# Route showing asset reports as of the last summary refresh
+def reports():
+    return render_template('reports.html', report=asset_report())
+
+@assets.route('/assets/import', methods=['GET', 'POST'])
+@admin_required
+# Route for importing assets in bulk from an uploaded CSV, JSON or NDJSON file; admin access required
+def bulk_import():
+    form = ImportForm()
+    result = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        if form.background.data:
+            job = enqueue_import(upload, detect_format(upload.filename), current_user,
+                                 batch_size=current_app.config['IMPORT_BATCH_SIZE'])
+            flash('The import was queued.', 'info')
+            return redirect(url_for('assets.job_status', job_id=job.id))
+        try:
+            # The upload is parsed straight from werkzeug's spooled temporary file
+            result = import_assets(upload.stream, detect_format(upload.filename), current_user,
+                                   batch_size=current_app.config['IMPORT_BATCH_SIZE'])
+        except ImportFailed as exc:
+            flash(str(exc), 'danger')
+        else:
+            flash(result.summary(), 'success' if not result.failed else 'warning')
+    return render_template('import_assets.html', form=form, result=result)
+
+@assets.route('/assets/export')
+@login_required
+# Route that streams the assets matching the list filters as CSV, NDJSON, Parquet or Arrow
+def export_assets_file():
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', type=int) == 1
+    if request.args.get('background', type=int) == 1:
+        # Written to a file by a worker; the job page offers it for download when done
+        if fmt not in EXPORT_FORMATS:
+            abort(400, description='Unsupported export format: %s' % fmt)
+        job = enqueue('export', {'filters': parse_filters(request.args), 'format': fmt, 'gzip': compress,
+                                 'chunk_size': current_app.config['EXPORT_CHUNK_SIZE']}, user=current_user)
+        flash('The export was queued.', 'info')
+        return redirect(url_for('assets.job_status', job_id=job.id))
+    try:
+        chunks = export_assets(parse_filters(request.args), fmt, chunk_size=current_app.config['EXPORT_CHUNK_SIZE'])
+    except ExportFailed as exc:
+        abort(400, description=str(exc))
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = 'assets-%s.%s' % (datetime.utcnow().strftime('%Y%m%d-%H%M%S'), extension)
+    if compress:
+        chunks, mimetype, filename = gzip_stream(chunks), 'application/gzip', filename + '.gz'
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+@assets.route('/assets/edit/<int:asset_id>', methods=['GET', 'POST'])
+@login_required
+# Route to edit an asset based on its id
+def edit_asset(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    form = AssetForm(obj=asset, original_name=asset.name)  # Pass original_name to the form
+    if not form.is_submitted():
+        form.tag_list.data = ', '.join(tag.name for tag in asset.tags)
+        form.attribute_lines.data = format_attribute_lines(asset.attributes)
+    if form.validate_on_submit():
+        asset.name = form.name.data
+        asset.description = form.description.data
+        # Tags and attributes are rows of their own; touching updated_at still gives the
+        # asset a new version, so cached copies and API ETags notice the change
+        if set_facets(asset.id, tags=form.tags, attributes=form.attributes):
+            asset.updated_at = datetime.utcnow()
+        try:
+            db.session.commit()
+        except IntegrityError as exc:
+            db.session.rollback()
+            if not is_name_conflict(exc):
+                raise
+            flash('An asset with this name already exists. Please choose a different name.', 'warning')
+            return render_template('edit_asset.html', form=form, asset_id=asset_id)
+        except StaleDataError:
+            # Saved by someone else since this request loaded it; the form keeps what was typed
+            db.session.rollback()
+            flash('This asset was changed by someone else while you were editing it. '
+                  'Check it and save again.', 'warning')
+            return render_template('edit_asset.html', form=form, asset_id=asset_id)
+        flash('Asset updated successfully.', 'success')
+        return redirect(url_for('assets.list_assets'))
+    return render_template('edit_asset.html', form=form, asset_id=asset.id)
+
+@assets.route('/assets/delete/<int:asset_id>', methods=['POST'])
+@admin_required
+# Route to delete an asset; admin access required
+def delete_asset(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    db.session.delete(asset)
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        flash('This asset was changed by someone else meanwhile and was not deleted.', 'warning')
+        return redirect(url_for('assets.list_assets'))
+    flash('Asset deleted successfully.', 'success')
+    return redirect(url_for('assets.list_assets'))
+
+@assets.route('/assets/<int:asset_id>/retire', methods=['POST'])
+@admin_required
+# Route marking an asset as retired; it moves to the archive once ARCHIVE_AFTER_DAYS have passed
+def retire(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    retire_asset(asset)
+    flash('Asset retired. It will be moved to the archive after %d days.' % current_app.config['ARCHIVE_AFTER_DAYS'],
+          'success')
+    return redirect(url_for('assets.list_assets'))
+
+@assets.route('/assets/<int:asset_id>/unretire', methods=['POST'])
+@admin_required
+# Route taking back the retirement of an asset that is not archived yet
+def unretire(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    unretire_asset(asset)
+    flash('Asset is back in use.', 'success')
+    return redirect(url_for('assets.list_assets'))
+
+@assets.route('/archive/<int:archive_id>/restore', methods=['POST'])
+@admin_required
+# Route moving an archived asset back into the asset list, with its attachments
+def restore(archive_id):
+    archived = db.get_or_404(ArchivedAsset, archive_id)
+    try:
+        restore_archived(archived)
+    except ArchiveError as exc:
+        flash(str(exc), 'danger')
+        return redirect(url_for('assets.list_assets', archived='only'))
+    flash('Asset restored.', 'success')
+    return redirect(url_for('assets.list_assets'))
+
+@assets.route('/assets/<int:asset_id>/attachments', methods=['GET', 'POST'])
+@login_required
+# Route listing an asset's attachments and uploading new ones; the upload is copied to the
+# blob store in chunks, so large files never sit in worker memory
+def asset_attachments(asset_id):
+    asset = db.get_or_404(Asset, asset_id)
+    limit = current_app.config['ATTACHMENT_MAX_SIZE']
+    # Refused before the multipart body is parsed; a little is allowed for the form fields
+    if request.method == 'POST' and (request.content_length or 0) > limit + 64 * 1024:
+        abort(413)
+    form = AttachmentForm()
+    if form.validate_on_submit():
+        upload = form.file.data
+        try:
+            attachment, created = add_attachment(asset, upload.stream, upload.filename, upload.mimetype, current_user)
+        except AttachmentTooLarge as exc:
+            flash(str(exc), 'danger')
+        else:
+            if created:
+                flash('Attached %s.' % attachment.filename, 'success')
+            else:
+                flash('This file is already attached as %s.' % attachment.filename, 'info')
+            return redirect(url_for('assets.asset_attachments', asset_id=asset.id))
+    return render_template('attachments.html', asset=asset, form=form, attachments=asset.attachments,
+                           is_image=is_image)
+
+@assets.route('/attachments/<int:attachment_id>')
+@login_required
+# Route sending an attachment; images, PDFs and text open in the browser unless ?download=1
+def attachment_file(attachment_id):
+    attachment = db.get_or_404(Attachment, attachment_id)
+    return send_attachment(attachment, download=request.args.get('download', type=int) == 1)
+
+@assets.route('/attachments/<int:attachment_id>/thumbnail/<int:size>')
+@login_required
+# Route sending a PNG thumbnail of an image attachment, rendered on first request
+def attachment_thumbnail(attachment_id, size):
+    attachment = db.get_or_404(Attachment, attachment_id)
+    path = make_thumbnail(attachment, size) if size in THUMBNAIL_SIZES else None
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype='image/png', etag='%s-%d' % (attachment.sha256, size), conditional=True,
+                         max_age=current_app.config['ATTACHMENT_MAX_AGE'])
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
+
+@assets.route('/attachments/<int:attachment_id>/delete', methods=['POST'])
+@login_required
+# Route removing an attachment; admins and the uploader may do this. The file itself is
+# deleted by `flask attachments gc` once nothing refers to it.
+def delete_attachment(attachment_id):
+    attachment = db.get_or_404(Attachment, attachment_id)
+    if current_user.role != 'admin' and attachment.uploaded_by_id != current_user.id:
+        abort(403)
+    asset_id = attachment.asset_id
+    db.session.delete(attachment)
+    db.session.commit()
+    flash('Attachment removed.', 'success')
+    return redirect(url_for('assets.asset_attachments', asset_id=asset_id))
+
+# Loads a job the current user may see, or 404s (other users' jobs are not revealed)
+def _visible_job(job_id):
+    job = db.get_or_404(Job, job_id)
+    if not can_view(job, current_user):
+        abort(404)
+    return job
+
+@assets.route('/jobs/<int:job_id>')
+@login_required
+# Route showing a background job's progress; the page refreshes itself until the job ends
+def job_status(job_id):
+    job = _visible_job(job_id)
+    return render_template('job.html', job=job, info=job_to_dict(job))
+
+@assets.route('/jobs/<int:job_id>.json')
+@login_required
+# Route returning a background job's status for polling scripts
+def job_status_json(job_id):
+    return jsonify(job_to_dict(_visible_job(job_id)))
+
+@assets.route('/jobs/<int:job_id>/result')
+@login_required
+# Route downloading the file a finished background job produced
+def job_result(job_id):
+    job = _visible_job(job_id)
+    path = result_file(job)
+    if job.status != 'succeeded' or path is None:
+        abort(404)
+    return send_file(path, as_attachment=True)
+
@@ -0,0 +1,215 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+import time
+from flask import current_app, send_file, abort
+from sqlalchemy.exc import IntegrityError
+from models import db, Attachment
+from archive import archived_blobs
+
+# Files attached to assets. Content is stored once per SHA-256 under
+# ATTACHMENT_DIR/blobs/ab/cd/<sha256>: an upload is copied to a temporary file in
+# fixed-size chunks while it is hashed, then renamed into place (or dropped when that
+# content is already stored). Files are sent with send_file, which hands them to the
+# server's sendfile and answers Range and If-None-Match requests. Image thumbnails are
+# made with Pillow on first request and kept under ATTACHMENT_DIR/thumbnails/. Blobs no
+# attachment refers to any more are removed by `flask attachments gc`.
+
+CHUNK_SIZE = 1024 * 1024
+
+THUMBNAIL_SIZES = (128, 256, 512)
+
+# Types shown in the browser; everything else is downloaded, so uploaded HTML or SVG
+# can't run script in the application's origin
+INLINE_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'application/pdf', 'text/plain')
+IMAGE_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff')
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+class AttachmentStore:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('ATTACHMENT_DIR'):
+            app.config['ATTACHMENT_DIR'] = os.path.join(app.instance_path, 'attachments')
+        app.config.setdefault('ATTACHMENT_MAX_SIZE', 100 * 1024 * 1024)
+        # Browsers may reuse a downloaded attachment this long; its URL never changes content
+        app.config.setdefault('ATTACHMENT_MAX_AGE', 30 * 24 * 3600)
+        app.extensions['attachments'] = self
+
+
+def _root(*parts):
+    return os.path.join(current_app.config['ATTACHMENT_DIR'], *parts)
+
+
+def blob_path(sha256):
+    return _root('blobs', sha256[:2], sha256[2:4], sha256)
+
+
+def thumbnail_path(sha256, size):
+    return _root('thumbnails', sha256[:2], '%s-%d.png' % (sha256, size))
+
+
+# Copies stream into the blob store a chunk at a time; returns (sha256, size). Raises
+# AttachmentTooLarge once more than max_size bytes have been read.
+def store_blob(stream, max_size=None):
+    max_size = max_size or current_app.config['ATTACHMENT_MAX_SIZE']
+    directory = _root('tmp')
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise AttachmentTooLarge('Attachments can be at most %d MB.' % (max_size // (1024 * 1024)))
+                digest.update(chunk)
+                f.write(chunk)
+        sha256 = digest.hexdigest()
+        path = blob_path(sha256)
+        if os.path.exists(path):
+            # Already stored; touching it keeps the garbage collector's grace period fair
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp, path)
+            temp = None
+        return sha256, size
+    finally:
+        if temp is not None:
+            os.remove(temp)
+
+
+def guess_type(filename, declared=None):
+    guessed = mimetypes.guess_type(filename)[0]
+    content_type = guessed or declared or 'application/octet-stream'
+    return content_type.split(';')[0].strip().lower()[:100]
+
+
+def clean_filename(filename):
+    name = os.path.basename((filename or '').replace('\\', '/')).strip()
+    return name[:255] or 'attachment'
+
+
+# Stores the content of stream and attaches it to asset; returns (attachment, created).
+# A file the asset already has is not attached twice.
+def add_attachment(asset, stream, filename, content_type=None, user=None):
+    sha256, size = store_blob(stream)
+    existing = Attachment.query.filter_by(asset_id=asset.id, sha256=sha256).first()
+    if existing is not None:
+        return existing, False
+    filename = clean_filename(filename)
+    attachment = Attachment(asset_id=asset.id, sha256=sha256, filename=filename, size=size,
+                            content_type=guess_type(filename, content_type), uploaded_by_id=user.id if user else None)
+    db.session.add(attachment)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same file was attached by a concurrent request
+        db.session.rollback()
+        return Attachment.query.filter_by(asset_id=asset.id, sha256=sha256).one(), False
+    return attachment, True
+
+
+def attachment_to_dict(attachment):
+    return {
+        'id': attachment.id,
+        'asset_id': attachment.asset_id,
+        'filename': attachment.filename,
+        'content_type': attachment.content_type,
+        'size': attachment.size,
+        'sha256': attachment.sha256,
+        'uploaded_at': attachment.uploaded_at.isoformat(),
+        'is_image': is_image(attachment),
+    }
+
+
+def is_image(attachment):
+    return attachment.content_type in IMAGE_TYPES
+
+
+# Response sending an attachment's content; Range, If-None-Match and If-Modified-Since
+# are answered by send_file
+def send_attachment(attachment, download=False):
+    path = blob_path(attachment.sha256)
+    if not os.path.exists(path):
+        abort(404)
+    inline = not download and attachment.content_type in INLINE_TYPES
+    response = send_file(path, mimetype=attachment.content_type, as_attachment=not inline,
+                         download_name=attachment.filename, etag=attachment.sha256, conditional=True,
+                         max_age=current_app.config['ATTACHMENT_MAX_AGE'])
+    response.cache_control.private = True
+    response.cache_control.public = False
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = "sandbox; default-src 'none'; img-src 'self'; style-src 'unsafe-inline'"
+    return response
+
+
+# Path of a thumbnail at most size pixels wide and high, made on first use. None when the
+# attachment is not an image Pillow can read.
+def make_thumbnail(attachment, size):
+    path = thumbnail_path(attachment.sha256, size)
+    if os.path.exists(path):
+        return path
+    if not is_image(attachment):
+        return None
+    from PIL import Image, ImageOps
+    try:
+        with Image.open(blob_path(attachment.sha256)) as image:
+            # JPEG decoding at a reduced scale keeps large photos from being expanded in full
+            image.draft('RGB', (size, size))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                image = image.convert('RGBA')
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, 'PNG', optimize=True)
+        # Concurrent requests may both render it; the last rename wins with identical content
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+    return path
+
+
+# Deletes blobs and thumbnails no attachment refers to, counting the attachments kept with
+# archived assets. Files younger than grace seconds are kept, as their attachment row may
+# not be committed yet. Returns the blobs removed.
+def collect_garbage(grace=3600):
+    referenced = {sha256 for sha256, in db.session.query(Attachment.sha256).distinct()}
+    referenced |= archived_blobs()
+    cutoff = time.time() - grace
+    removed = 0
+    for folder, unused_dirs, files in os.walk(_root('blobs')):
+        for name in files:
+            path = os.path.join(folder, name)
+            if name not in referenced and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+    for folder, unused_dirs, files in os.walk(_root('thumbnails')):
+        for name in files:
+            if name.split('-')[0] not in referenced:
+                os.remove(os.path.join(folder, name))
+    for folder, unused_dirs, files in os.walk(_root('tmp')):
+        for name in files:
+            path = os.path.join(folder, name)
+            # Left behind by an upload whose worker died
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+    return removed
@@ -0,0 +1,105 @@
+import math
+from functools import wraps
+from flask import Blueprint, render_template, redirect, url_for, flash, abort
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+from models import db, User
+from forms import RegistrationForm, LoginForm
+from passwords import HashingBusy, get_hasher
+from ratelimit import get_rate_limiter
+from user_cache import get_user_cache
+from api import authenticate_token
+
+# Login, logout and registration, plus the Flask-Login setup shared by every blueprint
+auth = Blueprint('auth', __name__)
+
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
+
+@login_manager.user_loader
+# Function to load a user by user ID, from the per-worker identity cache when possible
+def load_user(user_id):
+    return get_user_cache().load(int(user_id))
+
+@login_manager.request_loader
+# Authenticates API requests from an "Authorization: Bearer <token>" header, without a session
+def load_user_from_token(request):
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and token:
+        return authenticate_token(token.strip())
+    return None
+
+def admin_required(f):
+    # Decorator to require admin role for accessing certain views
+    @wraps(f)
+    @login_required
+    def decorated_function(*args, **kwargs):
+        if current_user.role != 'admin':
+            # Aborts with 403 Forbidden if the user is not an admin
+            abort(403)
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Answers 503 when too many passwords are already being hashed, asking the client to retry shortly
+def busy(template_name, **context):
+    flash('The server is busy. Please try again in a few seconds.', 'warning')
+    return render_template(template_name, **context), 503, {'Retry-After': '5'}
+
+# Answers 429 to a client over its rate limit; checked before the form, so no hashing happens
+def throttled(retry_after, template_name, **context):
+    flash('Too many attempts. Please try again in %d seconds.' % math.ceil(retry_after), 'danger')
+    return render_template(template_name, **context), 429, {'Retry-After': str(math.ceil(retry_after))}
+
+@auth.route('/login', methods=['GET', 'POST'])
+def login():
+    # Login route for user authentication
+    form = LoginForm()
+    if form.is_submitted():
+        retry_after = get_rate_limiter().hit('login', username=form.username.data)
+        if retry_after:
+            return throttled(retry_after, 'login.html', form=form)
+    if form.validate_on_submit():
+        user = User.query.filter_by(username=form.username.data).first()
+        hasher = get_hasher()
+        try:
+            password_ok = user is not None and hasher.verify(user.password, form.password.data)
+            if password_ok and hasher.needs_rehash(user.password):
+                # Upgrade hashes made with older settings while the plain password is at hand
+                user.password = hasher.hash(form.password.data)
+                db.session.commit()
+        except HashingBusy:
+            return busy('login.html', form=form)
+        if password_ok:
+            login_user(user)
+            flash('Logged in successfully.', 'success')
+            return redirect(url_for('assets.home'))
+        else:
+            flash('Invalid credentials.', 'danger')
+    return render_template('login.html', form=form)
+
+@auth.route('/logout')
+@login_required
+# Route to log out the user
+def logout():
+    logout_user()
+    flash('Logged out successfully.', 'success')
+    return redirect(url_for('auth.login'))
+
+@auth.route('/register', methods=['GET', 'POST'])
+# Route for user registration
+def register():
+    form = RegistrationForm()
+    if form.is_submitted():
+        retry_after = get_rate_limiter().hit('register', username=form.username.data)
+        if retry_after:
+            return throttled(retry_after, 'register.html', form=form)
+    if form.validate_on_submit():
+        try:
+            hashed_password = get_hasher().hash(form.password.data)
+        except HashingBusy:
+            return busy('register.html', form=form)
+        user = User(username=form.username.data, password=hashed_password, role='user')
+        db.session.add(user)
+        db.session.commit()
+        flash('Registration successful.', 'success')
+        return redirect(url_for('auth.login'))
+    return render_template('register.html', form=form)
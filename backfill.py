@@ -0,0 +1,306 @@
+import time
+from collections import Counter
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func, select, text, update
+from sqlalchemy.exc import OperationalError
+from models import db, User, Asset, BackfillCheckpoint
+from changes import FIELDS, record_changes
+from owners import adjust_asset_counts
+
+# Data backfills that run while the application serves traffic. A backfill walks its
+# table in primary key order, batch_size rows at a time, and each batch is one short
+# transaction holding the row updates and the checkpoint, so locks are held briefly and
+# an interrupted run resumes after the last committed batch. Between batches the runner
+# sleeps, for at least `sleep` seconds and for `throttle` times as long as the batch
+# took, which leaves the database to the application when it is busy. A dry run reads
+# the same batches and reports what would change without writing.
+#
+# Schema changes follow expand/backfill/contract: a migration adds the column as
+# nullable, the application starts writing it, `flask backfill run NAME` fills the
+# existing rows, and a later migration calls ensure_backfilled(NAME) before it adds
+# the NOT NULL constraint.
+
+# name -> Backfill
+BACKFILLS = {}
+
+# Failed batches (lock timeouts, SQLite busy errors) are retried this many times
+RETRIES = 5
+
+
+class BackfillError(Exception):
+    pass
+
+
+class Backfills:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BACKFILL_BATCH_SIZE', 1000)
+        app.config.setdefault('BACKFILL_SLEEP', 0.0)
+        # Pause after each batch for this many times as long as the batch took
+        app.config.setdefault('BACKFILL_THROTTLE', 1.0)
+        app.config.setdefault('BACKFILL_LOCK_TIMEOUT_MS', 2000)
+        app.extensions['backfills'] = self
+
+
+class Backfill:
+    def __init__(self, name, model, fn, columns, where=None, log_changes=False, description=None):
+        self.name = name
+        self.model = model
+        self.fn = fn
+        self.columns = columns
+        self.where = where
+        # Asset backfills that change what the change feed shows bump versions and log changes
+        self.log_changes = log_changes
+        self.description = description or (fn.__doc__ or '').strip()
+
+
+# Registers fn(rows) as a backfill of model. rows are dicts of the given columns (plus
+# the primary key) for one batch; fn returns {'id': ..., column: new value, ...} for the
+# rows to change. where limits the rows visited, e.g. Asset.created_by.is_(None).
+def backfill(name, model, columns=(), where=None, log_changes=False, description=None):
+    def register(fn):
+        BACKFILLS[name] = Backfill(name, model, fn, list(columns), where, log_changes, description)
+        return fn
+    return register
+
+
+class BackfillResult:
+    def __init__(self, name, dry_run, total):
+        self.name = name
+        self.dry_run = dry_run
+        self.total = total  # rows left to visit when the run started, an estimate
+        self.seen = 0
+        self.changed = 0
+        self.batches = 0
+        self.last_id = 0
+        self.finished = False
+        self.started = time.monotonic()
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.seen / elapsed if elapsed > 0 else 0.0
+
+    # Seconds left at the current rate, when it can be told
+    @property
+    def eta(self):
+        if not self.rate or self.total is None:
+            return None
+        return max(self.total - self.seen, 0) / self.rate
+
+    def summary(self):
+        done = 'Would change' if self.dry_run else 'Changed'
+        state = 'finished' if self.finished else 'stopped after id %d' % self.last_id
+        return '%s %d of %d rows in %d batches (%s).' % (done, self.changed, self.seen, self.batches, state)
+
+    def to_dict(self):
+        return {'name': self.name, 'dry_run': self.dry_run, 'total': self.total, 'seen': self.seen,
+                'changed': self.changed, 'batches': self.batches, 'last_id': self.last_id,
+                'finished': self.finished}
+
+
+def get_backfill(name):
+    try:
+        return BACKFILLS[name]
+    except KeyError:
+        raise BackfillError('Unknown backfill: %s' % name) from None
+
+
+def _checkpoint(name, restart):
+    checkpoint = db.session.get(BackfillCheckpoint, name)
+    now = datetime.utcnow()
+    if checkpoint is None:
+        checkpoint = BackfillCheckpoint(name=name, last_id=0, rows_seen=0, rows_changed=0, started_at=now, updated_at=now)
+        db.session.add(checkpoint)
+    elif restart:
+        checkpoint.last_id, checkpoint.rows_seen, checkpoint.rows_changed = 0, 0, 0
+        checkpoint.started_at, checkpoint.updated_at, checkpoint.finished_at = now, now, None
+    db.session.commit()
+    return checkpoint
+
+
+def _batch(spec, last_id, batch_size, lock=False):
+    pk = spec.model.__table__.c.id
+    columns = [pk] + [column for column in spec.columns if column.key != 'id']
+    if spec.log_changes:
+        columns += [spec.model.__table__.c[key] for key in FIELDS + ('version',)
+                    if key not in {column.key for column in columns}]
+    query = select(*columns).where(pk > last_id)
+    if spec.where is not None:
+        query = query.where(spec.where)
+    query = query.order_by(pk).limit(batch_size)
+    if lock:
+        # Rows stay locked until the batch commits, so application writes in between can't
+        # be overwritten (SQLite is already locked by the checkpoint write)
+        query = query.with_for_update()
+    return [row._asdict() for row in db.session.execute(query)]
+
+
+def rows_by_id(rows):
+    return {row['id']: row for row in rows}
+
+
+# The values of change that differ from row
+def _diff(row, change):
+    return {key: value for key, value in change.items() if key != 'id' and (key not in row or row[key] != value)}
+
+
+# Writes one batch of changes; returns the rows that actually changed
+def _apply(spec, rows, changes):
+    by_id = rows_by_id(rows)
+    table = spec.model.__table__
+    changed = []
+    for change in changes:
+        row = by_id[change['id']]
+        values = _diff(row, change)
+        if values:
+            changed.append((row, values))
+    now = datetime.utcnow()
+    # executemany needs the same columns in every row, so rows are grouped by the columns they set
+    groups = {}
+    for row, values in changed:
+        groups.setdefault(tuple(sorted(values)), []).append(dict({'b_' + key: value for key, value in values.items()},
+                                                                 b_id=row['id']))
+    for keys, params in groups.items():
+        statement = update(table).where(table.c.id == db.bindparam('b_id')).values(
+            {key: db.bindparam('b_' + key) for key in keys})
+        if spec.log_changes:
+            statement = statement.values(version=table.c.version + 1, updated_at=now)
+        db.session.execute(statement.execution_options(synchronize_session=False), params)
+    if spec.log_changes and changed:
+        deltas = Counter()
+        logged = []
+        for row, values in changed:
+            diff = {key: [row.get(key), value] for key, value in values.items()}
+            logged.append(dict(row, version=row['version'] + 1, updated_at=now, changes=diff, **values))
+            if 'owner_id' in diff:
+                deltas[row['owner_id']] -= 1
+                deltas[values['owner_id']] += 1
+        record_changes('update', logged)
+        adjust_asset_counts(deltas)
+    return len(changed)
+
+
+def _lock_timeout():
+    # On PostgreSQL a batch gives up on a row lock the application holds rather than queue
+    # behind it (and make application queries queue behind the backfill); it is retried
+    if db.session.connection().dialect.name == 'postgresql':
+        db.session.execute(text("SET LOCAL lock_timeout = '%dms'" % current_app.config['BACKFILL_LOCK_TIMEOUT_MS']))
+
+
+# Runs a registered backfill from its checkpoint (or from the start with restart=True).
+# Stops after max_batches when given; progress(result) is called after every batch.
+def run_backfill(name, batch_size=None, sleep=None, throttle=None, dry_run=False, restart=False, max_batches=None,
+                 progress=None):
+    config = current_app.config
+    spec = get_backfill(name)
+    batch_size = batch_size or config['BACKFILL_BATCH_SIZE']
+    sleep = config['BACKFILL_SLEEP'] if sleep is None else sleep
+    throttle = config['BACKFILL_THROTTLE'] if throttle is None else throttle
+    if dry_run:
+        checkpoint = None if restart else db.session.get(BackfillCheckpoint, name)
+        last_id = checkpoint.last_id if checkpoint else 0
+    else:
+        checkpoint = _checkpoint(name, restart)
+        last_id = checkpoint.last_id
+        if checkpoint.finished_at is not None:
+            result = BackfillResult(name, dry_run, 0)
+            result.last_id, result.finished = last_id, True
+            db.session.rollback()
+            return result
+
+    pk = spec.model.__table__.c.id
+    remaining = select(func.count()).select_from(spec.model.__table__).where(pk > last_id)
+    if spec.where is not None:
+        remaining = remaining.where(spec.where)
+    result = BackfillResult(name, dry_run, db.session.execute(remaining).scalar())
+    result.last_id = last_id
+    db.session.rollback()
+
+    while max_batches is None or result.batches < max_batches:
+        started = time.monotonic()
+        for attempt in range(RETRIES + 1):
+            try:
+                if dry_run:
+                    rows = _batch(spec, result.last_id, batch_size)
+                    changed = sum(1 for change in spec.fn(rows) if _diff(rows_by_id(rows)[change['id']], change))
+                    db.session.rollback()
+                else:
+                    _lock_timeout()
+                    # Claims the batch before reading it: a runner that moved the checkpoint
+                    # meanwhile makes this match nothing
+                    checkpoint = BackfillCheckpoint.__table__
+                    claimed = db.session.execute(
+                        checkpoint.update().where(checkpoint.c.name == name, checkpoint.c.last_id == result.last_id)
+                        .values(updated_at=datetime.utcnow())).rowcount
+                    if not claimed:
+                        db.session.rollback()
+                        raise BackfillError('Backfill %s is being run by another process.' % name)
+                    rows = _batch(spec, result.last_id, batch_size, lock=True)
+                    changed = _apply(spec, rows, spec.fn(rows)) if rows else 0
+                    if rows:
+                        db.session.execute(checkpoint.update().where(checkpoint.c.name == name).values(
+                            last_id=rows[-1]['id'], rows_seen=checkpoint.c.rows_seen + len(rows),
+                            rows_changed=checkpoint.c.rows_changed + changed))
+                    db.session.commit()
+                break
+            except OperationalError:
+                db.session.rollback()
+                if attempt == RETRIES:
+                    raise
+                time.sleep(min(0.1 * 2 ** attempt, 5))
+        if not rows:
+            result.finished = True
+            break
+        result.batches += 1
+        result.seen += len(rows)
+        result.changed += changed
+        result.last_id = rows[-1]['id']
+        if progress:
+            progress(result)
+        pause = max(sleep, (time.monotonic() - started) * throttle)
+        if pause:
+            time.sleep(pause)
+
+    if result.finished and not dry_run:
+        db.session.execute(update(BackfillCheckpoint).where(BackfillCheckpoint.name == name)
+                           .values(finished_at=datetime.utcnow()).execution_options(synchronize_session=False))
+        db.session.commit()
+    db.session.rollback()
+    return result
+
+
+def backfill_status():
+    checkpoints = {checkpoint.name: checkpoint for checkpoint in BackfillCheckpoint.query}
+    return [(spec, checkpoints.get(name)) for name, spec in sorted(BACKFILLS.items())]
+
+
+# For contract migrations: fails the migration unless the backfill has finished. Reads
+# the checkpoint through the migration's connection.
+def ensure_backfilled(name):
+    from alembic import context, op
+    if context.is_offline_mode():
+        return
+    finished = op.get_bind().execute(text('SELECT finished_at FROM backfill_checkpoint WHERE name = :name'),
+                                     {'name': name}).scalar()
+    if finished is None:
+        raise BackfillError('Run `flask backfill run %s` before this migration.' % name)
+
+
+# Built-in backfills
+
+@backfill('asset-updated-at', Asset, columns=[Asset.date_created], where=Asset.updated_at.is_(None))
+def fill_updated_at(rows):
+    """Sets a missing updated_at to the creation date."""
+    return [{'id': row['id'], 'updated_at': row['date_created']} for row in rows if row['date_created']]
+
+
+@backfill('asset-created-by', Asset, columns=[Asset.owner_id], where=Asset.created_by.is_(None), log_changes=True)
+def fill_created_by(rows):
+    """Records the owner as the creator of assets that have none."""
+    owners = dict(db.session.query(User.id, User.username).filter(User.id.in_({row['owner_id'] for row in rows})))
+    return [{'id': row['id'], 'created_by': owners[row['owner_id']]} for row in rows if row['owner_id'] in owners]
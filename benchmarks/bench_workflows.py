@@ -0,0 +1,361 @@
+# benchmarks/bench_workflows.py
+#
+# Seeds a database with a configurable number of assets and users, then measures
+# throughput and p50/p90/p99 latency of the main workflows (login, home, list, search,
+# create, edit, delete). Runs in-process through the Flask test client, or against
+# gunicorn with concurrent clients. Results are written as JSON and can be compared
+# with a previous run to catch regressions between releases:
+#
+#   python benchmarks/bench_workflows.py --assets 100000 --output before.json
+#   python benchmarks/bench_workflows.py --assets 100000 --baseline before.json --output after.json
+#   python benchmarks/bench_workflows.py --mode gunicorn --workers 4 --concurrency 16
+#
+# --database points it at an existing database instead of a temporary SQLite file; one
+# that already holds data is only emptied and reseeded with --wipe.
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from sqlalchemy.engine import make_url
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_PASSWORD = 'benchpass'
+WORDS = ('laptop', 'monitor', 'keyboard', 'mouse', 'router', 'switch', 'firewall', 'server',
+         'printer', 'scanner', 'phone', 'tablet', 'dock', 'headset', 'camera', 'projector')
+SCENARIOS = ('login', 'home', 'list', 'search', 'create', 'edit', 'delete')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the asset manager workflows.')
+    parser.add_argument('--assets', type=int, default=10000, help='number of assets to seed (e.g. 10000, 100000, 1000000)')
+    parser.add_argument('--users', type=int, default=100, help='number of users to seed')
+    parser.add_argument('--database', help='SQLAlchemy URL to benchmark against (default: a SQLite file in a temporary directory)')
+    parser.add_argument('--reuse', action='store_true', help='keep existing data when the database already holds the requested assets')
+    parser.add_argument('--wipe', action='store_true', help='delete the users and assets of a non-empty --database before seeding')
+    parser.add_argument('--iterations', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated subset of %s' % ', '.join(SCENARIOS))
+    parser.add_argument('--mode', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent HTTP clients in gunicorn mode')
+    parser.add_argument('--port', type=int, default=0, help='gunicorn port (default: a free port)')
+    parser.add_argument('--seed', type=int, default=1234, help='random seed for the generated data')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown of p50/p99 against the baseline (0.25 = 25%%)')
+    return parser.parse_args(argv)
+
+
+# Settings for the app under test. The login rate limiter would turn most benchmark logins
+# away with 429s (and leave the clients logged out), so it is off; its state and the user
+# cache generation file go to the run's temporary directory rather than instance/.
+def bench_config(workdir):
+    return {
+        'RATE_LIMIT_ENABLED': False,
+        'RATE_LIMIT_STORAGE': os.path.join(workdir, 'ratelimit.sqlite'),
+        'USER_CACHE_GENERATION_FILE': os.path.join(workdir, 'user-cache.generation'),
+    }
+
+
+def load_app(database_url, workdir):
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    return create_app(dict(bench_config(workdir), SQLALCHEMY_DATABASE_URI=database_url, WTF_CSRF_ENABLED=False))
+
+
+# Inserts users and assets with executemany batches, far faster than going through the ORM.
+# Seeding empties the user and asset tables first, which it refuses to do to a database
+# holding data unless wipe is set.
+def seed(app, assets, users, reuse=False, wipe=False, seed=1234, batch_size=10000):
+    from models import db, User, Asset
+    from owners import recount_assets
+    from passwords import hash_password
+    rng = random.Random(seed)
+    with app.app_context():
+        db.create_all()
+        asset_count, user_count = Asset.query.count(), User.query.count()
+        if reuse and asset_count == assets and user_count == users + 1:
+            return False
+        if (asset_count or user_count) and not wipe:
+            raise SystemExit('The database already holds %d assets and %d users; pass --wipe to delete them and '
+                             'seed anew, or --reuse with matching --assets and --users to keep them.'
+                             % (asset_count, user_count))
+        db.session.execute(Asset.__table__.delete())
+        db.session.execute(User.__table__.delete())
+        # Hashing is deliberately slow, so every generated user shares one hash
+        password = hash_password(BENCH_PASSWORD)
+        db.session.execute(User.__table__.insert(), [
+            {'id': 1, 'username': 'admin', 'password': password, 'role': 'admin'}
+        ] + [
+            {'id': i + 2, 'username': 'bench%05d' % i, 'password': password, 'role': 'user'} for i in range(users)
+        ])
+        now = datetime.utcnow()
+        for start in range(0, assets, batch_size):
+            rows = []
+            for i in range(start, min(start + batch_size, assets)):
+                owner = rng.randint(1, users + 1)
+                rows.append({
+                    'name': '%s %07d' % (rng.choice(WORDS).title(), i),
+                    'description': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 8))),
+                    'owner_id': owner,
+                    'created_by': 'admin' if owner == 1 else 'bench%05d' % (owner - 2),
+                    'date_created': now - timedelta(seconds=rng.randint(0, 365 * 86400)),
+                })
+            db.session.execute(Asset.__table__.insert(), rows)
+            db.session.commit()
+        # Core inserts skip the ORM listeners that maintain User.asset_count
+        recount_assets()
+    return True
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(latencies, wall_time, errors):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput_rps': round(len(ordered) / wall_time, 2) if wall_time else None,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        'min_ms': round(ordered[0] * 1000, 3) if ordered else None,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3) if ordered else None,
+        'p90_ms': round(percentile(ordered, 0.90) * 1000, 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3) if ordered else None,
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else None,
+    }
+
+
+# A scenario is a list of requests, each a (method, path, form data, expected statuses) tuple
+def build_requests(app, scenario, iterations, users, run_id, rng):
+    from models import Asset
+    if scenario == 'login':
+        return [('POST', '/login', {'username': 'bench%05d' % rng.randrange(users), 'password': BENCH_PASSWORD}, (302,))
+                for _ in range(iterations)]
+    if scenario == 'home':
+        return [('GET', '/', None, (200,))] * iterations
+    if scenario == 'list':
+        return [('GET', '/assets', None, (200,))] * iterations
+    if scenario == 'search':
+        return [('GET', '/assets?' + urlencode({'q': rng.choice(WORDS)}), None, (200,)) for _ in range(iterations)]
+    if scenario == 'create':
+        return [('POST', '/assets/new', {'name': 'Bench %s %05d' % (run_id, i), 'description': 'created by the benchmark'}, (302,))
+                for i in range(iterations)]
+    # Edit and delete work on the assets created by this run
+    with app.app_context():
+        created = Asset.query.filter(Asset.name.like('Bench %s %%' % run_id)).order_by(Asset.id).all()
+    if scenario == 'edit':
+        return [('POST', '/assets/edit/%d' % asset.id, {'name': asset.name, 'description': 'edited by the benchmark'}, (302,))
+                for asset in created]
+    if scenario == 'delete':
+        return [('POST', '/assets/delete/%d' % asset.id, None, (302,)) for asset in created]
+    raise ValueError('Unknown scenario %r' % scenario)
+
+
+class ClientSession:
+    # In-process session on the Flask test client; the response body is read in full so
+    # streamed pages are timed end to end
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    def login(self, username):
+        return self.request('POST', '/login', {'username': username, 'password': BENCH_PASSWORD})
+
+
+class HTTPSession:
+    # Minimal cookie-keeping HTTP client. Cookies are handled by hand because the session
+    # cookie is marked Secure and the standard cookie jar would not send it over plain HTTP
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.cookies = {}
+        self.csrf_token = None
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % item for item in self.cookies.items())
+        if data is not None:
+            if self.csrf_token:
+                data = dict(data, csrf_token=self.csrf_token)
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            self.last_body = response.read()
+            for header in response.headers.get_all('Set-Cookie') or []:
+                name, _, value = header.split(';', 1)[0].partition('=')
+                self.cookies[name.strip()] = value
+            return response.status
+        finally:
+            connection.close()
+
+    def fetch_csrf_token(self, path):
+        self.request('GET', path)
+        match = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', self.last_body)
+        self.csrf_token = match.group(1).decode() if match else None
+
+    def login(self, username):
+        self.fetch_csrf_token('/login')
+        status = self.request('POST', '/login', {'username': username, 'password': BENCH_PASSWORD})
+        # CSRF tokens are tied to the session, which login_user rotates
+        self.fetch_csrf_token('/assets/new')
+        return status
+
+
+def run_scenario(requests, make_session, username, concurrency):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    chunks = [requests[i::concurrency] for i in range(concurrency)]
+
+    def worker(chunk):
+        nonlocal errors
+        session = make_session()
+        session.login(username)
+        local, failed = [], 0
+        for method, path, data, expected in chunk:
+            started = time.perf_counter()
+            status = session.request(method, path, data)
+            local.append(time.perf_counter() - started)
+            failed += status not in expected
+        with lock:
+            latencies.extend(local)
+            errors += failed
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        worker(requests)
+    else:
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(worker, [chunk for chunk in chunks if chunk]))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(database_url, workers, port, workdir):
+    env = dict(os.environ, DATABASE_URL=database_url, RATE_LIMIT_ENABLED='0')
+    # gunicorn evaluates literal arguments to the app factory
+    factory = 'app:create_app(%r)' % (bench_config(workdir),)
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', '127.0.0.1:%d' % port,
+                                '--log-level', 'warning', '--preload', factory], cwd=ROOT, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('gunicorn exited with status %d; is it installed?' % process.returncode)
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('gunicorn did not start listening on port %d' % port)
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            if previous.get(key) and current.get(key) and current[key] > previous[key] * (1 + tolerance):
+                regressions.append({'scenario': name, 'metric': key, 'baseline': previous[key], 'current': current[key],
+                                    'change': round(current[key] / previous[key] - 1, 3)})
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit('Unknown scenarios: %s' % ', '.join(sorted(unknown)))
+    workdir = tempfile.mkdtemp(prefix='asset-bench-')
+    database_url = args.database or 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    app = load_app(database_url, workdir)
+
+    started = time.perf_counter()
+    seeded = seed(app, args.assets, args.users, reuse=args.reuse, wipe=args.wipe, seed=args.seed)
+    seed_time = time.perf_counter() - started
+    print('%s %d assets and %d users in %.1fs' % ('Seeded' if seeded else 'Reused', args.assets, args.users, seed_time), file=sys.stderr)
+
+    server = None
+    if args.mode == 'gunicorn':
+        port = args.port or free_port()
+        server = start_gunicorn(database_url, args.workers, port, workdir)
+        make_session, concurrency = (lambda: HTTPSession('127.0.0.1', port)), args.concurrency
+    else:
+        make_session, concurrency = (lambda: ClientSession(app)), 1
+
+    rng = random.Random(args.seed)
+    run_id = '%x' % int(time.time())
+    results = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'mode': args.mode,
+            'assets': args.assets,
+            'users': args.users,
+            'iterations': args.iterations,
+            'concurrency': concurrency,
+            'workers': args.workers if server else None,
+            'database': make_url(database_url).get_backend_name(),
+            'seed_seconds': round(seed_time, 2),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'scenarios': {},
+    }
+    try:
+        for name in scenarios:
+            requests = build_requests(app, name, args.iterations, args.users, run_id, rng)
+            # Writes run as the admin, who may delete; reads as a regular user
+            username = 'admin' if name in ('create', 'edit', 'delete') else 'bench%05d' % rng.randrange(args.users)
+            results['scenarios'][name] = run_scenario(requests, make_session, username, concurrency)
+            print('%-8s %s' % (name, results['scenarios'][name]), file=sys.stderr)
+    finally:
+        if server:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['regressions'] = compare(results, json.load(f), args.tolerance)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 1 if results.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
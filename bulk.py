@@ -0,0 +1,165 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import delete, update
+from models import db, User, Asset, Attachment
+from changes import FIELDS, record_changes
+from owners import adjust_asset_counts, owner_deltas
+from facets import remove_facets
+from search import apply_filters
+from forms import ASSET_DESCRIPTION_MAX_LENGTH
+
+# Admin operations on many assets at once: delete, reassign the owner, set the
+# description. The selection is a list of ids, the asset list filters, or both. It is
+# walked in id order one chunk at a time, and each chunk is one set-based
+# UPDATE/DELETE ... WHERE id IN (...) plus its change feed rows and owner counts,
+# committed on its own, so a large selection never holds one huge transaction open.
+# A dry run reads the same chunks and reports what would change without writing.
+
+# Explicit id lists above this size should be sent as a filter instead
+MAX_IDS = 10000
+
+COLUMNS = [Asset.id, Asset.version] + [getattr(Asset, field) for field in FIELDS]
+
+
+class BulkError(ValueError):
+    pass
+
+
+class BulkResult:
+    VERBS = {'delete': ('Deleted', 'Would delete'), 'reassign': ('Reassigned', 'Would reassign'),
+             'describe': ('Updated', 'Would update'), 'update': ('Updated', 'Would update')}
+
+    def __init__(self, action, dry_run):
+        self.action = action
+        self.dry_run = dry_run
+        self.matched = 0  # rows in the selection
+        self.changed = 0  # rows written, or that would be on a dry run
+        self.batches = 0
+
+    def summary(self):
+        done, would = self.VERBS[self.action]
+        unchanged = self.matched - self.changed
+        return '%s %d asset%s%s.' % (would if self.dry_run else done, self.changed, '' if self.changed == 1 else 's',
+                                     ' (%d already up to date)' % unchanged if unchanged else '')
+
+    def to_dict(self):
+        return {'action': self.action, 'dry_run': self.dry_run, 'matched': self.matched,
+                'changed': self.changed, 'batches': self.batches}
+
+
+def _check_selection(ids, filters):
+    if ids is None and not filters:
+        raise BulkError('Select assets by id or by filter.')
+    if filters and 'archived' in filters:
+        raise BulkError('Bulk actions apply to live assets only; remove the archived filter.')
+    if ids is not None and len(ids) > MAX_IDS:
+        raise BulkError('At most %d ids can be sent at once; use a filter instead.' % MAX_IDS)
+
+
+# Yields the selected rows as dicts, chunk_size at a time in id order. Rows are locked
+# (FOR UPDATE, where the database supports it) until the chunk's transaction ends.
+def _chunks(ids, filters, chunk_size, lock):
+    last = 0
+    while True:
+        query = db.session.query(*COLUMNS).filter(Asset.id > last)
+        if ids is not None:
+            query = query.filter(Asset.id.in_(ids))
+        query = apply_filters(query, filters or {}).order_by(Asset.id).limit(chunk_size)
+        if lock:
+            query = query.with_for_update()
+        rows = [row._asdict() for row in query]
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]['id']
+
+
+def _run(action, ids, filters, dry_run, chunk_size, apply):
+    _check_selection(ids, filters)
+    result = BulkResult(action, dry_run)
+    try:
+        for rows in _chunks(ids, filters, chunk_size, lock=not dry_run):
+            result.matched += len(rows)
+            result.batches += 1
+            result.changed += apply(rows, dry_run)
+            if not dry_run:
+                db.session.commit()
+    finally:
+        # Ends the read transaction of a dry run, or the failed chunk of a real one
+        db.session.rollback()
+    return result
+
+
+def bulk_delete(ids=None, filters=None, dry_run=False, chunk_size=1000):
+    def apply(rows, dry_run):
+        if not dry_run:
+            ids = [row['id'] for row in rows]
+            remove_facets(ids)
+            # SQLite doesn't enforce the cascade; the files go at the next `flask attachments gc`
+            db.session.execute(delete(Attachment).where(Attachment.asset_id.in_(ids))
+                               .execution_options(synchronize_session=False))
+            db.session.execute(delete(Asset).where(Asset.id.in_(ids))
+                               .execution_options(synchronize_session=False))
+            record_changes('delete', rows)
+            adjust_asset_counts(owner_deltas(rows, -1))
+        return len(rows)
+    return _run('delete', ids, filters, dry_run, chunk_size, apply)
+
+
+# Sets the same column values on every selected asset, skipping rows that already have
+# them; versions are bumped like an ORM update would
+def _bulk_set(action, values, ids, filters, dry_run, chunk_size):
+    def apply(rows, dry_run):
+        rows = [row for row in rows if any(row[key] != value for key, value in values.items())]
+        if dry_run or not rows:
+            return len(rows)
+        now = datetime.utcnow()
+        db.session.execute(update(Asset).where(Asset.id.in_([row['id'] for row in rows]))
+                           .values(version=Asset.version + 1, updated_at=now, **values)
+                           .execution_options(synchronize_session=False))
+        changed = []
+        deltas = Counter()
+        for row in rows:
+            diff = {key: [row[key], value] for key, value in values.items() if row[key] != value}
+            changed.append(dict(row, version=row['version'] + 1, updated_at=now, changes=diff, **values))
+            if 'owner_id' in diff:
+                deltas[row['owner_id']] -= 1
+                deltas[values['owner_id']] += 1
+        record_changes('update', changed)
+        adjust_asset_counts(deltas)
+        return len(rows)
+    return _run(action, ids, filters, dry_run, chunk_size, apply)
+
+
+def _clean_values(values):
+    if not values or set(values) - {'owner_id', 'description'}:
+        raise BulkError('Only owner_id and description can be set in bulk.')
+    values = dict(values)
+    if 'owner_id' in values:
+        owner_id = values['owner_id']
+        if not isinstance(owner_id, int) or isinstance(owner_id, bool) or db.session.get(User, owner_id) is None:
+            raise BulkError('Unknown owner_id.')
+    if 'description' in values:
+        description = values['description']
+        if description is not None and not isinstance(description, str):
+            raise BulkError('description must be a string.')
+        description = (description or '').strip() or None
+        if description and len(description) > ASSET_DESCRIPTION_MAX_LENGTH:
+            raise BulkError('description must be at most %d characters.' % ASSET_DESCRIPTION_MAX_LENGTH)
+        values['description'] = description
+    return values
+
+
+# Sets owner_id and/or description on every selected asset
+def bulk_update(values, ids=None, filters=None, dry_run=False, chunk_size=1000):
+    values = _clean_values(values)
+    action = {('owner_id',): 'reassign', ('description',): 'describe'}.get(tuple(values), 'update')
+    return _bulk_set(action, values, ids, filters, dry_run, chunk_size)
+
+
+def bulk_reassign(owner_id, **options):
+    return bulk_update({'owner_id': owner_id}, **options)
+
+
+def bulk_set_description(description, **options):
+    return bulk_update({'description': description}, **options)
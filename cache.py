@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Marker for "not cached", since None is a legitimate cached value
+MISSING = object()
+
+
+# A small thread-safe in-process cache with a size bound (least recently used
+# entries are evicted first) and a per-entry time to live. Each gunicorn worker
+# holds its own instance, so the TTL also bounds how stale a worker can get.
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        entry = self._data.get(key)
+        if entry is None:
+            return MISSING
+        expires, value = entry
+        if expires <= self.timer():
+            del self._data[key]
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+        return default if value is MISSING else value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (self.timer() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return MISSING if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    # Returns the cached value, computing and storing it with factory() on a miss
+    def get_or_set(self, key, factory, ttl=None):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+    # Applies fn to a cached value under the lock. Does nothing on a miss, since the
+    # next reader recomputes the value anyway; fn returns MISSING to drop the entry.
+    def update(self, key, fn):
+        with self._lock:
+            value = self._lookup(key)
+            if value is MISSING:
+                return
+            value = fn(value)
+            if value is MISSING:
+                del self._data[key]
+            else:
+                self._data[key] = (self._data[key][0], value)
@@ -0,0 +1,159 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import g, has_request_context
+from sqlalchemy import event, inspect, text
+from models import db, Asset, AssetChange
+
+# Change feed for downstream sync. Every asset create, update and delete adds a row to
+# asset_change inside the same transaction, from a flush listener for ORM writes or via
+# record_changes() for bulk statements. Consumers read the rows after the last id they
+# have seen, so syncing costs O(changes) instead of re-reading the whole table.
+#
+# Ids are only a safe cursor if they become visible in id order. SQLite serialises
+# writers anyway; on PostgreSQL writers take a transaction-level advisory lock before
+# logging, so a transaction holding a lower id always commits before a higher one.
+
+FIELDS = ('name', 'description', 'owner_id', 'created_by', 'date_created', 'updated_at')
+ADVISORY_LOCK_KEY = 0x61737365  # 'asse'
+
+# Notified after commits that logged changes, waking long-polls in this process early.
+# Other processes are picked up by the polling interval.
+_new_changes = threading.Condition()
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def snapshot(values):
+    return {key: _json_value(values[key]) for key in FIELDS if key in values}
+
+
+def _changed_by():
+    # Flask-Login keeps the loaded user in g; reading current_user here could query the
+    # database in the middle of a flush
+    user = g.get('_login_user') if has_request_context() else None
+    return getattr(user, 'username', None)
+
+
+# Keeps other transactions from logging changes until this one ends. Only needed on
+# PostgreSQL: SQLite already lets one writer at a time commit.
+def lock_feed(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+
+
+def _write(session, changes):
+    connection = session.connection()
+    lock_feed(connection)
+    changed_by = _changed_by()
+    connection.execute(AssetChange.__table__.insert(), [
+        dict(change, changed_by=changed_by, changed_at=datetime.utcnow()) for change in changes
+    ])
+    session.info['asset_changes_logged'] = True
+
+
+# Logs changes made by bulk statements, which bypass the flush listener. rows are dicts
+# holding 'id', optionally 'version', and the asset columns; update rows may also carry
+# 'changes' as {field: [old, new]}. operation is 'create', 'update' or 'delete'. Runs in
+# the session's current transaction.
+def record_changes(operation, rows, session=None):
+    if not rows:
+        return
+    key = 'old' if operation == 'delete' else 'new'
+    changes = []
+    for row in rows:
+        data = {key: snapshot(row)}
+        if row.get('changes'):
+            data['changes'] = {field: [_json_value(old), _json_value(new)] for field, (old, new) in row['changes'].items()}
+        changes.append({'asset_id': row['id'], 'operation': operation, 'version': row.get('version', 1), 'data': data})
+    _write(session or db.session, changes)
+
+
+def _loaded(state):
+    return {key: state.dict[key] for key in FIELDS if key in state.dict}
+
+
+@event.listens_for(db.session, 'after_flush')
+def _log_flushed_changes(session, flush_context):
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, Asset):
+            changes.append({'asset_id': obj.id, 'operation': 'create', 'version': obj.version,
+                            'data': {'new': snapshot(_loaded(inspect(obj)))}})
+    for obj in session.dirty:
+        if isinstance(obj, Asset):
+            state = inspect(obj)
+            diff = {}
+            for key in FIELDS:
+                history = state.attrs[key].history
+                if history.added:
+                    old = history.deleted[0] if history.deleted else None
+                    if old != history.added[0]:
+                        diff[key] = [_json_value(old), _json_value(history.added[0])]
+            if diff:
+                changes.append({'asset_id': obj.id, 'operation': 'update', 'version': obj.version,
+                                'data': {'new': snapshot(_loaded(state)), 'changes': diff}})
+    for obj in session.deleted:
+        if isinstance(obj, Asset):
+            state = inspect(obj)
+            changes.append({'asset_id': state.identity[0], 'operation': 'delete', 'version': state.dict.get('version'),
+                            'data': {'old': snapshot(_loaded(state))}})
+    if changes:
+        _write(session, changes)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_waiters(session):
+    if session.info.pop('asset_changes_logged', False):
+        with _new_changes:
+            _new_changes.notify_all()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_logged_changes(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('asset_changes_logged', None)
+
+
+def change_to_dict(change):
+    return {
+        'cursor': change.id,
+        'asset_id': change.asset_id,
+        'operation': change.operation,
+        'version': change.version,
+        'changed_by': change.changed_by,
+        'changed_at': change.changed_at.isoformat(),
+        **change.data,
+    }
+
+
+def latest_cursor():
+    return db.session.query(db.func.max(AssetChange.id)).scalar() or 0
+
+
+def changes_since(cursor, limit=100):
+    return AssetChange.query.filter(AssetChange.id > cursor).order_by(AssetChange.id).limit(limit).all()
+
+
+# Returns the changes after cursor, waiting up to timeout seconds for one to appear
+def wait_for_changes(cursor, limit=100, timeout=0, poll_interval=1.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        changes = changes_since(cursor, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes
+        # End the read transaction, or SQLite would keep serving the same snapshot
+        db.session.rollback()
+        with _new_changes:
+            _new_changes.wait(min(poll_interval, remaining))
+
+
+# Deletes changes older than the given number of days; returns how many were removed
+def prune_changes(days):
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = AssetChange.query.filter(AssetChange.changed_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
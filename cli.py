@@ -0,0 +1,275 @@
+import click
+from flask.cli import AppGroup
+from models import User
+
+# Command line tools, available as `flask assets ...`
+assets_cli = AppGroup('assets', help='Bulk asset operations.')
+
+
+def _user(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter('No user named %r.' % username, param_hint='--owner')
+    return user
+
+
+@assets_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--owner', default='admin', show_default=True, help='User recorded as importer and default owner.')
+@click.option('--format', 'fmt', type=click.Choice(['auto', 'csv', 'json', 'ndjson']), default='auto', show_default=True)
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per INSERT transaction.')
+# Imports assets from a CSV, JSON or NDJSON file
+def import_command(path, owner, fmt, batch_size):
+    from importer import import_assets, detect_format, ImportFailed
+    user = _user(owner)
+    try:
+        fmt = detect_format(path) if fmt == 'auto' else fmt
+        with open(path, 'rb') as stream:
+            result = import_assets(stream, fmt, user, batch_size=batch_size,
+                                   progress=lambda r: click.echo('  %d rows imported...' % r.inserted, err=True))
+    except ImportFailed as exc:
+        raise click.ClickException(str(exc))
+    for line, message in result.errors:
+        click.echo('line %s: %s' % (line, message), err=True)
+    if result.failed > len(result.errors):
+        click.echo('... %d more rejected rows not shown' % (result.failed - len(result.errors)), err=True)
+    click.echo(result.summary())
+
+
+@assets_cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson', 'parquet', 'arrow']), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False, allow_dash=True), default='-', help='File to write, - for stdout.')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows fetched per round trip.')
+@click.option('--q', help='Full text search over name and description.')
+@click.option('--name', help='Name prefix.')
+@click.option('--owner-id', type=int)
+@click.option('--created-by')
+@click.option('--created-from', help='YYYY-MM-DD or ISO timestamp.')
+@click.option('--created-to', help='YYYY-MM-DD or ISO timestamp.')
+@click.option('--sort', type=click.Choice(['date_created', '-date_created', 'name', '-name']))
+# Streams assets matching the same filters as the asset list to a file or stdout
+def export_command(fmt, output, compress, chunk_size, **options):
+    from werkzeug.datastructures import MultiDict
+    from compression import gzip_stream
+    from exporter import export_assets, ExportFailed
+    from search import parse_filters
+    filters = parse_filters(MultiDict({key: value for key, value in options.items() if value is not None}))
+    try:
+        chunks = export_assets(filters, fmt, chunk_size=chunk_size)
+    except ExportFailed as exc:
+        raise click.ClickException(str(exc))
+    if compress:
+        chunks = gzip_stream(chunks)
+    with click.open_file(output, 'wb') as stream:
+        for chunk in chunks:
+            stream.write(chunk)
+
+
+@assets_cli.command('archive')
+@click.option('--days', type=int, help='Archive assets retired at least this many days ago (default ARCHIVE_AFTER_DAYS).')
+@click.option('--dry-run', is_flag=True, help='Count the assets that would be archived.')
+# Moves retired assets out of the asset table into asset_archive; meant to run from cron
+def archive_command(days, dry_run):
+    from datetime import datetime, timedelta
+    from archive import archive_retired
+    before = datetime.utcnow() - timedelta(days=days) if days is not None else None
+    moved = archive_retired(before=before, dry_run=dry_run)
+    click.echo('%s %d retired asset%s.' % ('Would archive' if dry_run else 'Archived', moved, '' if moved == 1 else 's'))
+
+
+@assets_cli.command('recount-owners')
+# Recomputes User.asset_count from the asset table, e.g. after rows were changed with raw SQL
+def recount_owners_command():
+    from owners import recount_assets
+    click.echo('Corrected the asset count of %d users.' % recount_assets())
+
+
+@assets_cli.command('recount-facets')
+# Rebuilds the tag and attribute counts, e.g. after FACET_ATTRIBUTES changed
+def recount_facets_command():
+    from facets import recount_facets
+    click.echo('Counted %d facet values.' % recount_facets())
+
+
+# API token management, available as `flask api ...`
+api_cli = AppGroup('api', help='Manage API tokens.')
+
+
+@api_cli.command('create-token')
+@click.argument('username')
+@click.option('--name', default='cli', show_default=True, help='Label to recognise the token by.')
+# Creates an API token for a user and prints it; the raw token can't be shown again
+def create_token_command(username, name):
+    from api import create_token
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException('No user named %r.' % username)
+    click.echo(create_token(user, name))
+
+
+@api_cli.command('revoke-token')
+@click.argument('token_id', type=int)
+def revoke_token_command(token_id):
+    from models import db, ApiToken
+    token = db.session.get(ApiToken, token_id)
+    if token is None:
+        raise click.ClickException('No token with id %d.' % token_id)
+    db.session.delete(token)
+    db.session.commit()
+    click.echo('Revoked token %d (%s).' % (token.id, token.name))
+
+
+@api_cli.command('list-tokens')
+def list_tokens_command():
+    from models import ApiToken
+    for token in ApiToken.query.order_by(ApiToken.id):
+        click.echo('%d\t%s\t%s\t%s' % (token.id, token.user.username, token.name, token.date_created))
+
+
+# Change feed maintenance, available as `flask changes ...`
+changes_cli = AppGroup('changes', help='Maintain the asset change feed.')
+
+
+@changes_cli.command('prune')
+@click.option('--days', default=90, show_default=True, help='Keep changes from this many recent days.')
+# Deletes old change feed entries; consumers further behind must resync from the asset list
+def prune_command(days):
+    from changes import prune_changes
+    click.echo('Deleted %d changes older than %d days.' % (prune_changes(days), days))
+
+
+# Static asset pipeline, available as `flask static ...`
+static_cli = AppGroup('static', help='Vendor and precompress static files.')
+
+
+@static_cli.command('vendor')
+@click.option('--force', is_flag=True, help='Download files that are already present again.')
+# Downloads the pinned third-party CSS, JavaScript and fonts into static/vendor/
+def vendor_command(force):
+    from flask import current_app
+    from static_assets import fetch_vendor
+    try:
+        fetched = fetch_vendor(current_app.static_folder, force=force)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    for filename in fetched:
+        click.echo('Fetched %s' % filename)
+
+
+@static_cli.command('build')
+# Writes gzip (and brotli, when installed) copies of the static files for the server to send as they are
+def build_command():
+    from flask import current_app
+    from static_assets import precompress
+    written = precompress(current_app.static_folder)
+    click.echo('Wrote %d precompressed files.' % len(written))
+
+
+# Background jobs, available as `flask jobs ...`
+jobs_cli = AppGroup('jobs', help='Run and maintain background jobs.')
+
+
+@jobs_cli.command('worker')
+@click.option('--processes', type=int, help='Jobs run at once (default JOB_WORKER_PROCESSES); 0 runs them in this process.')
+@click.option('--poll', default=1.0, show_default=True, help='Seconds between checks for new jobs.')
+@click.option('--once', is_flag=True, help='Exit when no job is waiting instead of polling.')
+# Runs queued jobs until interrupted
+def worker_command(processes, poll, once):
+    from jobs import work
+    try:
+        done = work(processes=processes, poll_interval=poll, once=once, log=lambda message: click.echo(message, err=True))
+    except KeyboardInterrupt:
+        return
+    click.echo('Ran %d jobs.' % done)
+
+
+@jobs_cli.command('list')
+@click.option('--status', type=click.Choice(['queued', 'running', 'succeeded', 'failed']))
+@click.option('--limit', default=20, show_default=True)
+def list_jobs_command(status, limit):
+    from models import Job
+    query = Job.query.order_by(Job.id.desc())
+    if status:
+        query = query.filter_by(status=status)
+    for job in query.limit(limit):
+        click.echo('%d\t%s\t%s\t%s\t%s' % (job.id, job.kind, job.status, job.progress if job.progress is not None else '-',
+                                           job.message or ''))
+
+
+@jobs_cli.command('prune')
+@click.option('--days', default=7, show_default=True, help='Keep finished jobs from this many recent days.')
+# Deletes old finished jobs together with their result files
+def prune_jobs_command(days):
+    from jobs import prune_jobs
+    click.echo('Deleted %d jobs finished more than %d days ago.' % (prune_jobs(days), days))
+
+
+# Report summary tables, available as `flask reports ...`
+reports_cli = AppGroup('reports', help='Maintain the summary tables behind the reports.')
+
+
+@reports_cli.command('refresh')
+@click.option('--rebuild', is_flag=True, help='Recount everything from the asset table instead of the change feed.')
+# Applies new change feed entries to the report summaries, or rebuilds them
+def refresh_reports_command(rebuild):
+    from reports import rebuild as rebuild_reports, refresh
+    if rebuild:
+        click.echo('Counted %d assets.' % rebuild_reports())
+    else:
+        click.echo('Applied %d changes.' % refresh())
+
+
+# Attachment blob store, available as `flask attachments ...`
+attachments_cli = AppGroup('attachments', help='Maintain the attachment blob store.')
+
+
+@attachments_cli.command('gc')
+@click.option('--grace', default=3600, show_default=True, help='Keep unreferenced files younger than this many seconds.')
+# Deletes stored files and thumbnails that no attachment refers to any more
+def gc_command(grace):
+    from attachments import collect_garbage
+    click.echo('Removed %d unreferenced files.' % collect_garbage(grace))
+
+
+# Online data backfills, available as `flask backfill ...`
+backfill_cli = AppGroup('backfill', help='Run data backfills in small batches while the app serves traffic.')
+
+
+@backfill_cli.command('list')
+# Lists the registered backfills and how far each one has got
+def list_backfills_command():
+    from backfill import backfill_status
+    for spec, checkpoint in backfill_status():
+        if checkpoint is None:
+            state = 'not started'
+        elif checkpoint.finished_at:
+            state = 'finished %s, %d rows changed' % (checkpoint.finished_at.strftime('%Y-%m-%d %H:%M'), checkpoint.rows_changed)
+        else:
+            state = 'at id %d, %d rows changed' % (checkpoint.last_id, checkpoint.rows_changed)
+        click.echo('%s\t%s\t%s' % (spec.name, state, spec.description))
+
+
+@backfill_cli.command('run')
+@click.argument('name')
+@click.option('--batch-size', type=int, help='Rows per transaction (default BACKFILL_BATCH_SIZE).')
+@click.option('--sleep', type=float, help='Seconds to pause between batches at least.')
+@click.option('--throttle', type=float, help='Pause this many times as long as each batch took.')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing.')
+@click.option('--restart', is_flag=True, help='Start from the first row instead of the checkpoint.')
+@click.option('--max-batches', type=int, help='Stop after this many batches; run again to continue.')
+# Runs a backfill from its checkpoint; safe to interrupt and run again
+def run_backfill_command(name, batch_size, sleep, throttle, dry_run, restart, max_batches):
+    from backfill import run_backfill, BackfillError
+    def progress(result):
+        eta = result.eta
+        click.echo('%s: %d/%s rows, %d changed, %.0f rows/s%s' % (
+            name, result.seen, result.total, result.changed, result.rate,
+            ', about %ds left' % eta if eta is not None else ''), err=True)
+    try:
+        result = run_backfill(name, batch_size=batch_size, sleep=sleep, throttle=throttle, dry_run=dry_run,
+                              restart=restart, max_batches=max_batches, progress=progress)
+    except BackfillError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(result.summary())
+
@@ -0,0 +1,111 @@
+import zlib
+from flask import request, current_app
+
+try:
+    import brotli
+except ImportError:  # optional; responses fall back to gzip
+    brotli = None
+
+
+# Compresses an iterable of byte chunks into a gzip stream on the fly, yielding
+# compressed data as soon as zlib produces it. With flush_every, pending output is
+# flushed once that many input bytes have gone in, so a streamed page still arrives
+# in pieces instead of all at the end.
+def gzip_stream(chunks, level=6, flush_every=None):
+    # wbits=31 selects the gzip container (header and CRC trailer) rather than raw zlib
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if flush_every and pending >= flush_every:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# The brotli counterpart of gzip_stream; needs the brotli package
+def brotli_stream(chunks, quality=5, flush_every=None):
+    compressor = brotli.Compressor(quality=quality)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        pending += len(chunk)
+        if flush_every and pending >= flush_every:
+            data += compressor.flush()
+            pending = 0
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+# Picks the best encoding the client accepts: brotli when installed, then gzip
+def negotiate(accept_encodings, offered=('br', 'gzip')):
+    for encoding in offered:
+        if encoding == 'br' and brotli is None:
+            continue
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+# Compresses HTML, JSON and other text responses for clients that accept it. Streamed
+# pages are compressed chunk by chunk as they are generated; other bodies are compressed
+# whole once they pass COMPRESS_MIN_SIZE.
+class Compression:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIMETYPES', ('text/html', 'application/json', 'text/plain', 'text/css',
+                                                     'text/javascript', 'application/javascript', 'image/svg+xml'))
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 5)
+        # Input bytes between flushes of a streamed response
+        app.config.setdefault('COMPRESS_STREAM_FLUSH', 16384)
+        app.extensions['compression'] = self
+        app.after_request(self.compress)
+
+    def compress(self, response):
+        config = current_app.config
+        if (not config['COMPRESS_ENABLED'] or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough or 'Content-Encoding' in response.headers
+                or response.mimetype not in config['COMPRESS_MIMETYPES']):
+            return response
+        # A strong ETag promises byte-identical bodies, which If-Match relies on, so
+        # those responses (single API assets) are sent as they are
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            chunks = response.iter_encoded()
+            if encoding == 'br':
+                body = brotli_stream(chunks, config['COMPRESS_BROTLI_QUALITY'], config['COMPRESS_STREAM_FLUSH'])
+            else:
+                body = gzip_stream(chunks, config['COMPRESS_LEVEL'], config['COMPRESS_STREAM_FLUSH'])
+            # The original iterable still has to be closed (stream_with_context pops its context then)
+            original = response.response
+            if hasattr(original, 'close'):
+                response.call_on_close(original.close)
+            response.response = body
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            if encoding == 'br':
+                response.set_data(brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY']))
+            else:
+                response.set_data(b''.join(gzip_stream([data], config['COMPRESS_LEVEL'])))
+        response.headers['Content-Encoding'] = encoding
+        return response
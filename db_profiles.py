@@ -0,0 +1,126 @@
+import os
+import weakref
+from functools import wraps
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Delete, Insert, Update
+
+# Engine settings per database backend, picked with DATABASE_PROFILE ('auto' chooses
+# from the database URL, 'none' keeps SQLAlchemy's defaults):
+#
+#   sqlite    WAL journal so readers don't block the writer, synchronous=NORMAL,
+#             memory-mapped reads and a busy timeout instead of "database is locked"
+#   postgres  a sized connection pool with pre-ping and recycling, plus a larger
+#             compiled statement cache and server-side prepared statements on psycopg 3
+#
+# When DATABASE_REPLICA_URL is set, views decorated with @read_only send their queries
+# to that database. Writes and flushes always use the primary.
+
+
+# Engines of every app in this process. With gunicorn --preload the app is built before
+# the workers fork, and a child must not reuse the pooled connections of its parent.
+_engines = weakref.WeakSet()
+
+
+def _dispose_after_fork():
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
+
+
+def backend(url):
+    name = make_url(url).get_backend_name()
+    return 'postgres' if name == 'postgresql' else name
+
+
+def engine_options(url, config, profile='auto'):
+    if profile == 'auto':
+        profile = backend(url)
+    if profile == 'postgres':
+        options = {
+            'pool_size': config.get('DATABASE_POOL_SIZE', 10),
+            'max_overflow': config.get('DATABASE_MAX_OVERFLOW', 20),
+            'pool_timeout': config.get('DATABASE_POOL_TIMEOUT', 10),
+            'pool_recycle': config.get('DATABASE_POOL_RECYCLE', 1800),
+            'pool_pre_ping': True,
+            'query_cache_size': config.get('DATABASE_QUERY_CACHE_SIZE', 1200),
+        }
+        if make_url(url).get_driver_name() == 'psycopg':
+            # Prepare a statement server-side once it has been run this many times
+            options['connect_args'] = {'prepare_threshold': config.get('DATABASE_PREPARE_THRESHOLD', 5)}
+        return options
+    return {}
+
+
+def sqlite_pragmas(config):
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'busy_timeout': config.get('SQLITE_BUSY_TIMEOUT_MS', 5000),
+    }
+
+
+# Applies the pragmas to every new DBAPI connection of a SQLite engine
+def apply_sqlite_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+
+class DatabaseProfiles:
+    # Initialises db for app with the engine options of the selected profile
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('DATABASE_PROFILE', 'auto')
+        app.config.setdefault('DATABASE_REPLICA_URL', None)
+        profile = app.config['DATABASE_PROFILE']
+        url = app.config['SQLALCHEMY_DATABASE_URI']
+        options = dict(engine_options(url, app.config, profile), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+        db.init_app(app)
+        with app.app_context():
+            engines = list(db.engines.values())
+        # The replica is kept out of SQLALCHEMY_BINDS, which would give it a metadata of
+        # its own and make create_all() and migrations try to build tables there
+        self.replica = None
+        replica_url = app.config['DATABASE_REPLICA_URL']
+        if replica_url:
+            self.replica = create_engine(replica_url, **engine_options(replica_url, app.config, profile))
+            engines.append(self.replica)
+        for engine in engines:
+            _engines.add(engine)
+            if engine.dialect.name == 'sqlite' and profile in ('auto', 'sqlite'):
+                apply_sqlite_pragmas(engine, sqlite_pragmas(app.config))
+        app.extensions['db_profiles'] = self
+
+
+# Marks a view as read-only, so its queries may be answered by the replica
+def read_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.db_read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+# db.session class sending reads of @read_only views to the replica, if configured
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('db_read_only') \
+                and not isinstance(clause, (Insert, Update, Delete)):
+            replica = current_app.extensions['db_profiles'].replica
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,136 @@
+import csv
+import io
+import json
+from sqlalchemy import select, union_all
+from models import db, User, Asset, ArchivedAsset
+from pagination import order_clauses
+from search import apply_filters, sort_order
+
+# Streaming asset export. Rows are fetched in partitions with yield_per (a server-side
+# cursor where the driver supports one) and encoded partition by partition, so memory
+# stays constant however many assets match.
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+# Exported columns; "owner" is the owner's username so a CSV export can be re-imported
+COLUMNS = ('id', 'name', 'description', 'owner_id', 'owner', 'created_by', 'date_created')
+
+
+class ExportFailed(ValueError):
+    pass
+
+
+def _select(model, filters):
+    # Archived assets are exported under the id they had
+    asset_id = model.asset_id.label('id') if model is ArchivedAsset else model.id
+    stmt = (select(asset_id, model.name, model.description, model.owner_id,
+                   User.username.label('owner'), model.created_by, model.date_created)
+            .outerjoin(User, User.id == model.owner_id))
+    return apply_filters(stmt, filters, model)
+
+
+def _statement(filters):
+    archived = filters.get('archived')
+    if archived != 'include':
+        model = ArchivedAsset if archived == 'only' else Asset
+        return _select(model, filters).order_by(*order_clauses(sort_order(filters, model)))
+    union = union_all(_select(Asset, filters), _select(ArchivedAsset, filters)).subquery()
+    return select(union).order_by(*order_clauses([(union.c[column.key], descending)
+                                                  for column, descending in sort_order(filters)]))
+
+
+# Yields lists of result rows, chunk_size rows at a time
+def iter_partitions(filters, chunk_size=5000):
+    result = db.session.execute(_statement(filters).execution_options(yield_per=chunk_size))
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _csv(partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in partitions:
+        writer.writerows([*row[:-1], _iso(row[-1]) or ''] for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson(partitions):
+    for rows in partitions:
+        lines = [json.dumps(dict(zip(COLUMNS, (*row[:-1], _iso(row[-1]))))) for row in rows]
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+class _Sink(io.RawIOBase):
+    # A write-only file object whose contents are drained after every record batch,
+    # letting pyarrow's writers feed a streamed response
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def _arrow(partitions, fmt):
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportFailed('%s export requires the pyarrow package.' % fmt.capitalize())
+    schema = pa.schema([
+        ('id', pa.int64()), ('name', pa.string()), ('description', pa.string()),
+        ('owner_id', pa.int64()), ('owner', pa.string()), ('created_by', pa.string()),
+        ('date_created', pa.timestamp('us')),
+    ])
+
+    def generate():
+        sink = _Sink()
+        if fmt == 'parquet':
+            writer = pa.parquet.ParquetWriter(sink, schema, compression='snappy')
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        for rows in partitions:
+            # Each partition becomes one Parquet row group / Arrow record batch
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+    return generate()
+
+
+# Returns a generator of encoded byte chunks for the assets matching filters
+def export_assets(filters, fmt, chunk_size=5000):
+    if fmt not in FORMATS:
+        raise ExportFailed('Unsupported export format: %s' % fmt)
+    partitions = iter_partitions(filters, chunk_size)
+    if fmt == 'csv':
+        return _csv(partitions)
+    if fmt == 'ndjson':
+        return _ndjson(partitions)
+    return _arrow(partitions, fmt)
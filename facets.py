@@ -0,0 +1,354 @@
+import math
+import re
+from collections import Counter
+from flask import current_app
+from sqlalchemy import delete, event, func, insert, literal, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Asset, Tag, asset_tag, AssetAttribute, FacetCount
+
+# Tags and typed custom attributes of assets, and the facet counts next to the asset list.
+# Tags live in a normalised tag table joined through asset_tag; attributes are one
+# (asset, key) row holding the value's canonical text, indexed on (key, value, asset_id).
+# A filter such as ?tag=laptop&attr.location=Building 3 is therefore two index lookups
+# rather than a LIKE scan over descriptions.
+#
+# facet_count holds how many live assets carry each tag and each value of the attributes
+# listed in FACET_ATTRIBUTES. All writes go through set_facets() and remove_facets(),
+# which adjust the counts with relative upserts in the same transaction, so the counts
+# are read straight from that table. Attributes that are unique per asset, like serial
+# numbers, are better left out of FACET_ATTRIBUTES; they can still be filtered on.
+# `flask assets recount-facets` rebuilds the counts after FACET_ATTRIBUTES changes.
+
+TAG_PATTERN = re.compile(r'[a-z0-9][a-z0-9 ._/+-]*\Z')
+KEY_PATTERN = re.compile(r'[a-z][a-z0-9_]*\Z')
+TAG_MAX_LENGTH = 50
+KEY_MAX_LENGTH = 50
+VALUE_MAX_LENGTH = 200
+MAX_TAGS = 50
+MAX_ATTRIBUTES = 50
+
+
+class FacetError(ValueError):
+    pass
+
+
+class Facets:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Attributes whose values are counted and offered as facets on the asset list
+        app.config.setdefault('FACET_ATTRIBUTES', ['location', 'category'])
+        # Values shown per facet
+        app.config.setdefault('FACET_LIMIT', 10)
+        app.extensions['facets'] = self
+
+
+def normalize_tag(name):
+    return ' '.join(str(name).lower().split())[:TAG_MAX_LENGTH]
+
+
+# A list of tag names, or a comma separated string, as sorted unique normalised names
+def clean_tags(tags):
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    if not isinstance(tags, (list, tuple)):
+        raise FacetError('tags must be a list of names.')
+    names = set()
+    for tag in tags:
+        if not isinstance(tag, str):
+            raise FacetError('Tags must be text.')
+        name = ' '.join(tag.lower().split())
+        if not name:
+            continue
+        if len(name) > TAG_MAX_LENGTH or not TAG_PATTERN.match(name):
+            raise FacetError('Invalid tag %r: use letters, digits, spaces and . _ / + - (at most %d characters).'
+                             % (tag, TAG_MAX_LENGTH))
+        names.add(name)
+    if len(names) > MAX_TAGS:
+        raise FacetError('An asset can have at most %d tags.' % MAX_TAGS)
+    return sorted(names)
+
+
+# (canonical text, kind) of an attribute value; None for an empty value
+def canonical(value):
+    if isinstance(value, bool):
+        return ('true' if value else 'false'), 'boolean'
+    if isinstance(value, (int, float)):
+        if not math.isfinite(value):
+            raise FacetError('Attribute values must be finite numbers.')
+        return ('%d' % value if float(value).is_integer() else repr(float(value))), 'number'
+    if isinstance(value, str):
+        value = value.strip()
+        if len(value) > VALUE_MAX_LENGTH:
+            raise FacetError('Attribute values can be at most %d characters.' % VALUE_MAX_LENGTH)
+        return (value, 'string') if value else None
+    if value is None:
+        return None
+    raise FacetError('Attribute values must be text, numbers or true/false.')
+
+
+# The value stored as text, converted back to its kind
+def typed(value, kind):
+    if kind == 'number':
+        number = float(value)
+        return int(number) if number.is_integer() and re.fullmatch(r'-?\d+', value) else number
+    if kind == 'boolean':
+        return value == 'true'
+    return value
+
+
+# {key: value} as {key: (canonical text, kind)}; empty values are left out
+def clean_attributes(attributes):
+    if not isinstance(attributes, dict):
+        raise FacetError('attributes must be an object.')
+    cleaned = {}
+    for key, value in attributes.items():
+        key = str(key).strip().lower()
+        if len(key) > KEY_MAX_LENGTH or not KEY_PATTERN.match(key):
+            raise FacetError('Invalid attribute name %r: use lower case letters, digits and _.' % key)
+        value = canonical(value)
+        if value is not None:
+            cleaned[key] = value
+    if len(cleaned) > MAX_ATTRIBUTES:
+        raise FacetError('An asset can have at most %d attributes.' % MAX_ATTRIBUTES)
+    return cleaned
+
+
+# "key: value" lines, as typed in the asset form
+def parse_attribute_lines(text):
+    attributes = {}
+    for number, line in enumerate((text or '').splitlines(), 1):
+        if not line.strip():
+            continue
+        key, separator, value = line.partition(':')
+        if not separator:
+            raise FacetError('Line %d: write attributes as "name: value".' % number)
+        attributes[key] = value
+    return clean_attributes(attributes)
+
+
+def format_attribute_lines(attributes):
+    return '\n'.join('%s: %s' % (attribute.key, attribute.value) for attribute in attributes)
+
+
+def attribute_facet(key):
+    return 'attr.' + key
+
+
+def _counted_keys():
+    return set(current_app.config['FACET_ATTRIBUTES'])
+
+
+# Adds deltas ({(facet, value): change}) to facet_count with one upsert, dropping values
+# no asset has any more. Relative updates keep concurrent writers from losing counts.
+def adjust_facet_counts(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    connection = db.session.connection()
+    table = FacetCount.__table__
+    rows = [{'facet': facet, 'value': value, 'assets': delta} for (facet, value), delta in sorted(deltas.items())]
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(connection.dialect.name)
+    if dialect is not None:
+        statement = dialect.insert(table)
+        connection.execute(statement.on_conflict_do_update(index_elements=['facet', 'value'],
+                                                           set_={'assets': table.c.assets + statement.excluded.assets}),
+                           rows)
+    else:
+        existing = set(connection.execute(select(table.c.facet, table.c.value)
+                                          .where(tuple_(table.c.facet, table.c.value).in_(list(deltas)))).all())
+        updates = [dict(row, k_facet=row['facet'], k_value=row['value']) for row in rows
+                   if (row['facet'], row['value']) in existing]
+        if updates:
+            connection.execute(table.update().where(table.c.facet == db.bindparam('k_facet'),
+                                                    table.c.value == db.bindparam('k_value'))
+                               .values(assets=table.c.assets + db.bindparam('assets')), updates)
+        inserts = [row for row in rows if (row['facet'], row['value']) not in existing]
+        if inserts:
+            connection.execute(table.insert(), inserts)
+    connection.execute(table.delete().where(tuple_(table.c.facet, table.c.value).in_(list(deltas)),
+                                            table.c.assets <= 0))
+
+
+# ({asset_id: {tag names}}, {asset_id: {key: (value, kind)}}) of the given assets
+def current_facets(asset_ids):
+    connection = db.session.connection()
+    tags, attributes = {}, {}
+    rows = connection.execute(select(asset_tag.c.asset_id, Tag.name).join(Tag, Tag.id == asset_tag.c.tag_id)
+                              .where(asset_tag.c.asset_id.in_(asset_ids)))
+    for asset_id, name in rows:
+        tags.setdefault(asset_id, set()).add(name)
+    rows = connection.execute(select(AssetAttribute.asset_id, AssetAttribute.key, AssetAttribute.value,
+                                     AssetAttribute.kind).where(AssetAttribute.asset_id.in_(asset_ids)))
+    for asset_id, key, value, kind in rows:
+        attributes.setdefault(asset_id, {})[key] = (value, kind)
+    return tags, attributes
+
+
+# {name: id} of the given tags, creating the missing ones
+def _tag_ids(names):
+    connection = db.session.connection()
+    ids = dict(connection.execute(select(Tag.name, Tag.id).where(Tag.name.in_(names))).all())
+    missing = [{'name': name} for name in sorted(set(names) - set(ids))]
+    if missing:
+        dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(connection.dialect.name)
+        if dialect is not None:
+            # Another transaction may be creating the same tag
+            connection.execute(dialect.insert(Tag.__table__).on_conflict_do_nothing(index_elements=['name']), missing)
+        else:
+            connection.execute(insert(Tag.__table__), missing)
+        ids = dict(connection.execute(select(Tag.name, Tag.id).where(Tag.name.in_(names))).all())
+    return ids
+
+
+def _count(deltas, tags, attributes, sign):
+    counted = _counted_keys()
+    for name in tags:
+        deltas[('tag', name)] += sign
+    for key, (value, kind) in attributes.items():
+        if key in counted:
+            deltas[(attribute_facet(key), value)] += sign
+
+
+# Replaces the tags and/or the attributes of an asset (None leaves them as they are),
+# as returned by clean_tags() and clean_attributes(). Runs in the session's transaction;
+# returns True when anything changed.
+def set_facets(asset_id, tags=None, attributes=None):
+    connection = db.session.connection()
+    current_tags, current_attributes = current_facets([asset_id])
+    old_tags, old_attributes = current_tags.get(asset_id, set()), current_attributes.get(asset_id, {})
+    deltas = Counter()
+    changed = False
+    if tags is not None:
+        added, removed = set(tags) - old_tags, old_tags - set(tags)
+        if removed:
+            connection.execute(delete(asset_tag).where(
+                asset_tag.c.asset_id == asset_id, asset_tag.c.tag_id.in_(select(Tag.id).where(Tag.name.in_(removed)))))
+        if added:
+            ids = _tag_ids(added)
+            connection.execute(insert(asset_tag), [{'asset_id': asset_id, 'tag_id': ids[name]} for name in sorted(added)])
+        _count(deltas, added, {}, 1)
+        _count(deltas, removed, {}, -1)
+        changed = bool(added or removed)
+    if attributes is not None:
+        removed = {key: value for key, value in old_attributes.items() if attributes.get(key) != value}
+        added = {key: value for key, value in attributes.items() if old_attributes.get(key) != value}
+        if removed:
+            connection.execute(delete(AssetAttribute.__table__).where(
+                AssetAttribute.asset_id == asset_id, AssetAttribute.key.in_(list(removed))))
+        if added:
+            connection.execute(insert(AssetAttribute.__table__), [
+                {'asset_id': asset_id, 'key': key, 'value': value, 'kind': kind}
+                for key, (value, kind) in sorted(added.items())])
+        _count(deltas, (), added, 1)
+        _count(deltas, (), removed, -1)
+        changed = changed or bool(added or removed)
+    adjust_facet_counts(deltas)
+    return changed
+
+
+# Deletes the tags and attributes of assets about to be deleted or archived and takes
+# them off the counts; returns them as current_facets() does
+def remove_facets(asset_ids):
+    if not asset_ids:
+        return {}, {}
+    connection = db.session.connection()
+    tags, attributes = current_facets(asset_ids)
+    deltas = Counter()
+    for asset_id in asset_ids:
+        _count(deltas, tags.get(asset_id, ()), attributes.get(asset_id, {}), -1)
+    if tags:
+        connection.execute(delete(asset_tag).where(asset_tag.c.asset_id.in_(list(tags))))
+    if attributes:
+        connection.execute(delete(AssetAttribute.__table__).where(AssetAttribute.asset_id.in_(list(attributes))))
+    adjust_facet_counts(deltas)
+    return tags, attributes
+
+
+@event.listens_for(db.session, 'before_flush')
+def _remove_deleted_facets(session, flush_context, instances):
+    # Before the rows go: PostgreSQL would cascade them away uncounted, SQLite would
+    # leave them behind
+    ids = [obj.id for obj in session.deleted if isinstance(obj, Asset) and obj.id is not None]
+    if ids:
+        remove_facets(ids)
+
+
+# Recomputes facet_count from the tag and attribute tables; returns the rows written
+def recount_facets():
+    table = FacetCount.__table__
+    db.session.execute(delete(table))
+    tags = (select(literal('tag'), Tag.name, func.count()).select_from(asset_tag)
+            .join(Tag, Tag.id == asset_tag.c.tag_id).group_by(Tag.name))
+    attributes = (select(literal('attr.') + AssetAttribute.key, AssetAttribute.value, func.count())
+                  .where(AssetAttribute.key.in_(sorted(_counted_keys())))
+                  .group_by(AssetAttribute.key, AssetAttribute.value))
+    written = 0
+    for statement in (tags, attributes):
+        written += db.session.execute(insert(table).from_select(['facet', 'value', 'assets'], statement)).rowcount
+    db.session.commit()
+    return written
+
+
+# The facets for the asset list: the most common values of each facet with their counts,
+# the ones selected in filters marked (and listed even when not among the most common)
+def facet_summary(filters):
+    config = current_app.config
+    facets = [('tag', 'Tags', filters.get('tag', []))]
+    for key in config['FACET_ATTRIBUTES']:
+        selected = filters.get(attribute_facet(key))
+        facets.append((attribute_facet(key), key.replace('_', ' ').capitalize(), [selected] if selected else []))
+    # One query for all facets: the top FACET_LIMIT values of each, plus the selected ones
+    rank = func.row_number().over(partition_by=FacetCount.facet,
+                                  order_by=(FacetCount.assets.desc(), FacetCount.value)).label('rank')
+    ranked = (select(FacetCount.facet, FacetCount.value, FacetCount.assets, rank)
+              .where(FacetCount.facet.in_([facet for facet, _, _ in facets])).subquery())
+    chosen = [(facet, value) for facet, _, selected in facets for value in selected]
+    condition = ranked.c.rank <= config['FACET_LIMIT']
+    if chosen:
+        condition = condition | tuple_(ranked.c.facet, ranked.c.value).in_(chosen)
+    counts = {}
+    rows = db.session.execute(select(ranked.c.facet, ranked.c.value, ranked.c.assets).where(condition)
+                              .order_by(ranked.c.facet, ranked.c.rank))
+    for facet, value, assets in rows:
+        counts.setdefault(facet, {})[value] = assets
+    summary = []
+    for facet, label, selected in facets:
+        values = counts.get(facet, {})
+        values = [{'value': value, 'assets': values.get(value, 0), 'selected': value in selected}
+                  for value in list(values) + [value for value in selected if value not in values]]
+        if values:
+            summary.append({'facet': facet, 'label': label, 'values': values})
+    return summary
+
+
+# Filters with value of facet switched on or off; tags combine, an attribute has one value
+def toggle_filter(filters, facet, value):
+    filters = {key: value for key, value in filters.items() if key != 'cursor'}
+    if facet == 'tag':
+        tags = set(filters.get('tag', []))
+        tags.symmetric_difference_update([value])
+        if tags:
+            filters['tag'] = sorted(tags)
+        else:
+            filters.pop('tag', None)
+    elif filters.get(facet) == value:
+        del filters[facet]
+    else:
+        filters[facet] = value
+    return filters
+
+
+# Tag names and {key: typed value} of an asset or an archived asset
+def tag_names(asset):
+    if isinstance(asset, Asset):
+        return [tag.name for tag in asset.tags]
+    return list(asset.tags or [])
+
+
+def attribute_values(asset):
+    if isinstance(asset, Asset):
+        return {attribute.key: typed(attribute.value, attribute.kind) for attribute in asset.attributes}
+    return {attribute['key']: typed(attribute['value'], attribute['kind']) for attribute in asset.attributes or []}
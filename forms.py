@@ -1,6 +1,14 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, TextAreaField
-from wtforms.validators import DataRequired, Length, EqualTo, ValidationError, Regexp
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, PasswordField, TextAreaField, SelectField, IntegerField, SubmitField, BooleanField
+from wtforms.validators import DataRequired, Length, EqualTo, ValidationError, Regexp, Optional
+from models import db, User, Asset
+from facets import FacetError, clean_tags, parse_attribute_lines
+
+# Asset field limits, shared with the bulk importer so both apply the same rules. They are
+# the column lengths, so a value that passes validation always fits the table.
+ASSET_NAME_MAX_LENGTH = Asset.__table__.c.name.type.length
+ASSET_DESCRIPTION_MAX_LENGTH = Asset.__table__.c.description.type.length
 
 # Form for user registration, collecting username and password inputs
 class RegistrationForm(FlaskForm):
@@ -17,7 +25,6 @@ class RegistrationForm(FlaskForm):
     
     # Custom validator to ensure the username is unique
     def validate_username(self, username):
-        from app import User
         user = User.query.filter_by(username=username.data).first()
         if user:
             raise ValidationError('Username already exists.')
@@ -29,9 +36,12 @@ class LoginForm(FlaskForm):
 
 # Form for creating or editing an asset, with fields for name and description
 class AssetForm(FlaskForm):
-    name = StringField('Asset Name', validators=[DataRequired(), Length(max=200)])
-    # Limits the description to 500 characters
-    description = TextAreaField('Description', validators=[Length(max=500)])
+    name = StringField('Asset Name', validators=[DataRequired(), Length(max=ASSET_NAME_MAX_LENGTH)])
+    # Limits the description to the column length
+    description = TextAreaField('Description', validators=[Length(max=ASSET_DESCRIPTION_MAX_LENGTH)])
+    # Comma separated tags, and one "name: value" attribute per line (see facets.py)
+    tag_list = StringField('Tags')
+    attribute_lines = TextAreaField('Attributes')
 
     def __init__(self, *args, **kwargs):
         # Initializes the form, allowing passing of an original asset name
@@ -39,9 +49,52 @@ class AssetForm(FlaskForm):
         super(AssetForm, self).__init__(*args, **kwargs)
 
     def validate_name(self, field):
-        # Custom validator to ensure the asset name is unique if changed
+        # Fast pre-check that the asset name is unique if changed; the unique index on
+        # asset.name enforces it when the row is written
         if field.data != self.original_name:
-            from app import Asset
-            asset = Asset.query.filter_by(name=field.data).first()
-            if asset:
-                raise ValidationError('An asset with this name already exists.')
\ No newline at end of file
+            if db.session.query(Asset.id).filter_by(name=field.data).first():
+                raise ValidationError('An asset with this name already exists.')
+
+    def validate_tag_list(self, field):
+        try:
+            self.tags = clean_tags(field.data or '')
+        except FacetError as exc:
+            raise ValidationError(str(exc))
+
+    def validate_attribute_lines(self, field):
+        try:
+            self.attributes = parse_attribute_lines(field.data)
+        except FacetError as exc:
+            raise ValidationError(str(exc))
+
+# Form for uploading a CSV, JSON or NDJSON file of assets to import in bulk
+class ImportForm(FlaskForm):
+    file = FileField('Asset File', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'json', 'ndjson', 'jsonl'], 'Upload a CSV, JSON or NDJSON file.')
+    ])
+    # Large files are better imported by a background worker than inside the request
+    background = BooleanField('Import in the background')
+
+# Form for applying one admin action to the selected assets, or to every asset matching
+# the list filters; the checkboxes on the list page submit their ids along with it
+class BulkActionForm(FlaskForm):
+    action = SelectField('Action', choices=[('delete', 'Delete'), ('reassign', 'Reassign owner'),
+                                            ('describe', 'Set description')])
+    scope = SelectField('Apply to', choices=[('selected', 'Selected assets'), ('filtered', 'All assets matching the filters')])
+    owner_id = IntegerField('New owner ID', validators=[Optional()])
+    description = TextAreaField('New description', validators=[Length(max=ASSET_DESCRIPTION_MAX_LENGTH)])
+    preview = SubmitField('Preview')
+    apply = SubmitField('Apply')
+
+    def validate_owner_id(self, field):
+        if self.action.data == 'reassign':
+            if field.data is None:
+                raise ValidationError('Enter the ID of the new owner.')
+            if db.session.get(User, field.data) is None:
+                raise ValidationError('No user has this ID.')
+
+# Form for attaching a document or photo to an asset
+class AttachmentForm(FlaskForm):
+    file = FileField('File', validators=[FileRequired()])
+
@@ -0,0 +1,157 @@
+from flask import current_app, has_app_context
+from markupsafe import Markup
+from sqlalchemy import event
+from cache import TTLCache, MISSING
+from models import db, User, Asset, ArchivedAsset
+
+# Per-worker cache of rendered asset table rows. Most assets do not change between two
+# requests for the asset list, so a row's HTML (dates formatted, links built, the admin
+# buttons decided) is rendered once per (asset, role) and reused until the asset changes.
+#
+# Entries are keyed by asset id and stamped with the row's version, owner name and
+# creation time (archiving time for archived rows), so a row is re-rendered as soon as a
+# page is loaded with a newer version, whichever worker changed it. The timestamp tells
+# apart a new row that took the id of a deleted one (SQLite reuses the highest id), which
+# starts at version 1 again. Committed ORM updates and deletes in this worker also drop
+# their rows right away, and bulk UPDATE or DELETE statements drop every row. The cache
+# holds at most FRAGMENT_CACHE_SIZE assets, evicting the least recently used;
+# FRAGMENT_CACHE_SIZE = 0 turns it off.
+#
+# PAGE_CACHE_SIZE > 0 also caches whole table pages (the rows and the next cursor) per
+# filters, page and role, skipping the page query altogether. Any committed asset change
+# in the worker clears them, but other workers only notice after PAGE_CACHE_TTL seconds,
+# so it is off by default and meant for read-heavy installs that accept that delay.
+
+ROW_TEMPLATE = '_asset_row.html'
+
+
+class FragmentCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 20000)
+        app.config.setdefault('FRAGMENT_CACHE_TTL', 3600)
+        app.config.setdefault('PAGE_CACHE_SIZE', 0)
+        app.config.setdefault('PAGE_CACHE_TTL', 30)
+        self.rows = TTLCache(maxsize=app.config['FRAGMENT_CACHE_SIZE'], ttl=app.config['FRAGMENT_CACHE_TTL'])
+        self.pages = TTLCache(maxsize=app.config['PAGE_CACHE_SIZE'], ttl=app.config['PAGE_CACHE_TTL'])
+        app.extensions['fragment_cache'] = self
+
+    def clear(self):
+        self.rows.clear()
+        self.pages.clear()
+
+    # Drops the rows of assets changed in a commit (keys as _row_key) and, since rows may
+    # have entered or left their filters, every cached page
+    def invalidate(self, keys, all_rows=False):
+        if all_rows:
+            self.rows.clear()
+        else:
+            for key in keys:
+                self.rows.pop(key)
+        self.pages.clear()
+
+    # The <tr> of an asset or archived asset as seen by role. Rows with a checked bulk
+    # checkbox are rendered every time rather than cached.
+    def row(self, asset, role, bulk=False, checked=False):
+        if checked or not self.rows.maxsize:
+            return _render_row(asset, role, bulk, checked)
+        key = _row_key(asset)
+        stamp = _stamp(asset)
+        variant = (role, bulk)
+        entry = self.rows.get(key)
+        if entry is not None and entry['stamp'] == stamp and variant in entry:
+            return entry[variant]
+        html = _render_row(asset, role, bulk)
+        # Entries are replaced rather than changed in place, as other threads may be reading them
+        variants = dict(entry) if entry is not None and entry['stamp'] == stamp else {'stamp': stamp}
+        variants[variant] = html
+        self.rows.set(key, variants)
+        return html
+
+    def rows_for(self, assets, role, bulk=False, selected=()):
+        return [self.row(asset, role, bulk, not isinstance(asset, ArchivedAsset) and asset.id in selected)
+                for asset in assets]
+
+    # (rows, next cursor) of a table page: load() returns (assets, next cursor) and runs only
+    # when the page is not cached. key identifies the page, filters included.
+    def page(self, key, load, role, bulk=False, selected=()):
+        key = (role, bulk) + key
+        cacheable = self.pages.maxsize and not selected
+        if cacheable:
+            page = self.pages.get(key, MISSING)
+            if page is not MISSING:
+                return page
+        assets, next_cursor = load()
+        page = (self.rows_for(assets, role, bulk, selected), next_cursor)
+        if cacheable:
+            self.pages.set(key, page)
+        return page
+
+
+def get_fragment_cache():
+    return current_app.extensions['fragment_cache']
+
+
+def _row_key(asset):
+    return ('archive' if isinstance(asset, ArchivedAsset) else 'asset', asset.id)
+
+
+# What tells apart two renderings of the row under one key
+def _stamp(asset):
+    created = asset.archived_at if isinstance(asset, ArchivedAsset) else asset.date_created
+    return (asset.version, created, asset.owner.username)
+
+
+def _render_row(asset, role, bulk, checked=False):
+    template = current_app.jinja_env.get_template(ROW_TEMPLATE)
+    return Markup(template.render(asset=asset, role=role, bulk=bulk, checked=checked))
+
+
+# A hashable cache key for parsed filters, whose tag filter is a list
+def filters_key(filters):
+    return tuple(sorted((key, tuple(value) if isinstance(value, list) else value) for key, value in filters.items()))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changed_rows(session, flush_context):
+    changes = session.info.setdefault('fragment_cache_changed', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Asset, ArchivedAsset)):
+            changes.add(_row_key(obj))
+        elif isinstance(obj, User):
+            # Owner names are part of the row stamp, but cached pages would keep the old one
+            session.info['fragment_cache_pages'] = True
+    if any(isinstance(obj, (Asset, ArchivedAsset)) for obj in session.new):
+        session.info['fragment_cache_pages'] = True
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _bulk_asset_statement(orm_execute_state):
+    # ORM or Core statements alike, e.g. the importer's INSERTs into asset.__table__
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if getattr(table, 'name', None) not in (Asset.__tablename__, ArchivedAsset.__tablename__):
+        return
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['fragment_cache_stale'] = True
+    elif orm_execute_state.is_insert:
+        orm_execute_state.session.info['fragment_cache_pages'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_rows(session):
+    changed = session.info.pop('fragment_cache_changed', set())
+    stale = session.info.pop('fragment_cache_stale', False)
+    pages = session.info.pop('fragment_cache_pages', False)
+    if not (changed or stale or pages) or not has_app_context() or 'fragment_cache' not in current_app.extensions:
+        return
+    get_fragment_cache().invalidate(changed, all_rows=stale)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_changed_rows(session, previous_transaction):
+    if not previous_transaction.nested:
+        for key in ('fragment_cache_changed', 'fragment_cache_stale', 'fragment_cache_pages'):
+            session.info.pop(key, None)
@@ -0,0 +1,282 @@
+import codecs
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DataError, IntegrityError
+from forms import ASSET_NAME_MAX_LENGTH, ASSET_DESCRIPTION_MAX_LENGTH
+from models import db, User, Asset, is_name_conflict
+from changes import record_changes
+from owners import adjust_asset_counts, owner_deltas
+
+# Bulk asset import from CSV, JSON (an array of objects) or NDJSON files. Files are parsed
+# as a stream, validated with the same rules as AssetForm and written with executemany
+# INSERTs, one transaction per batch, so memory use doesn't grow with the file size.
+
+FORMATS = ('csv', 'json', 'ndjson')
+
+# Keep at most this many row errors in memory; the total is still counted
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFailed(ValueError):
+    pass
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.elapsed = 0.0
+        # Line (or record number) of the last record in a committed batch
+        self.last_line = 0
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def rows_per_second(self):
+        return self.inserted / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return '%d assets imported, %d rows rejected in %.2fs (%.0f rows/s)' % (
+            self.inserted, self.failed, self.elapsed, self.rows_per_second)
+
+
+# Picks the file format from its extension
+def detect_format(filename):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension == 'jsonl':
+        return 'ndjson'
+    if extension not in FORMATS:
+        raise ImportFailed('Unsupported file type: %s' % (extension or 'unknown'))
+    return extension
+
+
+def _read_csv(stream):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for record in reader:
+        # The header is line 1
+        yield reader.line_num, record
+
+
+def _read_ndjson(stream):
+    for line_no, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8-sig'), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as exc:
+            yield line_no, RowError('Invalid JSON: %s' % exc)
+
+
+def _read_json_array(stream, chunk_size=64 * 1024):
+    # Decodes the objects of a top-level JSON array one at a time from fixed-size
+    # chunks, so the whole document is never held in memory
+    decoder = json.JSONDecoder()
+    reader = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer, started, index = '', False, 0
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += reader.decode(chunk, final=not chunk)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise ImportFailed('A JSON import must be an array of objects.')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if not chunk:
+                    raise ImportFailed('Truncated or invalid JSON after record %d.' % index)
+                # The object continues in the next chunk
+                break
+            index += 1
+            position = end
+            yield index, record
+        buffer = buffer[position:]
+        if not chunk:
+            if started:
+                raise ImportFailed('Unterminated JSON array.')
+            return
+
+
+# Yields (line or record number, dict) pairs from a binary stream
+def read_records(stream, fmt):
+    if fmt == 'csv':
+        return _read_csv(stream)
+    if fmt == 'ndjson':
+        return _read_ndjson(stream)
+    if fmt == 'json':
+        return _read_json_array(stream)
+    raise ImportFailed('Unsupported format: %s' % fmt)
+
+
+# Checks name and description against the AssetForm rules and returns them stripped
+def clean_fields(record, partial=False):
+    if not isinstance(record, dict):
+        raise RowError('Expected an object with a name field.')
+    cleaned = {}
+    for key in ('name', 'description'):
+        if partial and key not in record:
+            continue
+        value = record.get(key) or ''
+        if not isinstance(value, str):
+            raise RowError('%s must be text.' % key)
+        cleaned[key] = value.strip()
+    if 'name' in cleaned:
+        if not cleaned['name']:
+            raise RowError('Name is required.')
+        if len(cleaned['name']) > ASSET_NAME_MAX_LENGTH:
+            raise RowError('Name must be at most %d characters.' % ASSET_NAME_MAX_LENGTH)
+    if len(cleaned.get('description', '')) > ASSET_DESCRIPTION_MAX_LENGTH:
+        raise RowError('Description must be at most %d characters.' % ASSET_DESCRIPTION_MAX_LENGTH)
+    return cleaned
+
+
+class AssetValidator:
+    # Validates records against the AssetForm rules. Existing names and usernames are
+    # loaded once up front, so uniqueness and owner checks never query per row.
+    def __init__(self, default_owner):
+        self.default_owner = default_owner
+        self.names = set(db.session.execute(select(Asset.name).execution_options(yield_per=10000)).scalars())
+        self.owners = dict(db.session.execute(select(User.username, User.id)).all())
+        self.owner_ids = set(self.owners.values())
+
+    def _owner_id(self, record):
+        owner = record.get('owner')
+        if owner not in (None, ''):
+            if owner not in self.owners:
+                raise RowError('Unknown owner %r.' % owner)
+            return self.owners[owner]
+        owner_id = record.get('owner_id')
+        if owner_id not in (None, ''):
+            try:
+                owner_id = int(owner_id)
+            except (TypeError, ValueError):
+                raise RowError('owner_id must be an integer.')
+            if owner_id not in self.owner_ids:
+                raise RowError('Unknown owner_id %d.' % owner_id)
+            return owner_id
+        return self.default_owner.id
+
+    # Returns the column values for a valid record, or raises RowError
+    def validate(self, record):
+        if isinstance(record, RowError):
+            raise record
+        fields = clean_fields(record)
+        name = fields['name']
+        if name in self.names:
+            raise RowError('An asset with this name already exists.')
+        values = {
+            'name': name,
+            'description': fields['description'],
+            'owner_id': self._owner_id(record),
+            'created_by': self.default_owner.username,
+            'date_created': datetime.utcnow(),
+        }
+        if record.get('date_created'):
+            try:
+                values['date_created'] = datetime.fromisoformat(str(record['date_created']))
+            except ValueError:
+                raise RowError('date_created must be an ISO 8601 timestamp.')
+        self.names.add(name)
+        return values
+
+
+# Writes one batch with a single executemany INSERT and commits it. If another writer
+# took one of the names meanwhile, the unique index rejects the whole batch, and a value
+# the database refuses (DataError, e.g. too long for its column) does the same; the batch
+# is then retried row by row so only the offending rows are reported. Returns rows inserted.
+def _insert(batch):
+    # Bulk inserts bypass the flush, so the change feed entries and owner counts are written here
+    ids = db.session.scalars(insert(Asset).returning(Asset.id, sort_by_parameter_order=True), batch).all()
+    record_changes('create', [dict(values, id=asset_id) for asset_id, values in zip(ids, batch)])
+    adjust_asset_counts(owner_deltas(batch))
+
+
+def _flush_batch(batch, lines, result):
+    try:
+        _insert(batch)
+        db.session.commit()
+        return len(batch)
+    except (IntegrityError, DataError):
+        db.session.rollback()
+    inserted = 0
+    for line, values in zip(lines, batch):
+        try:
+            _insert([values])
+            db.session.commit()
+            inserted += 1
+        except IntegrityError as exc:
+            db.session.rollback()
+            if not is_name_conflict(exc):
+                raise
+            result.add_error(line, 'An asset with this name already exists.')
+        except DataError:
+            db.session.rollback()
+            result.add_error(line, 'A value does not fit its column.')
+    return inserted
+
+
+# Imports (line, record) pairs on behalf of `owner`, who becomes the owner of records
+# that don't name one. Valid records are inserted in batches of batch_size; invalid
+# ones are reported in the result and skipped. progress(result) is called after each
+# committed batch. Records up to line start_after are skipped, to resume an import that
+# committed them before it stopped.
+def import_records(records, owner, batch_size=1000, progress=None, start_after=None):
+    result = ImportResult()
+    started = time.perf_counter()
+    validator = AssetValidator(owner)
+    batch, lines = [], []
+    try:
+        for line, record in records:
+            if start_after is not None and line <= start_after:
+                continue
+            try:
+                batch.append(validator.validate(record))
+                lines.append(line)
+            except RowError as exc:
+                result.add_error(line, str(exc))
+                continue
+            if len(batch) >= batch_size:
+                result.inserted += _flush_batch(batch, lines, result)
+                result.last_line = lines[-1]
+                batch, lines = [], []
+                if progress:
+                    progress(result)
+        if batch:
+            result.inserted += _flush_batch(batch, lines, result)
+            result.last_line = lines[-1]
+    finally:
+        result.elapsed = time.perf_counter() - started
+    return result
+
+
+# Imports assets from a binary stream in one of FORMATS
+def import_assets(stream, fmt, owner, batch_size=1000, progress=None, start_after=None):
+    try:
+        return import_records(read_records(stream, fmt), owner, batch_size=batch_size, progress=progress,
+                              start_after=start_after)
+    except (csv.Error, UnicodeDecodeError) as exc:
+        db.session.rollback()
+        raise ImportFailed('Could not read file: %s' % exc)
@@ -0,0 +1,384 @@
+import multiprocessing
+import os
+import shutil
+import socket
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update
+from models import db, User, Job
+
+# Background jobs for work too slow for a request: large imports, exports and reports.
+# Jobs are rows in the job table, so no broker is needed. `flask jobs worker` claims
+# runnable rows with a conditional UPDATE (safe with several workers), runs them in a
+# process pool and records progress, results and errors back on the row. Result files
+# live under JOB_DIR/<job id>/. A failed job is retried with exponential backoff until
+# max_attempts; handlers raise JobFailed for errors a retry cannot fix, and save a
+# checkpoint when a retry should resume rather than start over.
+
+# kind -> function(context) returning a JSON-serialisable result
+HANDLERS = {}
+
+FINISHED = ('succeeded', 'failed')
+
+
+class JobFailed(Exception):
+    pass
+
+
+# Registers a job handler under kind
+def handler(kind):
+    def register(f):
+        HANDLERS[kind] = f
+        return f
+    return register
+
+
+class JobQueue:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOB_DIR', os.path.join(app.instance_path, 'jobs'))
+        app.config.setdefault('JOB_WORKER_PROCESSES', 2)
+        app.config.setdefault('JOB_MAX_ATTEMPTS', 3)
+        # Retry n waits JOB_RETRY_BACKOFF * 2 ** (n - 1) seconds, at most JOB_RETRY_BACKOFF_MAX
+        app.config.setdefault('JOB_RETRY_BACKOFF', 10)
+        app.config.setdefault('JOB_RETRY_BACKOFF_MAX', 3600)
+        # Running jobs whose worker has not been heard from for this long are retried
+        app.config.setdefault('JOB_STALE_SECONDS', 300)
+        app.extensions['jobs'] = self
+
+
+def job_dir(job_id):
+    return os.path.join(current_app.config['JOB_DIR'], str(job_id))
+
+
+def enqueue(kind, payload, user=None, max_attempts=None):
+    if kind not in HANDLERS:
+        raise ValueError('Unknown job kind: %s' % kind)
+    job = Job(kind=kind, payload=payload, created_by_id=user.id if user else None,
+              max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS'])
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result': job.result,
+        'has_result_file': bool(job.result_path),
+        'error': job.error.splitlines()[-1] if job.error else None,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'run_after': job.run_after.isoformat() if job.status == 'queued' else None,
+    }
+
+
+# True when user may see the job: its creator, or any admin
+def can_view(job, user):
+    return user.role == 'admin' or job.created_by_id == user.id
+
+
+def result_file(job):
+    return os.path.join(current_app.config['JOB_DIR'], job.result_path) if job.result_path else None
+
+
+def _set(job_id, **values):
+    db.session.execute(update(Job).where(Job.id == job_id).values(**values)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+
+
+# Handed to handlers: the payload plus ways to report progress and write result files
+class JobContext:
+    def __init__(self, job):
+        self.job_id = job.id
+        self.kind = job.kind
+        self.payload = job.payload
+        self.attempt = job.attempts
+        self.user = db.session.get(User, job.created_by_id) if job.created_by_id else None
+        # What the last attempt saved with save_checkpoint(), or None
+        self.checkpoint = job.checkpoint
+        self.result_path = None
+        self._reported = 0.0
+
+    # Records progress (a percentage, or None when unknown) and a short message. Writes
+    # are throttled to one a second; call it between transactions of the handler's own work.
+    def progress(self, percent=None, message=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._reported < 1.0:
+            return
+        self._reported = now
+        _set(self.job_id, progress=None if percent is None else max(0, min(100, int(percent))),
+             message=(message or '')[:200] or None, heartbeat_at=datetime.utcnow())
+
+    # Saves where the job got to, for a retry to resume from. Call it after committing the
+    # work it describes.
+    def save_checkpoint(self, value):
+        self.checkpoint = value
+        _set(self.job_id, checkpoint=value, heartbeat_at=datetime.utcnow())
+
+    # Path for a result file of this job; the last one asked for is offered for download
+    def result_file(self, filename):
+        directory = job_dir(self.job_id)
+        os.makedirs(directory, exist_ok=True)
+        self.result_path = os.path.join(str(self.job_id), filename)
+        return os.path.join(directory, filename)
+
+
+def _backoff(attempts):
+    config = current_app.config
+    return min(config['JOB_RETRY_BACKOFF'] * 2 ** max(attempts - 1, 0), config['JOB_RETRY_BACKOFF_MAX'])
+
+
+# Records a failed attempt: back to the queue after a backoff delay, or failed for good
+def _fail(job_id, error, permanent=False):
+    db.session.rollback()
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return
+    now = datetime.utcnow()
+    if permanent or job.attempts >= job.max_attempts:
+        _set(job_id, status='failed', error=error, finished_at=now, worker=None)
+    else:
+        _set(job_id, status='queued', error=error, worker=None, run_after=now + timedelta(seconds=_backoff(job.attempts)))
+
+
+# Atomically moves the oldest runnable queued job to running; returns its id or None
+def claim_next(worker):
+    now = datetime.utcnow()
+    candidates = (db.session.query(Job.id).filter(Job.status == 'queued', Job.run_after <= now)
+                  .order_by(Job.run_after, Job.id).limit(5).all())
+    for job_id, in candidates:
+        # Another worker may claim the same row first; then the UPDATE matches nothing
+        claimed = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', attempts=Job.attempts + 1, worker=worker, heartbeat_at=now,
+                    started_at=now, progress=None, message=None)
+            .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+    db.session.rollback()
+    return None
+
+
+# Runs one claimed job to completion in the current app context
+def run_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None or job.status != 'running':
+        return
+    context = JobContext(job)
+    try:
+        result = HANDLERS[job.kind](context)
+    except JobFailed as exc:
+        _fail(job_id, str(exc), permanent=True)
+    except Exception:
+        _fail(job_id, traceback.format_exc())
+    else:
+        db.session.rollback()
+        _set(job_id, status='succeeded', result=result, result_path=context.result_path, progress=100,
+             finished_at=datetime.utcnow(), heartbeat_at=datetime.utcnow(), error=None, worker=None)
+    finally:
+        db.session.rollback()
+
+
+# Requeues (or fails) running jobs whose worker stopped sending heartbeats
+def recover_stale():
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_STALE_SECONDS'])
+    stale = [job_id for job_id, in db.session.query(Job.id).filter(Job.status == 'running', Job.heartbeat_at < cutoff)]
+    for job_id in stale:
+        _fail(job_id, 'The worker running this job stopped responding.')
+    return len(stale)
+
+
+def _heartbeat(job_ids):
+    if job_ids:
+        db.session.execute(update(Job).where(Job.id.in_(job_ids), Job.status == 'running')
+                           .values(heartbeat_at=datetime.utcnow()).execution_options(synchronize_session=False))
+        db.session.commit()
+
+
+# The app a pool process runs jobs in; forked children inherit it, and db_profiles
+# disposes the inherited connection pools so each child opens its own connections
+_worker_app = None
+
+
+def _run_in_child(job_id):
+    with _worker_app.app_context():
+        try:
+            run_job(job_id)
+        finally:
+            db.session.remove()
+
+
+# Claims and runs jobs until stopped, `processes` at a time. processes=0 runs jobs inline
+# in this process, as do platforms without fork(), where pool processes could not inherit
+# the app. With once=True it returns when no job is runnable; max_jobs stops it after that
+# many jobs. Returns the number of jobs run.
+def work(processes=None, poll_interval=1.0, once=False, max_jobs=None, log=None):
+    global _worker_app
+    app = current_app._get_current_object()
+    processes = app.config['JOB_WORKER_PROCESSES'] if processes is None else processes
+    worker = '%s:%d' % (socket.gethostname(), os.getpid())
+    log = log or (lambda message: None)
+    if processes and 'fork' not in multiprocessing.get_all_start_methods():
+        log('Processes cannot be forked on this platform; running jobs one at a time in this process.')
+        processes = 0
+    recover_stale()
+    done = 0
+    if processes == 0:
+        while max_jobs is None or done < max_jobs:
+            job_id = claim_next(worker)
+            if job_id is None:
+                if once:
+                    break
+                recover_stale()
+                time.sleep(poll_interval)
+                continue
+            log('Running job %d' % job_id)
+            run_job(job_id)
+            done += 1
+        return done
+
+    _worker_app = app
+    pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork'))
+    running = {}
+    try:
+        while True:
+            while len(running) < processes and (max_jobs is None or done + len(running) < max_jobs):
+                job_id = claim_next(worker)
+                if job_id is None:
+                    break
+                log('Running job %d' % job_id)
+                running[pool.submit(_run_in_child, job_id)] = job_id
+            if not running:
+                if once or (max_jobs is not None and done >= max_jobs):
+                    break
+                recover_stale()
+                time.sleep(poll_interval)
+                continue
+            finished, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job_id = running.pop(future)
+                done += 1
+                try:
+                    future.result()
+                except BrokenProcessPool:
+                    _fail(job_id, 'The process running this job died.')
+                    pool.shutdown(cancel_futures=True)
+                    pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork'))
+                except Exception:
+                    _fail(job_id, traceback.format_exc())
+            _heartbeat(list(running.values()))
+    finally:
+        pool.shutdown(wait=True)
+    return done
+
+
+# Deletes finished jobs older than days, with their result files; returns how many
+def prune_jobs(days):
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    jobs = Job.query.filter(Job.status.in_(FINISHED), Job.finished_at < cutoff).all()
+    for job in jobs:
+        shutil.rmtree(job_dir(job.id), ignore_errors=True)
+        # Uploads of imports that never succeeded are still on disk
+        if job.kind == 'import' and os.path.exists(job.payload['path']):
+            os.remove(job.payload['path'])
+        db.session.delete(job)
+    db.session.commit()
+    return len(jobs)
+
+
+# Built-in handlers
+
+@handler('import')
+# payload: path (an uploaded file copied under JOB_DIR/uploads), format, batch_size. Each
+# committed batch is checkpointed, so a retry skips the rows it already imported instead
+# of rejecting them as duplicates; a batch committed just before a crash is the exception.
+def import_job(context):
+    from importer import import_assets, ImportFailed, MAX_REPORTED_ERRORS
+    if context.user is None:
+        raise JobFailed('The user who queued this import no longer exists.')
+    path = context.payload['path']
+    size = os.path.getsize(path) or 1
+    done = context.checkpoint or {'line': 0, 'inserted': 0, 'failed': 0, 'errors': []}
+
+    # Totals of the earlier attempts plus this one's
+    def totals(result):
+        return {'line': result.last_line or done['line'], 'inserted': done['inserted'] + result.inserted,
+                'failed': done['failed'] + result.failed,
+                'errors': (done['errors'] + [[line, message] for line, message in result.errors])[:MAX_REPORTED_ERRORS]}
+
+    try:
+        with open(path, 'rb') as stream:
+            def progress(result):
+                context.save_checkpoint(totals(result))
+                context.progress(100.0 * stream.tell() / size, '%d rows imported' % context.checkpoint['inserted'])
+            result = import_assets(stream, context.payload['format'], context.user,
+                                   batch_size=context.payload.get('batch_size', 5000), progress=progress,
+                                   start_after=done['line'])
+    except ImportFailed as exc:
+        raise JobFailed(str(exc))
+    os.remove(path)
+    final = totals(result)
+    result.inserted, result.failed = final['inserted'], final['failed']
+    return {'inserted': final['inserted'], 'failed': final['failed'], 'summary': result.summary(),
+            'errors': final['errors']}
+
+
+@handler('export')
+# payload: filters, format, gzip, chunk_size
+def export_job(context):
+    from exporter import export_assets, ExportFailed, FORMATS
+    from compression import gzip_stream
+    payload = context.payload
+    try:
+        chunks = export_assets(payload.get('filters') or {}, payload['format'], chunk_size=payload.get('chunk_size', 5000))
+    except ExportFailed as exc:
+        raise JobFailed(str(exc))
+    filename = 'assets-%d.%s' % (context.job_id, FORMATS[payload['format']][1])
+    if payload.get('gzip'):
+        chunks, filename = gzip_stream(chunks), filename + '.gz'
+    # The export streams from an open cursor, so progress can't be written until it ends
+    context.progress(None, 'Exporting', force=True)
+    written = 0
+    with open(context.result_file(filename), 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+    return {'bytes': written, 'filename': filename}
+
+
+@handler('report')
+# payload: rebuild (recount from the asset table rather than catch up with the change feed)
+def report_job(context):
+    from reports import rebuild, refresh
+    if context.payload.get('rebuild'):
+        context.progress(None, 'Rebuilding the report summaries', force=True)
+        return {'assets': rebuild()}
+    context.progress(None, 'Refreshing the report summaries', force=True)
+    return {'changes': refresh()}
+
+
+# Saves an uploaded file where the worker can read it and queues its import
+def enqueue_import(upload, fmt, user, batch_size):
+    directory = os.path.join(current_app.config['JOB_DIR'], 'uploads')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '%s-%d.%s' % (datetime.utcnow().strftime('%Y%m%d%H%M%S%f'), user.id, fmt))
+    upload.save(path)
+    return enqueue('import', {'path': path, 'format': fmt, 'batch_size': batch_size,
+                              'filename': os.path.basename(upload.filename or '')}, user=user)
@@ -0,0 +1,212 @@
+import bisect
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import Response, abort, current_app, g, has_app_context, has_request_context, request
+from flask import before_render_template, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Built-in request instrumentation: per-route latency, SQL query count and time per
+# request, template render time and password hashing time, exposed in the Prometheus
+# text format on /metrics. Values are kept per process, so with several gunicorn
+# workers each scrape reports the worker that answered it. The endpoint is off unless
+# METRICS_ENABLED is set, and then only answers admins, logged in or sending an admin's
+# API token as "Authorization: Bearer <token>" (Prometheus' authorization setting).
+
+logger = logging.getLogger('asset_manager.slow')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # {label tuple: [bucket counts..., sum, count]}
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series.setdefault(key, [0] * (len(self.buckets) + 2))
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name, _labels(key, le=_number(bound)), cumulative))
+            lines.append('%s_bucket%s %d' % (self.name, _labels(key, le='+Inf'), series[-1]))
+            lines.append('%s_sum%s %s' % (self.name, _labels(key), _number(series[-2])))
+            lines.append('%s_count%s %d' % (self.name, _labels(key), series[-1]))
+        return lines
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(key, **extra):
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = ('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs)
+    return '{%s}' % ','.join(escaped)
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.request_duration = Histogram('http_request_duration_seconds', 'Request latency by route.')
+        self.request_queries = Histogram('http_request_sql_queries', 'SQL statements executed per request.', QUERY_COUNT_BUCKETS)
+        self.request_sql_time = Histogram('http_request_sql_seconds', 'Time spent in SQL per request.')
+        self.template_time = Histogram('template_render_seconds', 'Template render time.')
+        self.password_hash_time = Histogram('password_hash_seconds', 'Password hashing and verification time.')
+        self.histograms = [self.request_duration, self.request_queries, self.request_sql_time,
+                           self.template_time, self.password_hash_time]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', False)
+        # Log requests slower than this many milliseconds with their SQL; 0 disables
+        app.config.setdefault('SLOW_REQUEST_MS', 0)
+        app.extensions['metrics'] = self
+        app.before_request(_start_request)
+        app.after_request(_record_status)
+        app.teardown_request(_finish_request)
+        before_render_template.connect(_template_started, app)
+        template_rendered.connect(_template_finished, app)
+        app.add_url_rule('/metrics', 'metrics', _metrics_view)
+
+    def observe(self, histogram, value, **labels):
+        with self.lock:
+            histogram.observe(value, **labels)
+
+    def render(self):
+        with self.lock:
+            lines = [line for histogram in self.histograms for line in histogram.render()]
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics():
+    return current_app.extensions['metrics']
+
+
+# Times the enclosed block into one of the histograms, e.g. timed('password_hash_time', operation='check')
+@contextmanager
+def timed(histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_app_context() and 'metrics' in current_app.extensions:
+            metrics = get_metrics()
+            metrics.observe(getattr(metrics, histogram), time.perf_counter() - started, **labels)
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    # Statements are only kept when the slow request log is on
+    g.sql_statements = [] if current_app.config['SLOW_REQUEST_MS'] else None
+
+
+def _record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _finish_request(exc):
+    # Runs when the request context is popped, which for stream_with_context responses
+    # is after the last chunk, so streamed pages are timed in full
+    if not has_app_context():
+        return
+    started = g.pop('metrics_started', None)
+    if started is None or request.endpoint == 'metrics':
+        return
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    status = g.pop('metrics_status', 500 if exc else 200)
+    metrics = get_metrics()
+    metrics.observe(metrics.request_duration, elapsed, endpoint=endpoint, method=request.method, status=status)
+    metrics.observe(metrics.request_queries, g.sql_count, endpoint=endpoint)
+    metrics.observe(metrics.request_sql_time, g.sql_time, endpoint=endpoint)
+    threshold = current_app.config['SLOW_REQUEST_MS']
+    if threshold and elapsed * 1000 >= threshold:
+        _log_slow_request(elapsed, endpoint)
+
+
+def _log_slow_request(elapsed, endpoint):
+    statements = g.get('sql_statements') or []
+    lines = ['Slow request %s %s (%s): %.0fms, %d SQL statements taking %.0fms' % (
+        request.method, request.full_path.rstrip('?'), endpoint, elapsed * 1000, g.sql_count, g.sql_time * 1000)]
+    # The same statement repeated many times is the usual sign of an N+1 query
+    repeated = Counter(statement for _, statement in statements).most_common(3)
+    for statement, count in repeated:
+        if count > 1:
+            lines.append('  repeated %dx: %s' % (count, statement))
+    for duration, statement in sorted(statements, reverse=True)[:5]:
+        lines.append('  %.1fms: %s' % (duration * 1000, statement))
+    logger.warning('\n'.join(lines))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if not has_request_context() or 'sql_count' not in g:
+        return
+    g.sql_count += 1
+    g.sql_time += elapsed
+    if g.sql_statements is not None and len(g.sql_statements) < 500:
+        g.sql_statements.append((elapsed, ' '.join(statement.split())))
+
+
+# A failed statement never reaches after_cursor_execute, so its start time is dropped here
+@event.listens_for(Engine, 'handle_error')
+def _drop_failed_query(exception_context):
+    conn = exception_context.connection
+    stack = conn.info.get('query_started') if conn is not None and exception_context.execution_context is not None else None
+    if stack:
+        stack.pop()
+
+
+def _template_started(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('template_started', []).append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    stack = g.get('template_started') if has_request_context() else None
+    if stack:
+        metrics = sender.extensions['metrics']
+        metrics.observe(metrics.template_time, time.perf_counter() - stack.pop(), template=template.name)
+
+
+def _metrics_view():
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    if not current_user.is_authenticated:
+        abort(401)
+    if current_user.role != 'admin':
+        abort(403)
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
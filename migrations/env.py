@@ -10,8 +10,9 @@ from alembic import context
 config = context.config
 
 # Interpret the config file for Python logging.
-# This line sets up loggers basically.
-fileConfig(config.config_file_name)
+# This line sets up loggers basically. Loggers the app already set up keep working when
+# migrations run inside it.
+fileConfig(config.config_file_name, disable_existing_loggers=False)
 logger = logging.getLogger('alembic.env')
 
 
@@ -45,6 +46,21 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
+# Search objects created with raw DDL by the migrations rather than declared in the
+# models: the SQLite FTS5 table (with its shadow tables, filled by triggers) and the
+# PostgreSQL full-text index. Autogenerate would otherwise drop them.
+RAW_DDL_TABLES = ('asset_fts', 'asset_fts_data', 'asset_fts_idx', 'asset_fts_docsize', 'asset_fts_config')
+RAW_DDL_INDEXES = ('ix_asset_fulltext',)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and name in RAW_DDL_TABLES:
+        return False
+    if type_ == 'index' and name in RAW_DDL_INDEXES:
+        return False
+    return True
+
+
 def get_metadata():
     if hasattr(target_db, 'metadatas'):
         return target_db.metadatas[None]
@@ -65,7 +81,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -97,6 +114,11 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        # Each migration commits on its own, so a failure late in `flask db upgrade` keeps
+        # the earlier ones, and data backfills can run between migrations without one
+        # transaction spanning the whole upgrade (see backfill.py)
+        conf_args.setdefault('transaction_per_migration', True)
+        conf_args.setdefault('include_object', include_object)
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
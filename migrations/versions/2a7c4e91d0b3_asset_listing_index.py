@@ -0,0 +1,26 @@
+"""Index asset listing order.
+
+Revision ID: 2a7c4e91d0b3
+Revises: 163e6b9091b1
+Create Date: 2026-10-18 09:12:40.511203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a7c4e91d0b3'
+down_revision = '163e6b9091b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.create_index('ix_asset_date_created_id', ['date_created', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.drop_index('ix_asset_date_created_id')
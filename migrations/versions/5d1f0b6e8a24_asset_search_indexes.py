@@ -0,0 +1,64 @@
+"""Indexes for asset search, filtering and sorting.
+
+Revision ID: 5d1f0b6e8a24
+Revises: 2a7c4e91d0b3
+Create Date: 2026-10-18 11:03:27.146518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1f0b6e8a24'
+down_revision = '2a7c4e91d0b3'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS asset_fts USING fts5(name, description, content='asset', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS asset_fts_ai AFTER INSERT ON asset BEGIN "
+    "INSERT INTO asset_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS asset_fts_ad AFTER DELETE ON asset BEGIN "
+    "INSERT INTO asset_fts(asset_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS asset_fts_au AFTER UPDATE OF name, description ON asset BEGIN "
+    "INSERT INTO asset_fts(asset_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO asset_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    # Index the rows that already exist
+    "INSERT INTO asset_fts(asset_fts) VALUES ('rebuild')",
+]
+
+
+def upgrade():
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.create_index('ix_asset_owner_id_date_created', ['owner_id', 'date_created', 'id'], unique=False)
+        batch_op.create_index('ix_asset_created_by_date_created', ['created_by', 'date_created', 'id'], unique=False)
+        batch_op.create_index('ix_asset_name', ['name'], unique=False)
+    op.create_index('ix_asset_name_lower', 'asset', [sa.text('lower(name)')], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_FTS:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.execute(
+            "CREATE INDEX ix_asset_fulltext ON asset USING gin "
+            "(to_tsvector('simple', name || ' ' || coalesce(description, '')))"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for trigger in ('asset_fts_ai', 'asset_fts_ad', 'asset_fts_au'):
+            op.execute('DROP TRIGGER IF EXISTS %s' % trigger)
+        op.execute('DROP TABLE IF EXISTS asset_fts')
+    elif dialect == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_asset_fulltext')
+
+    op.drop_index('ix_asset_name_lower', table_name='asset')
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.drop_index('ix_asset_name')
+        batch_op.drop_index('ix_asset_created_by_date_created')
+        batch_op.drop_index('ix_asset_owner_id_date_created')
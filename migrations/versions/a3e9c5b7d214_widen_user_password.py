@@ -0,0 +1,30 @@
+"""Room for longer password hashes.
+
+Revision ID: a3e9c5b7d214
+Revises: f1d8b3a5c720
+Create Date: 2026-10-19 09:14:52.306481
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e9c5b7d214'
+down_revision = 'f1d8b3a5c720'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Werkzeug's scrypt hashes are 162 characters; logins rehash older ones to that method
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=150), type_=sa.String(length=255),
+                              existing_nullable=False)
+
+
+def downgrade():
+    # Hashes longer than 150 characters have to be reset before this can run on PostgreSQL
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=255), type_=sa.String(length=150),
+                              existing_nullable=False)
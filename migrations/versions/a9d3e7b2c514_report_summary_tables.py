@@ -0,0 +1,43 @@
+"""Report summary tables.
+
+Revision ID: a9d3e7b2c514
+Revises: f5c2a9e4b813
+Create Date: 2026-10-18 19:02:37.614920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d3e7b2c514'
+down_revision = 'f5c2a9e4b813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('report_state',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('cursor', sa.Integer(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+    sa.Column('rebuilt_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('report_asset_day',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('assets', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table('report_asset_creator',
+    sa.Column('created_by', sa.String(length=150), nullable=False),
+    sa.Column('assets', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('created_by')
+    )
+    # Tables are filled by the first report refresh
+
+
+def downgrade():
+    op.drop_table('report_asset_creator')
+    op.drop_table('report_asset_day')
+    op.drop_table('report_state')
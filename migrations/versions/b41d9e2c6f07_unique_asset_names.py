@@ -0,0 +1,39 @@
+"""Enforce unique asset names.
+
+Revision ID: b41d9e2c6f07
+Revises: 8c3e5a7f1d42
+Create Date: 2026-10-18 15:20:48.377102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b41d9e2c6f07'
+down_revision = '8c3e5a7f1d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Uniqueness used to be checked only in the application, so concurrent creates may
+    # have slipped duplicates in. Refuse to continue rather than pick rows to delete.
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT name, COUNT(*) FROM asset GROUP BY name HAVING COUNT(*) > 1 LIMIT 10'
+    )).all()
+    if duplicates:
+        raise RuntimeError(
+            'Rename or remove duplicate asset names before upgrading: %s'
+            % ', '.join('%r (%d rows)' % (name, count) for name, count in duplicates)
+        )
+
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.drop_index('ix_asset_name')
+        batch_op.create_index('uq_asset_name', ['name'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.drop_index('uq_asset_name')
+        batch_op.create_index('ix_asset_name', ['name'], unique=False)
@@ -0,0 +1,27 @@
+"""Owner summary kept with the report state.
+
+Revision ID: b8f2d6a4c931
+Revises: a3e9c5b7d214
+Create Date: 2026-10-19 10:41:08.925317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8f2d6a4c931'
+down_revision = 'a3e9c5b7d214'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by the next `flask reports refresh`
+    with op.batch_alter_table('report_state', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('owners', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('report_state', schema=None) as batch_op:
+        batch_op.drop_column('owners')
@@ -0,0 +1,40 @@
+"""Asset attachments.
+
+Revision ID: c2f8d4a6b937
+Revises: a9d3e7b2c514
+Create Date: 2026-10-18 19:48:03.117250
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f8d4a6b937'
+down_revision = 'a9d3e7b2c514'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('attachment',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('asset_id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('content_type', sa.String(length=100), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('uploaded_by_id', sa.Integer(), nullable=True),
+    sa.Column('uploaded_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['asset_id'], ['asset.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['uploaded_by_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_attachment_sha256', 'attachment', ['sha256'], unique=False)
+    op.create_index('uq_attachment_asset_id_sha256', 'attachment', ['asset_id', 'sha256'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_attachment_asset_id_sha256', table_name='attachment')
+    op.drop_index('ix_attachment_sha256', table_name='attachment')
+    op.drop_table('attachment')
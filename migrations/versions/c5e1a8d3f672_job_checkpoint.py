@@ -0,0 +1,26 @@
+"""Checkpoints for resuming retried jobs.
+
+Revision ID: c5e1a8d3f672
+Revises: b8f2d6a4c931
+Create Date: 2026-10-19 11:27:35.148206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1a8d3f672'
+down_revision = 'b8f2d6a4c931'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('checkpoint', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_column('checkpoint')
@@ -0,0 +1,33 @@
+"""Backfill checkpoints.
+
+Revision ID: d4b7e1f9a286
+Revises: c2f8d4a6b937
+Create Date: 2026-10-18 20:31:55.802413
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b7e1f9a286'
+down_revision = 'c2f8d4a6b937'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('backfill_checkpoint',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.Column('rows_seen', sa.Integer(), nullable=False),
+    sa.Column('rows_changed', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('backfill_checkpoint')
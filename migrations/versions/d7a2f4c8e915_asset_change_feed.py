@@ -0,0 +1,38 @@
+"""Asset change feed.
+
+Revision ID: d7a2f4c8e915
+Revises: b41d9e2c6f07
+Create Date: 2026-10-18 16:02:37.514620
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a2f4c8e915'
+down_revision = 'b41d9e2c6f07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('asset_change',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('asset_id', sa.Integer(), nullable=False),
+    sa.Column('operation', sa.String(length=10), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=True),
+    sa.Column('changed_by', sa.String(length=150), nullable=True),
+    sa.Column('changed_at', sa.DateTime(), nullable=False),
+    sa.Column('data', sa.JSON(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+    with op.batch_alter_table('asset_change', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_asset_change_asset_id'), ['asset_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('asset_change', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_asset_change_asset_id'))
+    op.drop_table('asset_change')
@@ -0,0 +1,29 @@
+"""Denormalised asset count per user.
+
+Revision ID: e3b8c1d5a7f0
+Revises: d7a2f4c8e915
+Create Date: 2026-10-18 16:12:44.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b8c1d5a7f0'
+down_revision = 'd7a2f4c8e915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('asset_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute('UPDATE "user" SET asset_count = (SELECT count(*) FROM asset WHERE asset.owner_id = "user".id)')
+    op.create_index('ix_user_asset_count_id', 'user', ['asset_count', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_asset_count_id', table_name='user')
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('asset_count')
@@ -0,0 +1,53 @@
+"""Retired assets and the asset archive.
+
+Revision ID: e6a1c3f8b295
+Revises: d4b7e1f9a286
+Create Date: 2026-10-18 21:05:37.402816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a1c3f8b295'
+down_revision = 'd4b7e1f9a286'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A plain ALTER TABLE: batch mode would copy the asset table and drop its FTS triggers
+    op.add_column('asset', sa.Column('retired_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_asset_retired_at', 'asset', ['retired_at'], unique=False)
+
+    op.create_table('asset_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('asset_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('description', sa.String(length=200), nullable=True),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=True),
+    sa.Column('created_by', sa.String(length=150), nullable=True),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('retired_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.Column('attachments', sa.JSON(), nullable=True),
+    sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_asset_archive_asset_id', 'asset_archive', ['asset_id'], unique=False)
+    op.create_index('ix_asset_archive_date_created_id', 'asset_archive', ['date_created', 'id'], unique=False)
+    op.create_index('ix_asset_archive_owner_id_date_created', 'asset_archive', ['owner_id', 'date_created', 'id'], unique=False)
+    op.create_index('ix_asset_archive_name', 'asset_archive', ['name'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_asset_archive_name', table_name='asset_archive')
+    op.drop_index('ix_asset_archive_owner_id_date_created', table_name='asset_archive')
+    op.drop_index('ix_asset_archive_date_created_id', table_name='asset_archive')
+    op.drop_index('ix_asset_archive_asset_id', table_name='asset_archive')
+    op.drop_table('asset_archive')
+    op.drop_index('ix_asset_retired_at', table_name='asset')
+    op.drop_column('asset', 'retired_at')
@@ -0,0 +1,64 @@
+"""Asset tags, attributes and facet counts.
+
+Revision ID: f1d8b3a5c720
+Revises: e6a1c3f8b295
+Create Date: 2026-10-18 22:31:09.845120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1d8b3a5c720'
+down_revision = 'e6a1c3f8b295'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tag',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('asset_tag',
+    sa.Column('asset_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['asset_id'], ['asset.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+    sa.PrimaryKeyConstraint('asset_id', 'tag_id')
+    )
+    op.create_index('ix_asset_tag_tag_id_asset_id', 'asset_tag', ['tag_id', 'asset_id'], unique=False)
+    op.create_table('asset_attribute',
+    sa.Column('asset_id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.String(length=200), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.ForeignKeyConstraint(['asset_id'], ['asset.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('asset_id', 'key')
+    )
+    op.create_index('ix_asset_attribute_key_value_asset_id', 'asset_attribute', ['key', 'value', 'asset_id'], unique=False)
+    op.create_table('facet_count',
+    sa.Column('facet', sa.String(length=60), nullable=False),
+    sa.Column('value', sa.String(length=200), nullable=False),
+    sa.Column('assets', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('facet', 'value')
+    )
+    op.create_index('ix_facet_count_facet_assets', 'facet_count', ['facet', 'assets'], unique=False)
+    op.add_column('asset_archive', sa.Column('tags', sa.JSON(), nullable=True))
+    op.add_column('asset_archive', sa.Column('attributes', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('asset_archive', schema=None) as batch_op:
+        batch_op.drop_column('attributes')
+        batch_op.drop_column('tags')
+    op.drop_index('ix_facet_count_facet_assets', table_name='facet_count')
+    op.drop_table('facet_count')
+    op.drop_index('ix_asset_attribute_key_value_asset_id', table_name='asset_attribute')
+    op.drop_table('asset_attribute')
+    op.drop_index('ix_asset_tag_tag_id_asset_id', table_name='asset_tag')
+    op.drop_table('asset_tag')
+    op.drop_table('tag')
@@ -1,16 +1,27 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import DDL, event
+from db_profiles import RoutingSession
 
-# Initialises SQLAlchemy for handling database operation
-db = SQLAlchemy()
+# Initialises SQLAlchemy for handling database operation; the session routes reads of
+# @read_only views to a replica when one is configured
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # User model representing users within the application
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
-    password = db.Column(db.String(150), nullable=False)
+    # Sized for the longest hash PASSWORD_HASH_METHOD can produce (scrypt: 162 characters)
+    password = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(10), nullable=False, default='user')
+    # Number of assets the user owns, maintained by owners.py
+    asset_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        # The owners page lists users by asset count
+        db.Index('ix_user_asset_count_id', 'asset_count', 'id'),
+    )
 
 # Asset model representing assets managed by the application
 class Asset(db.Model):
@@ -20,4 +31,227 @@ class Asset(db.Model):
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     owner = db.relationship('User', backref=db.backref('assets', lazy=True))
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
-    created_by = db.Column(db.String(150), nullable=True)
\ No newline at end of file
+    created_by = db.Column(db.String(150), nullable=True)
+    # Incremented by SQLAlchemy on every UPDATE; drives API ETags and optimistic locking
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Set when the asset is retired; `flask assets archive` later moves it to asset_archive
+    retired_at = db.Column(db.DateTime)
+
+    __mapper_args__ = {'version_id_col': version}
+
+    __table_args__ = (
+        # Keyset pagination of the asset list walks this index in (date_created, id) order
+        db.Index('ix_asset_date_created_id', 'date_created', 'id'),
+        # Equality filters on the asset list, already in listing order
+        db.Index('ix_asset_owner_id_date_created', 'owner_id', 'date_created', 'id'),
+        db.Index('ix_asset_created_by_date_created', 'created_by', 'date_created', 'id'),
+        # Asset names are unique; the index also serves sorting by name
+        db.Index('uq_asset_name', 'name', unique=True),
+        # The archive mover looks for assets retired before a cutoff
+        db.Index('ix_asset_retired_at', 'retired_at'),
+    )
+
+# Tags and typed attributes of assets, written through facets.py. Tag names are stored
+# normalised (lower case), so each tag is one row however it was typed.
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+
+# The tag filter walks (tag_id, asset_id); the primary key serves an asset's own tags
+asset_tag = db.Table('asset_tag',
+    db.Column('asset_id', db.Integer, db.ForeignKey('asset.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    db.Index('ix_asset_tag_tag_id_asset_id', 'tag_id', 'asset_id'),
+)
+
+# One value per key and asset. value holds the canonical text of the value ('3', 'true',
+# 'Building 3'), which is what filters compare; kind tells how to give it back.
+class AssetAttribute(db.Model):
+    asset_id = db.Column(db.Integer, db.ForeignKey('asset.id', ondelete='CASCADE'), primary_key=True)
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.String(200), nullable=False)
+    # string, number or boolean
+    kind = db.Column(db.String(10), nullable=False, default='string')
+
+    __table_args__ = (
+        # Attribute filters look up (key, value) and get the asset ids from the index
+        db.Index('ix_asset_attribute_key_value_asset_id', 'key', 'value', 'asset_id'),
+    )
+
+# Live assets per tag ('tag') or per value of a faceted attribute ('attr.<key>'), kept
+# current by facets.py in the same transaction as the tags and attributes themselves
+class FacetCount(db.Model):
+    facet = db.Column(db.String(60), primary_key=True)
+    value = db.Column(db.String(200), primary_key=True)
+    assets = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        # The most common values of a facet
+        db.Index('ix_facet_count_facet_assets', 'facet', 'assets'),
+    )
+
+# Retired asset moved out of the asset table by archive.py, so the live table and its
+# indexes only hold assets in use. asset_id is the id the asset had; ids can be reused
+# on SQLite, so the archive has ids of its own. The asset's attachments are kept as
+# JSON, with their files still in the blob store.
+class ArchivedAsset(db.Model):
+    __tablename__ = 'asset_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    asset_id = db.Column(db.Integer, nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.String(200))
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    owner = db.relationship('User')
+    date_created = db.Column(db.DateTime)
+    created_by = db.Column(db.String(150))
+    version = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime)
+    retired_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attachments = db.Column(db.JSON(none_as_null=True))
+    # Tag names, and attributes as {'key', 'value', 'kind'} dicts
+    tags = db.Column(db.JSON(none_as_null=True))
+    attributes = db.Column(db.JSON(none_as_null=True))
+
+    __table_args__ = (
+        # The same listing orders and owner filter as the asset table
+        db.Index('ix_asset_archive_date_created_id', 'date_created', 'id'),
+        db.Index('ix_asset_archive_owner_id_date_created', 'owner_id', 'date_created', 'id'),
+        db.Index('ix_asset_archive_name', 'name'),
+    )
+
+# API token used by scripts instead of a session cookie; only a SHA-256 digest is stored
+class ApiToken(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user = db.relationship('User')
+    name = db.Column(db.String(100), nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Append-only log of asset creates, updates and deletes, written in the same transaction
+# as the change itself (see changes.py). The id is the cursor of the change feed.
+class AssetChange(db.Model):
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    asset_id = db.Column(db.Integer, nullable=False, index=True)
+    operation = db.Column(db.String(10), nullable=False)
+    version = db.Column(db.Integer)
+    changed_by = db.Column(db.String(150))
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # {'new': {...}} for creates, {'new': {...}, 'changes': {field: [old, new]}} for updates, {'old': {...}} for deletes
+    data = db.Column(db.JSON, nullable=False)
+
+# Background job run by `flask jobs worker` (see jobs.py). Workers claim queued jobs whose
+# run_after has passed; failures are retried with exponential backoff until max_attempts.
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    # queued, running, succeeded or failed
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    payload = db.Column(db.JSON, nullable=False)
+    result = db.Column(db.JSON)
+    # Result file, relative to JOB_DIR
+    result_path = db.Column(db.String(500))
+    progress = db.Column(db.Integer)  # percent, when the job can tell
+    message = db.Column(db.String(200))
+    # Where a handler got to, kept across attempts so a retry can resume (JobContext.save_checkpoint)
+    checkpoint = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Refreshed by the worker while the job runs; a stale heartbeat means the worker died
+    heartbeat_at = db.Column(db.DateTime)
+    worker = db.Column(db.String(100))
+
+    __table_args__ = (
+        # Workers look for the oldest runnable queued job
+        db.Index('ix_job_status_run_after', 'status', 'run_after', 'id'),
+    )
+
+# File attached to an asset. The content lives in the blob store under its SHA-256 (see
+# attachments.py), so identical files uploaded twice are stored once.
+class Attachment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    asset_id = db.Column(db.Integer, db.ForeignKey('asset.id', ondelete='CASCADE'), nullable=False)
+    asset = db.relationship('Asset', backref=db.backref('attachments', lazy=True, cascade='all, delete-orphan',
+                                                        passive_deletes=True, order_by='Attachment.id'))
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    uploaded_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    uploaded_by = db.relationship('User')
+    uploaded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # An asset's attachments are listed in upload order; one file is attached once
+        db.Index('uq_attachment_asset_id_sha256', 'asset_id', 'sha256', unique=True),
+    )
+
+# Progress of a backfill (see backfill.py): the last primary key processed, committed with
+# each batch so an interrupted run resumes where it stopped
+class BackfillCheckpoint(db.Model):
+    name = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    rows_seen = db.Column(db.Integer, nullable=False, default=0)
+    rows_changed = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+# Summary tables behind the reports page (see reports.py), kept current from the change
+# feed. report_state holds the change feed cursor they have been brought up to.
+class ReportState(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    cursor = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime)
+    rebuilt_at = db.Column(db.DateTime)
+    # Owners by asset count as of refreshed_at (reports._owner_summary)
+    owners = db.Column(db.JSON)
+
+# Assets created per day
+class ReportAssetDay(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    assets = db.Column(db.Integer, nullable=False)
+
+# Assets per created_by value ('' for none)
+class ReportAssetCreator(db.Model):
+    created_by = db.Column(db.String(150), primary_key=True)
+    assets = db.Column(db.Integer, nullable=False)
+
+# Read-only views of an asset's tags and attributes; facets.py writes the rows, keeping
+# the facet counts in step
+Asset.tags = db.relationship(Tag, secondary=asset_tag, viewonly=True, order_by=Tag.name)
+Asset.attributes = db.relationship(AssetAttribute, viewonly=True, order_by=AssetAttribute.key)
+
+# True when an IntegrityError was raised by the unique index on asset.name
+def is_name_conflict(error):
+    message = str(error.orig)
+    return 'uq_asset_name' in message or 'asset.name' in message
+
+# Case-insensitive name prefix search compares ranges on lower(name)
+db.Index('ix_asset_name_lower', db.func.lower(Asset.name))
+
+# SQLite FTS5 index over name and description, kept in sync by triggers. The same DDL
+# is applied by the migration; these listeners cover databases built with create_all().
+ASSET_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS asset_fts USING fts5(name, description, content='asset', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS asset_fts_ai AFTER INSERT ON asset BEGIN "
+    "INSERT INTO asset_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS asset_fts_ad AFTER DELETE ON asset BEGIN "
+    "INSERT INTO asset_fts(asset_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS asset_fts_au AFTER UPDATE OF name, description ON asset BEGIN "
+    "INSERT INTO asset_fts(asset_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO asset_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+]
+
+for statement in ASSET_FTS_DDL:
+    event.listen(Asset.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Asset.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS asset_fts').execute_if(dialect='sqlite'))
@@ -0,0 +1,65 @@
+from collections import Counter
+from sqlalchemy import event, inspect, func, select
+from models import db, User, Asset
+
+# User.asset_count is a denormalised count of the assets each user owns, so owner lists
+# can show counts without a GROUP BY over the asset table. ORM writes keep it current
+# from a flush listener; bulk statements call adjust_asset_counts() next to
+# record_changes(). Counts are applied as relative UPDATEs in the same transaction, so
+# concurrent writers never overwrite each other's increments. recount_assets() repairs
+# drift left by raw SQL.
+
+
+# {owner_id: delta} for rows created (sign=1) or deleted (sign=-1) by a bulk statement
+def owner_deltas(rows, sign=1):
+    deltas = Counter()
+    for row in rows:
+        deltas[row['owner_id']] += sign
+    return deltas
+
+
+def adjust_asset_counts(deltas, session=None):
+    session = session or db.session
+    deltas = {owner_id: delta for owner_id, delta in deltas.items() if delta and owner_id is not None}
+    if not deltas:
+        return
+    table = User.__table__
+    session.connection().execute(
+        table.update().where(table.c.id == db.bindparam('owner_id'))
+        .values(asset_count=table.c.asset_count + db.bindparam('delta')),
+        [{'owner_id': owner_id, 'delta': delta} for owner_id, delta in sorted(deltas.items())]
+    )
+    # Loaded users would otherwise keep showing the old count until the commit expires them
+    for owner_id in deltas:
+        user = session.identity_map.get(session.identity_key(User, owner_id))
+        if user is not None:
+            session.expire(user, ['asset_count'])
+
+
+@event.listens_for(db.session, 'after_flush')
+def _count_flushed_assets(session, flush_context):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Asset):
+            deltas[obj.owner_id] += 1
+    for obj in session.dirty:
+        if isinstance(obj, Asset):
+            history = inspect(obj).attrs.owner_id.history
+            if history.added and history.deleted and history.added[0] != history.deleted[0]:
+                deltas[history.deleted[0]] -= 1
+                deltas[history.added[0]] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Asset):
+            state = inspect(obj)
+            deltas[state.committed_state.get('owner_id', state.dict.get('owner_id'))] -= 1
+    adjust_asset_counts(deltas, session)
+
+
+# Recomputes every user's asset_count from the asset table; returns the users corrected
+def recount_assets():
+    actual = (select(func.count(Asset.id)).where(Asset.owner_id == User.id)
+              .correlate(User).scalar_subquery())
+    result = db.session.execute(db.update(User).where(User.asset_count != actual).values(asset_count=actual)
+                                .execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
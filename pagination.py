@@ -0,0 +1,135 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_, false, literal, select, union_all
+
+# Keyset (cursor) pagination helpers. Instead of OFFSET, which makes the database
+# walk every skipped row, each page continues strictly after the sort key of the
+# last row already shown, so fetching page 1000 costs the same as fetching page 1.
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _dump(value):
+    # Tags datetimes so they survive the JSON round trip
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _load(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+# Encodes the sort key values of a row into an opaque URL-safe cursor
+def encode_cursor(values):
+    raw = json.dumps([_dump(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+# Decodes a cursor produced by encode_cursor, raising InvalidCursor on tampering
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != size:
+            raise InvalidCursor(cursor)
+        return [_load(v) for v in values]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+# Builds the ORDER BY clauses for a list of (column, descending) pairs.
+# NULLs always sort as the smallest value so the keyset predicate below is well defined.
+# Columns of a union don't know whether they are nullable and are treated as if they were.
+def order_clauses(order):
+    clauses = []
+    for column, descending in order:
+        nullable = getattr(column, 'nullable', True)
+        if descending:
+            clause = column.desc()
+            clauses.append(clause.nulls_last() if nullable else clause)
+        else:
+            clause = column.asc()
+            clauses.append(clause.nulls_first() if nullable else clause)
+    return clauses
+
+
+def _after(column, value, descending):
+    # Rows strictly after value in the sort direction, with NULL as the smallest value
+    if descending:
+        if value is None:
+            return false()
+        if column.nullable:
+            return or_(column < value, column.is_(None))
+        return column < value
+    if value is None:
+        return column.is_not(None)
+    return column > value
+
+
+def _equal(column, value):
+    return column.is_(None) if value is None else column == value
+
+
+# Predicate selecting the rows that come after the given sort key values. For a key of
+# (a, b, id) this expands to: a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z)
+def keyset_predicate(order, values):
+    branches = []
+    for i, (column, descending) in enumerate(order):
+        equal = [_equal(c, v) for (c, _), v in zip(order[:i], values[:i])]
+        branches.append(and_(*equal, _after(column, values[i], descending)))
+    return or_(*branches)
+
+
+# Fetches one page of rows ordered by `order`, whose last pair must be a unique column.
+# Returns the rows and the cursor of the next page (None on the last page).
+def keyset_page(query, order, cursor=None, per_page=50):
+    if cursor:
+        query = query.filter(keyset_predicate(order, decode_cursor(cursor, len(order))))
+    # One extra row tells us whether another page exists without a COUNT(*)
+    rows = query.order_by(*order_clauses(order)).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column, _ in order])
+    return rows, next_cursor
+
+
+# Keyset pagination over several selects with the same columns, e.g. a table and its
+# archive. Each select is ordered and limited to one page on its own, so each can walk
+# its own index, and the union of those pages is sorted again. order is a list of
+# (column key, descending) pairs; ties between selects are broken by their position,
+# which the cursor carries as its last value. Returns rows with a `source` attribute
+# (the position of their select) and the cursor of the next page.
+def union_keyset_page(session, selects, order, cursor=None, per_page=50):
+    values = decode_cursor(cursor, len(order) + 1) if cursor else None
+    if values is not None and not isinstance(values[-1], int):
+        raise InvalidCursor(cursor)
+    pages = []
+    for source, statement in enumerate(selects):
+        columns = [(statement.selected_columns[key], descending) for key, descending in order]
+        if values is not None:
+            after = keyset_predicate(columns, values[:-1])
+            if source > values[-1]:
+                # Rows of a later select sort after the cursor row even when their keys are equal
+                after = or_(after, and_(*[_equal(column, value) for (column, _), value in zip(columns, values)]))
+            statement = statement.where(after)
+        statement = statement.add_columns(literal(source).label('source'))
+        page = statement.order_by(*order_clauses(columns)).limit(per_page + 1).subquery()
+        pages.append(select(page))
+    union = union_all(*pages).subquery()
+    columns = [(union.c[key], descending) for key, descending in order] + [(union.c.source, False)]
+    rows = session.execute(select(union).order_by(*order_clauses(columns)).limit(per_page + 1)).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, key) for key, _ in order] + [last.source])
+    return rows, next_cursor
@@ -0,0 +1,110 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+from metrics import timed
+
+# Password hashing with a configurable algorithm and cost. Hashes made with older
+# settings still verify, and needs_rehash() tells login to upgrade them. Hashing runs
+# on a small bounded thread pool (hashlib releases the GIL while it works), so a burst
+# of logins waits for a slot, or is turned away with HashingBusy, instead of taking
+# every worker thread away from normal page requests.
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class _Argon2:
+    # Optional backend for PASSWORD_HASH_METHOD = 'argon2[:time_cost:memory_cost:parallelism]'
+    def __init__(self, method):
+        try:
+            from argon2 import PasswordHasher
+        except ImportError:
+            raise RuntimeError('PASSWORD_HASH_METHOD %r needs the argon2-cffi package.' % method) from None
+        params = [int(value) for value in method.split(':')[1:]]
+        names = ('time_cost', 'memory_cost', 'parallelism')
+        self.hasher = PasswordHasher(**dict(zip(names, params)))
+
+    def hash(self, password):
+        return self.hasher.hash(password)
+
+    def verify(self, stored, password):
+        from argon2.exceptions import VerificationError, InvalidHashError
+        try:
+            return self.hasher.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    def needs_rehash(self, stored):
+        return self.hasher.check_needs_rehash(stored)
+
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.prefix = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+        # Hashes computed at once per process, and how many more may wait for a slot
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_QUEUE', 16)
+        # Seconds a request waits for a slot before HashingBusy is raised
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5)
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.argon2 = _Argon2(self.method) if self.method.startswith('argon2') else None
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_QUEUE'])
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        app.extensions['password_hasher'] = self
+
+    def _run(self, operation, fn, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise HashingBusy()
+        try:
+            with timed('password_hash_time', operation=operation):
+                return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+    def _hash(self, password):
+        if self.argon2:
+            return self.argon2.hash(password)
+        return generate_password_hash(password, method=self.method)
+
+    def _verify(self, stored, password):
+        if stored.startswith('$argon2'):
+            return (self.argon2 or _Argon2('argon2')).verify(stored, password)
+        return check_password_hash(stored, password)
+
+    def hash(self, password):
+        return self._run('generate', self._hash, password)
+
+    def verify(self, stored, password):
+        return self._run('check', self._verify, stored, password)
+
+    # True when stored was made with a different algorithm or cost than the configured one
+    def needs_rehash(self, stored):
+        if self.argon2:
+            return not stored.startswith('$argon2') or self.argon2.needs_rehash(stored)
+        if self.prefix is None:
+            # Werkzeug fills in default parameters, so compare against a real hash's prefix
+            self.prefix = generate_password_hash('', method=self.method).split('$', 1)[0]
+        return stored.split('$', 1)[0] != self.prefix
+
+
+def get_hasher():
+    return current_app.extensions['password_hasher']
+
+
+def hash_password(password):
+    return get_hasher().hash(password)
+
+
+def verify_password(stored, password):
+    return get_hasher().verify(stored, password)
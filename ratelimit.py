@@ -0,0 +1,140 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from flask import current_app, request
+
+# Token-bucket throttling for the login and registration forms, which each cost a full
+# password hash. Buckets live in a small SQLite file in the instance folder, so every
+# worker process on the host draws from the same buckets without Redis. A check is one
+# short write transaction on that file and runs before the form is validated, so a
+# rejected attempt never reaches the hasher or the application database.
+#
+# RATE_LIMITS maps a route name to the keys it is limited by and a limit per key, e.g.
+# {'login': {'ip': '20/minute', 'username': '5/minute'}}. "N/period" is a bucket of N
+# attempts that refills at N per period, so short bursts pass and a steady stream is
+# held to the rate. An attempt is allowed only when every one of its buckets has a token.
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+DEFAULT_LIMITS = {
+    'login': {'ip': '20/minute', 'username': '5/minute'},
+    'register': {'ip': '5/hour'},
+}
+
+# Expired buckets are deleted after this many checks in a process
+PRUNE_EVERY = 1000
+
+logger = logging.getLogger(__name__)
+
+
+# '5/minute' -> (capacity 5, 5/60 tokens a second)
+def parse_limit(limit):
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*', limit)
+    if not match or not int(match.group(1)):
+        raise ValueError('Invalid rate limit %r; expected e.g. "5/minute" or "100/10 minutes".' % limit)
+    count, periods, period = int(match.group(1)), int(match.group(2) or 1), match.group(3)
+    return count, count / float(periods * PERIODS[period])
+
+
+# 'ip=20/minute,username=5/minute' -> {'ip': '20/minute', 'username': '5/minute'}
+def parse_limits(value):
+    limits = {}
+    for part in value.split(','):
+        key, _, limit = part.strip().partition('=')
+        if key:
+            limits[key.strip()] = limit.strip()
+    return limits
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RATE_LIMIT_STORAGE', os.path.join(app.instance_path, 'ratelimit.sqlite'))
+        app.config.setdefault('RATE_LIMITS', {})
+        self.enabled = app.config['RATE_LIMIT_ENABLED']
+        self.path = app.config['RATE_LIMIT_STORAGE']
+        self.limits = {}
+        for route, limits in dict(DEFAULT_LIMITS, **app.config['RATE_LIMITS']).items():
+            if isinstance(limits, str):
+                limits = parse_limits(limits)
+            self.limits[route] = {key: parse_limit(limit) for key, limit in limits.items() if limit}
+        # One connection per thread; a forked worker opens its own
+        self.local = threading.local()
+        self.checks = 0
+        app.extensions['rate_limiter'] = self
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None and self.local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        # Losing a few buckets in a crash is harmless, so skip the fsyncs
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+                     'updated REAL NOT NULL, full_at REAL NOT NULL) WITHOUT ROWID')
+        self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    # Takes a token from the bucket of each key; returns 0 when allowed, otherwise the
+    # seconds until it would be allowed. Nothing is taken when any bucket is empty.
+    def take(self, buckets, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            updates = []
+            wait = 0.0
+            for key, (capacity, rate) in buckets.items():
+                row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + max(now - row[1], 0) * rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                tokens -= 1
+                updates.append((key, tokens, now, now + (capacity - tokens) / rate))
+            if not wait:
+                conn.executemany('INSERT OR REPLACE INTO bucket (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)', updates)
+            self.checks += 1
+            if self.checks % PRUNE_EVERY == 0:
+                # A full bucket is the same as no bucket
+                conn.execute('DELETE FROM bucket WHERE full_at <= ?', (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    # Checks an attempt at route from the current request's client address and the given
+    # identifiers (e.g. username=...); returns 0 or the seconds to wait
+    def hit(self, route, **identifiers):
+        limits = self.limits.get(route)
+        if not self.enabled or not limits:
+            return 0
+        identifiers['ip'] = request.remote_addr or 'unknown'
+        buckets = {}
+        for key, limit in limits.items():
+            value = identifiers.get(key)
+            if value:
+                buckets['%s:%s:%s' % (route, key, str(value).strip().lower()[:200])] = limit
+        try:
+            return self.take(buckets)
+        except sqlite3.Error:
+            # An unavailable store must not lock everyone out
+            logger.warning('Rate limit store %s unavailable', self.path, exc_info=True)
+            return 0
+
+    # Empties every bucket, e.g. after a false alarm
+    def reset(self):
+        self._connect().execute('DELETE FROM bucket')
+
+
+def get_rate_limiter():
+    return current_app.extensions['rate_limiter']
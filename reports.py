@@ -0,0 +1,245 @@
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, insert, select, update
+from models import db, User, Asset, AssetChange, ReportState, ReportAssetDay, ReportAssetCreator
+from changes import latest_cursor, lock_feed
+
+# Asset reports: creations per week, age of the inventory, top creators and how assets
+# are spread over owners. Counts come from two small summary tables (assets per creation
+# day and per created_by) rather than from the asset table. A rebuild fills them by
+# reading the asset table in chunks, two columns at a time, and counting each chunk
+# with pandas. Afterwards refresh() applies only the change feed entries after the
+# cursor saved in report_state, so a report over millions of assets reads a few thousand
+# summary rows. The owner spread is recounted by each refresh and kept in report_state.
+#
+# Page views only read the summaries, as of their last refresh: refreshing and
+# rebuilding are left to `flask reports refresh` (from cron) and the report job.
+# pandas is imported when a report is first built.
+
+STATE = 'assets'
+
+# (upper bound in days, label); the last bucket is open-ended
+AGE_BUCKETS = ((30, 'Under 30 days'), (90, '30 to 90 days'), (365, '90 days to 1 year'),
+               (730, '1 to 2 years'), (None, 'Over 2 years'))
+
+
+class Reports:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Rows read per round trip when rebuilding or catching up with the change feed
+        app.config.setdefault('REPORT_CHUNK_SIZE', 50000)
+        app.config.setdefault('REPORT_WEEKS', 26)
+        app.config.setdefault('REPORT_TOP', 10)
+        app.extensions['reports'] = self
+
+
+def _read_chunks(statement, **options):
+    import pandas as pd
+    return pd.read_sql(statement, db.session.connection(), chunksize=current_app.config['REPORT_CHUNK_SIZE'], **options)
+
+
+def _empty_counts():
+    import pandas as pd
+    return pd.Series(dtype='int64')
+
+
+# Per-day counts of a column of timestamps (or ISO strings); missing dates are not counted
+def _count_days(values):
+    import pandas as pd
+    days = pd.to_datetime(values, format='ISO8601').dt.normalize()
+    return days.value_counts()
+
+
+def _count_creators(values):
+    return values.fillna('').value_counts()
+
+
+# Adds deltas ({key: change}) to the assets column of a summary table, inserting missing
+# keys and dropping rows that reach zero
+def _adjust(model, key, deltas):
+    deltas = {value: int(delta) for value, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    table = model.__table__
+    column = table.c[key]
+    existing = set()
+    keys = list(deltas)
+    for start in range(0, len(keys), 500):
+        existing.update(db.session.execute(select(column).where(column.in_(keys[start:start + 500]))).scalars())
+    updates = [{'k': value, 'delta': delta} for value, delta in deltas.items() if value in existing]
+    if updates:
+        db.session.execute(table.update().where(column == db.bindparam('k'))
+                           .values(assets=table.c.assets + db.bindparam('delta')), updates)
+    inserts = [{key: value, 'assets': delta} for value, delta in deltas.items() if value not in existing]
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+    db.session.execute(table.delete().where(table.c.assets <= 0))
+
+
+def _day_keys(counts):
+    return {timestamp.date(): delta for timestamp, delta in counts.items()}
+
+
+# Recomputes the summary tables from the asset table; returns the assets counted
+def rebuild():
+    session = db.session
+    # Emptying the tables takes SQLite's write lock and lock_feed() holds back writers on
+    # PostgreSQL, so no change can commit between reading the assets and the cursor
+    session.execute(delete(ReportAssetDay))
+    session.execute(delete(ReportAssetCreator))
+    lock_feed(session.connection())
+    cursor = latest_cursor()
+    days, creators = _empty_counts(), _empty_counts()
+    for chunk in _read_chunks(select(Asset.date_created, Asset.created_by)):
+        days = days.add(_count_days(chunk['date_created']), fill_value=0)
+        creators = creators.add(_count_creators(chunk['created_by']), fill_value=0)
+    if len(days):
+        session.execute(insert(ReportAssetDay), [{'day': day, 'assets': int(count)} for day, count in _day_keys(days).items()])
+    if len(creators):
+        session.execute(insert(ReportAssetCreator), [{'created_by': value, 'assets': int(count)}
+                                                     for value, count in creators.items()])
+    now = datetime.utcnow()
+    state = session.get(ReportState, STATE) or ReportState(name=STATE)
+    state.cursor, state.refreshed_at, state.rebuilt_at = cursor, now, now
+    state.owners = _owner_summary(current_app.config['REPORT_TOP'])
+    session.add(state)
+    session.commit()
+    return int(creators.sum())
+
+
+def _column(frame, name):
+    import pandas as pd
+    return frame[name] if name in frame else pd.Series(index=frame.index, dtype=object)
+
+
+# Summary deltas of one chunk of change feed rows: creates add, deletes subtract, and
+# updates that changed date_created or created_by move the asset between keys
+def _change_deltas(chunk):
+    import pandas as pd
+    data = pd.json_normalize(chunk['data'].tolist())
+    data.index = chunk.index
+    operation = chunk['operation']
+    created, deleted = operation == 'create', operation == 'delete'
+    deltas = {}
+    for field, count in (('date_created', _count_days), ('created_by', _count_creators)):
+        changed = _column(data, 'changes.' + field).dropna()
+        added = pd.concat([_column(data, 'new.' + field)[created], changed.str[1]])
+        removed = pd.concat([_column(data, 'old.' + field)[deleted], changed.str[0]])
+        if field == 'date_created':
+            added, removed = added.dropna(), removed.dropna()
+        deltas[field] = count(added).sub(count(removed), fill_value=0)
+    return deltas['date_created'], deltas['created_by']
+
+
+# Brings the summary tables up to date with the change feed and recounts the owner spread;
+# returns the changes applied. Rebuilds instead when the tables were never built or the
+# feed was pruned past them.
+def refresh():
+    session = db.session
+    state = session.get(ReportState, STATE)
+    if state is None:
+        rebuild()
+        return 0
+    start, target = state.cursor, latest_cursor()
+    applied = 0
+    if target > start:
+        oldest = session.query(func.min(AssetChange.id)).scalar()
+        if oldest > start + 1:
+            rebuild()
+            return 0
+        applied = _apply_changes(start, target)
+    session.execute(update(ReportState).where(ReportState.name == STATE)
+                    .values(owners=_owner_summary(current_app.config['REPORT_TOP']), refreshed_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False))
+    session.commit()
+    session.expire(state)
+    return applied
+
+
+# Applies the change feed entries in (start, target] to the summary tables, uncommitted
+def _apply_changes(start, target):
+    session = db.session
+    # Claims the range first; a concurrent refresh that got there before matches nothing
+    claimed = session.execute(update(ReportState).where(ReportState.name == STATE, ReportState.cursor == start)
+                              .values(cursor=target)
+                              .execution_options(synchronize_session=False)).rowcount
+    if not claimed:
+        return 0
+    days, creators = _empty_counts(), _empty_counts()
+    applied = 0
+    statement = (select(AssetChange.operation, AssetChange.data)
+                 .where(AssetChange.id > start, AssetChange.id <= target).order_by(AssetChange.id))
+    for chunk in _read_chunks(statement):
+        chunk_days, chunk_creators = _change_deltas(chunk)
+        days = days.add(chunk_days, fill_value=0)
+        creators = creators.add(chunk_creators, fill_value=0)
+        applied += len(chunk)
+    _adjust(ReportAssetDay, 'day', _day_keys(days))
+    _adjust(ReportAssetCreator, 'created_by', creators)
+    return applied
+
+
+# Owners by asset count: the top owners plus the spread of User.asset_count, read in chunks
+def _owner_summary(top):
+    import pandas as pd
+    histogram = _empty_counts()
+    for chunk in _read_chunks(select(User.asset_count)):
+        histogram = histogram.add(chunk['asset_count'].value_counts(), fill_value=0)
+    histogram = histogram.sort_index()
+    users = int(histogram.sum())
+    owners = int(histogram[histogram.index > 0].sum())
+    if users:
+        cumulative = histogram.cumsum()
+        median = int(histogram.index[cumulative.searchsorted(users / 2.0)])
+        mean = float((histogram.index.to_series() * histogram).sum() / users)
+    else:
+        median, mean = 0, 0.0
+    rows = (db.session.query(User.id, User.username, User.asset_count).filter(User.asset_count > 0)
+            .order_by(User.asset_count.desc(), User.id).limit(top))
+    return {'users': users, 'owners': owners, 'without_assets': users - owners, 'median': median,
+            'mean': round(mean, 2), 'max': int(histogram.index.max()) if users else 0,
+            'top': [{'id': user_id, 'username': username, 'assets': count} for user_id, username, count in rows]}
+
+
+# The full asset report as a dict of plain values, read from the summary tables as of their
+# last refresh, or None when they have never been built
+def asset_report(today=None):
+    import pandas as pd
+    state = db.session.get(ReportState, STATE)
+    if state is None:
+        return None
+    config = current_app.config
+    today = today or date.today()
+    frame = pd.read_sql(select(ReportAssetDay.day, ReportAssetDay.assets), db.session.connection())
+    days = pd.Series(frame['assets'].to_numpy(), index=pd.to_datetime(frame['day']), dtype='int64')
+    total = int(db.session.query(func.coalesce(func.sum(ReportAssetCreator.assets), 0)).scalar())
+    dated = int(days.sum())
+
+    # Weeks start on Monday; the current week is the last one
+    this_week = pd.Timestamp(today - timedelta(days=today.weekday()))
+    weeks = pd.date_range(end=this_week, periods=config['REPORT_WEEKS'], freq='7D')
+    week_of = days.index - pd.to_timedelta(days.index.weekday, unit='D')
+    weekly = days.groupby(week_of).sum().reindex(weeks, fill_value=0)
+
+    ages = (pd.Timestamp(today) - days.index).days
+    bounds = [float('-inf')] + [limit for limit, _ in AGE_BUCKETS[:-1]] + [float('inf')]
+    buckets = pd.cut(ages, bounds, right=False, labels=[label for _, label in AGE_BUCKETS])
+    aging = days.groupby(buckets, observed=False).sum()
+
+    creators = (db.session.query(ReportAssetCreator.created_by, ReportAssetCreator.assets)
+                .order_by(ReportAssetCreator.assets.desc(), ReportAssetCreator.created_by).limit(config['REPORT_TOP']))
+    return {
+        'total': total,
+        'undated': total - dated,
+        'refreshed_at': state.refreshed_at.isoformat() if state.refreshed_at else None,
+        'rebuilt_at': state.rebuilt_at.isoformat() if state.rebuilt_at else None,
+        'weekly': [{'week': week.date().isoformat(), 'assets': int(count)} for week, count in weekly.items()],
+        'weekly_mean': round(float(weekly.mean()), 2) if len(weekly) else 0.0,
+        'aging': [{'bucket': label, 'assets': int(aging.get(label, 0))} for _, label in AGE_BUCKETS],
+        'creators': [{'created_by': created_by or None, 'assets': count} for created_by, count in creators],
+        # None until the first refresh after the owners column was added
+        'owners': state.owners,
+    }
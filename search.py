@@ -0,0 +1,147 @@
+import json
+from datetime import datetime, timedelta
+from weakref import WeakKeyDictionary
+from sqlalchemy import func, inspect, text, column, literal_column, Integer, cast, select, Text
+from models import db, Asset, Tag, asset_tag, AssetAttribute
+from facets import KEY_PATTERN, normalize_tag
+
+# Server-side filtering and sorting of assets for /assets (and anything else that lists
+# assets). Every filter is backed by an index so searches never need a full table scan.
+# The same filters apply to the archive of retired assets (see archive.py), whose
+# full text search is a plain substring scan. Tag and attribute filters are index
+# lookups in the tables of facets.py.
+
+# Sort options accepted by ?sort=, each a keyset order whose last column is unique
+SORTS = {
+    'date_created': [(Asset.date_created, False), (Asset.id, False)],
+    '-date_created': [(Asset.date_created, True), (Asset.id, True)],
+    'name': [(Asset.name, False), (Asset.id, False)],
+    '-name': [(Asset.name, True), (Asset.id, True)],
+}
+DEFAULT_SORT = 'date_created'
+
+# Remembers per engine whether the SQLite FTS5 index has been created
+_fts_available = WeakKeyDictionary()
+
+
+def _parse_date(value, end=False):
+    # Accepts YYYY-MM-DD (as sent by <input type="date">) or a full ISO timestamp.
+    # A bare end date covers the whole day, so it becomes the start of the next day.
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+# Reads the supported filters from request args, dropping empty or malformed values
+def parse_filters(args):
+    filters = {}
+    for key in ('q', 'name', 'created_by'):
+        value = (args.get(key) or '').strip()
+        if value:
+            filters[key] = value
+    owner_id = args.get('owner_id', type=int)
+    if owner_id is not None:
+        filters['owner_id'] = owner_id
+    for key in ('created_from', 'created_to'):
+        if _parse_date(args.get(key)):
+            filters[key] = args.get(key)
+    # ?tag= may repeat; an asset must carry every tag given
+    tags = args.getlist('tag') if hasattr(args, 'getlist') else [args.get('tag')]
+    tags = sorted({normalize_tag(tag) for tag in tags if tag and normalize_tag(tag)})
+    if tags:
+        filters['tag'] = tags
+    # ?attr.location=Building 3 matches the canonical text of the attribute's value
+    for key in args:
+        if key.startswith('attr.') and KEY_PATTERN.match(key[5:]) and (args.get(key) or '').strip():
+            filters[key] = args.get(key).strip()
+    # Live assets only by default; 'include' adds archived ones, 'only' lists just those
+    if args.get('archived') in ('include', 'only'):
+        filters['archived'] = args.get('archived')
+    sort = args.get('sort')
+    if sort in SORTS and sort != DEFAULT_SORT:
+        filters['sort'] = sort
+    return filters
+
+
+# Returns the keyset order for the sort selected in filters, on the columns of model
+def sort_order(filters, model=Asset):
+    return [(getattr(model, column.key), descending) for column, descending in SORTS[filters.get('sort', DEFAULT_SORT)]]
+
+
+def has_fulltext_index(engine):
+    if engine not in _fts_available:
+        _fts_available[engine] = engine.dialect.name == 'sqlite' and inspect(engine).has_table('asset_fts')
+    return _fts_available[engine]
+
+
+def _fts_query(terms):
+    # Quotes every word so user input can't inject FTS5 syntax; each word matches as a prefix
+    words = terms.split()
+    return ' '.join('"%s"*' % word.replace('"', '""') for word in words)
+
+
+# Full text search over name and description: FTS5 on SQLite, a tsvector expression
+# index on PostgreSQL, and a case-insensitive substring scan everywhere else
+def fulltext_clause(terms, model=Asset):
+    engine = db.engine
+    if model is not Asset:
+        return model.name.icontains(terms, autoescape=True) | model.description.icontains(terms, autoescape=True)
+    if has_fulltext_index(engine):
+        matches = text('SELECT rowid FROM asset_fts WHERE asset_fts MATCH :terms').bindparams(terms=_fts_query(terms))
+        return Asset.id.in_(matches.columns(column('rowid', Integer)))
+    if engine.dialect.name == 'postgresql':
+        # Spelled out literally so it matches the ix_asset_fulltext expression index
+        document = literal_column("to_tsvector('simple', asset.name || ' ' || coalesce(asset.description, ''))")
+        return document.op('@@')(func.plainto_tsquery('simple', terms))
+    return Asset.name.icontains(terms, autoescape=True) | Asset.description.icontains(terms, autoescape=True)
+
+
+def _prefix_clause(prefix, model=Asset):
+    # A half-open range on lower(name) uses ix_asset_name_lower, unlike LIKE 'abc%'
+    prefix = prefix.lower()
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    name = func.lower(model.name)
+    return (name >= prefix) & (name < upper)
+
+
+# Applies the parsed filters to a query of model (Asset or ArchivedAsset). The archived
+# filter picks the table and is handled by archive.asset_page().
+def apply_filters(query, filters, model=Asset):
+    if 'q' in filters:
+        query = query.filter(fulltext_clause(filters['q'], model))
+    if 'name' in filters:
+        query = query.filter(_prefix_clause(filters['name'], model))
+    if 'owner_id' in filters:
+        query = query.filter(model.owner_id == filters['owner_id'])
+    if 'created_by' in filters:
+        query = query.filter(model.created_by == filters['created_by'])
+    if 'created_from' in filters:
+        query = query.filter(model.date_created >= _parse_date(filters['created_from']))
+    if 'created_to' in filters:
+        query = query.filter(model.date_created < _parse_date(filters['created_to'], end=True))
+    for tag in filters.get('tag', ()):
+        query = query.filter(_tag_clause(tag, model))
+    for key, value in filters.items():
+        if key.startswith('attr.'):
+            query = query.filter(_attribute_clause(key[5:], value, model))
+    return query
+
+
+# Assets carrying tag, found through ix_asset_tag_tag_id_asset_id. The archive keeps
+# tags as JSON, which is scanned as text.
+def _tag_clause(tag, model):
+    if model is not Asset:
+        return cast(model.tags, Text).contains(json.dumps(tag), autoescape=True)
+    tag_id = select(Tag.id).where(Tag.name == tag).scalar_subquery()
+    return model.id.in_(select(asset_tag.c.asset_id).where(asset_tag.c.tag_id == tag_id))
+
+
+def _attribute_clause(key, value, model):
+    if model is not Asset:
+        # Archived attributes are stored as {"key": ..., "value": ..., "kind": ...}
+        return cast(model.attributes, Text).contains(json.dumps({'key': key, 'value': value})[1:-1], autoescape=True)
+    return model.id.in_(select(AssetAttribute.asset_id).where(AssetAttribute.key == key, AssetAttribute.value == value))
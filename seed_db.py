@@ -1,9 +1,10 @@
 # seed_db.py
-from app import app, db
-from models import User, Asset
+from app import create_app
+from models import db, User, Asset
 from werkzeug.security import generate_password_hash
 
 def seed_data():
+    app = create_app()
     with app.app_context():
         # Only seed if tables are successfully created with migrations
         if User.query.count() == 0:
@@ -0,0 +1,212 @@
+import base64
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import urllib.request
+from flask import current_app, request, send_from_directory, url_for, abort
+from markupsafe import Markup
+from werkzeug.security import safe_join
+from compression import brotli, negotiate
+
+# Third-party files served from static/vendor/, each with the pinned CDN URL it is fetched
+# from by `flask static vendor` and the Subresource Integrity hash of its content. Until a
+# file has been fetched, static_url() links the CDN copy instead and static_integrity()
+# adds the hash, so browsers refuse a CDN file that does not match the pinned one. The
+# fonts are loaded by the Font Awesome stylesheet, where integrity does not apply.
+VENDOR = {
+    'vendor/bootstrap/bootstrap.min.css': ('https://cdn.jsdelivr.net/npm/bootstrap@4.5.0/dist/css/bootstrap.min.css',
+                                           'sha384-9aIt2nRpC12Uk9gS9baDl411NQApFmC26EwAOH8WgZl5MYYxFfc+NcPb1dKGj7Sk'),
+    'vendor/bootstrap/bootstrap.min.js': ('https://cdn.jsdelivr.net/npm/bootstrap@4.5.0/dist/js/bootstrap.min.js',
+                                          'sha384-OgVRvuATP1z7JjHLkuOU7Xw704+h835Lr+6QL9UvYjZE3Ipu6Tp75j7Bh/kR0JKI'),
+    'vendor/jquery/jquery.slim.min.js': ('https://cdn.jsdelivr.net/npm/jquery@3.5.1/dist/jquery.slim.min.js',
+                                         'sha384-DfXdz2htPH0lsSSs5nCTpuj/zy4C+OGpamoFVy38MVBnE+IbbVYUew+OrCXaRkfj'),
+    # Bootstrap 4 needs Popper 1.x; the 2.x API is not compatible with its dropdowns and tooltips
+    'vendor/popper/popper.min.js': ('https://cdn.jsdelivr.net/npm/popper.js@1.16.0/dist/umd/popper.min.js',
+                                    'sha384-Q6E9RHvbIyZFJoft+2mJbHaEWldlvI9IOYy5n3zV9zzTtmI3UksdQRVvoxMfooAo'),
+    'vendor/fontawesome/css/all.min.css': ('https://cdn.jsdelivr.net/npm/@fortawesome/fontawesome-free@5.15.1/css/all.min.css',
+                                           'sha512-+4zCK9k+qNFUR5X+cKL9EIR+ZOhtIloNl9GIKS57V1MyNsYpYcUrUeQc9vNfzsWfV28IaLL3i96P9sdNyeRssA=='),
+    # The stylesheet refers to its fonts as ../webfonts/*, so they keep that layout
+    'vendor/fontawesome/webfonts/fa-solid-900.woff2': ('https://cdn.jsdelivr.net/npm/@fortawesome/fontawesome-free@5.15.1/webfonts/fa-solid-900.woff2', None),
+    'vendor/fontawesome/webfonts/fa-solid-900.woff': ('https://cdn.jsdelivr.net/npm/@fortawesome/fontawesome-free@5.15.1/webfonts/fa-solid-900.woff', None),
+    'vendor/fontawesome/webfonts/fa-regular-400.woff2': ('https://cdn.jsdelivr.net/npm/@fortawesome/fontawesome-free@5.15.1/webfonts/fa-regular-400.woff2', None),
+    'vendor/fontawesome/webfonts/fa-regular-400.woff': ('https://cdn.jsdelivr.net/npm/@fortawesome/fontawesome-free@5.15.1/webfonts/fa-regular-400.woff', None),
+    'vendor/fontawesome/webfonts/fa-brands-400.woff2': ('https://cdn.jsdelivr.net/npm/@fortawesome/fontawesome-free@5.15.1/webfonts/fa-brands-400.woff2', None),
+    'vendor/fontawesome/webfonts/fa-brands-400.woff': ('https://cdn.jsdelivr.net/npm/@fortawesome/fontawesome-free@5.15.1/webfonts/fa-brands-400.woff', None),
+}
+
+# Files worth precompressing; fonts and images are already compressed
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.map', '.html')
+
+# A fingerprinted name carries the first 12 hex digits of the SHA-256 of the content
+# before the last extension: css/styles.css -> css/styles.1a2b3c4d5e6f.css
+FINGERPRINT = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[A-Za-z0-9]+)$')
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+def fingerprinted(filename, digest):
+    stem, ext = os.path.splitext(filename)
+    return '%s.%s%s' % (stem, digest, ext)
+
+
+# Serves the static folder with content-hashed URLs. static_url('css/styles.css') returns
+# a URL that changes whenever the file does, so those URLs are cached for a year as
+# immutable; precompressed .br/.gz siblings written by `flask static build` are sent to
+# clients that accept them.
+class StaticAssets:
+    def __init__(self, app=None):
+        self.digests = {}
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STATIC_FINGERPRINT', True)
+        app.extensions['static_assets'] = self
+        app.add_template_global(static_url)
+        app.add_template_global(static_integrity)
+        # Replace the built-in static view so fingerprinted names resolve to the real files
+        app.view_functions['static'] = serve_static
+
+    # Content digest of a static file, recomputed only when its size or mtime changes
+    def digest(self, filename):
+        path = os.path.join(current_app.static_folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self.digests.get(filename)
+        if cached and cached[0] == key:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        with self.lock:
+            self.digests[filename] = (key, digest)
+        return digest
+
+
+def get_static_assets():
+    return current_app.extensions['static_assets']
+
+
+# url_for('static', ...) with the content hash in the file name, or the CDN URL for a
+# vendored file that has not been fetched yet
+def static_url(filename):
+    digest = get_static_assets().digest(filename)
+    if digest is None:
+        if filename in VENDOR:
+            return VENDOR[filename][0]
+        return url_for('static', filename=filename)
+    if not current_app.config['STATIC_FINGERPRINT']:
+        return url_for('static', filename=filename)
+    return url_for('static', filename=fingerprinted(filename, digest))
+
+
+# The integrity and crossorigin attributes for a tag whose static_url() is a CDN URL
+def static_integrity(filename):
+    if filename not in VENDOR or VENDOR[filename][1] is None or get_static_assets().digest(filename) is not None:
+        return ''
+    return Markup(' integrity="%s" crossorigin="anonymous"') % VENDOR[filename][1]
+
+
+# The Subresource Integrity value of data for the hash algorithm named in expected
+def integrity_of(data, expected):
+    algorithm = expected.split('-', 1)[0]
+    return '%s-%s' % (algorithm, base64.b64encode(hashlib.new(algorithm, data).digest()).decode('ascii'))
+
+
+def serve_static(filename):
+    static_folder = current_app.static_folder
+    if safe_join(static_folder, filename) is None:
+        abort(404)
+    immutable = False
+    match = FINGERPRINT.match(filename)
+    if match and not os.path.isfile(os.path.join(static_folder, filename)):
+        filename = match.group('stem') + match.group('ext')
+        # An outdated hash (a page rendered before a deploy) still gets the current file,
+        # just without the long-lived caching
+        immutable = get_static_assets().digest(filename) == match.group('digest')
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = _precompressed(static_folder, filename)
+    if encoding:
+        response = send_from_directory(static_folder, filename + ('.br' if encoding == 'br' else '.gz'),
+                                       mimetype=mimetype, max_age=ONE_YEAR if immutable else None)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(static_folder, filename, max_age=ONE_YEAR if immutable else None)
+    if filename.endswith(PRECOMPRESS_EXTENSIONS):
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
+# The precompressed sibling to send for this request, if one exists and is up to date
+def _precompressed(static_folder, filename):
+    if not filename.endswith(PRECOMPRESS_EXTENSIONS) or request.range:
+        return None
+    path = os.path.join(static_folder, filename)
+    try:
+        source_mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        abort(404)
+    available = []
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        try:
+            if os.stat(path + suffix).st_mtime_ns >= source_mtime:
+                available.append(encoding)
+        except OSError:
+            pass
+    return negotiate(request.accept_encodings, available) if available else None
+
+
+# Writes .gz (and .br, when brotli is installed) next to every compressible static file
+# whose compressed copy is missing or older than the file, and returns the paths written
+def precompress(static_folder):
+    written = []
+    for root, dirs, files in os.walk(static_folder):
+        for name in files:
+            if not name.endswith(PRECOMPRESS_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            source_mtime = os.stat(path).st_mtime_ns
+            with open(path, 'rb') as f:
+                data = f.read()
+            outputs = [('.gz', lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                outputs.append(('.br', lambda: brotli.compress(data, quality=11)))
+            for suffix, compress in outputs:
+                target = path + suffix
+                if os.path.exists(target) and os.stat(target).st_mtime_ns >= source_mtime:
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compress())
+                written.append(target)
+    return written
+
+
+# Downloads the pinned VENDOR files that are missing from the static folder. A file whose
+# content does not match its integrity hash raises ValueError and is not written.
+def fetch_vendor(static_folder, force=False, timeout=30):
+    fetched = []
+    for filename, (source, integrity) in VENDOR.items():
+        path = os.path.join(static_folder, filename)
+        if os.path.exists(path) and not force:
+            continue
+        with urllib.request.urlopen(source, timeout=timeout) as response:
+            data = response.read()
+        if integrity is not None and integrity_of(data, integrity) != integrity:
+            raise ValueError('%s does not match its pinned integrity hash' % source)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so a failed download never leaves a partial file
+        with open(path + '.part', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.part', path)
+        fetched.append(filename)
+    return fetched
@@ -0,0 +1,204 @@
+from datetime import datetime, timedelta
+from types import MappingProxyType
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, inspect
+from cache import TTLCache, MISSING
+from models import db, User, Asset
+
+# Dashboard aggregates for the home page. Each aggregate is computed from the database
+# once and then kept current by applying the deltas of committed asset inserts, updates
+# and deletes, so rendering "/" normally costs no queries at all. The TTL bounds how far
+# a worker can drift when another worker (or a raw SQL statement) changes the table.
+#
+# Owner counts come from User.asset_count (see owners.py) rather than a GROUP BY over the
+# asset table, and the total is their sum. Cached values are shared by every thread of the
+# worker, so they are handed out read-only and replaced, never changed in place, when a
+# commit applies its deltas.
+
+
+def _snapshot(asset_dict):
+    return MappingProxyType({key: asset_dict.get(key) for key in ('id', 'name', 'description', 'date_created')})
+
+
+def _day(value):
+    return value.date() if value else None
+
+
+class DashboardStats:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DASHBOARD_STATS_TTL', 300)
+        app.config.setdefault('DASHBOARD_DAYS', 14)
+        app.config.setdefault('DASHBOARD_TOP_OWNERS', 5)
+        self.cache = TTLCache(maxsize=16, ttl=app.config['DASHBOARD_STATS_TTL'])
+        self.days = app.config['DASHBOARD_DAYS']
+        self.top_owners = app.config['DASHBOARD_TOP_OWNERS']
+        app.extensions['dashboard_stats'] = self
+
+    def clear(self):
+        self.cache.clear()
+
+    def total(self):
+        return self.cache.get_or_set('total', lambda: sum(count for _, count in self.per_owner().values()))
+
+    # The newest asset as a plain dict, or None when there are no assets
+    def recent(self):
+        def load():
+            asset = Asset.query.order_by(Asset.date_created.desc(), Asset.id.desc()).first()
+            return _snapshot(asset.__dict__) if asset else None
+        return self.cache.get_or_set('recent', load)
+
+    # {owner_id: (username, asset count)}
+    def per_owner(self):
+        def load():
+            rows = db.session.query(User.id, User.username, User.asset_count).filter(User.asset_count > 0)
+            return MappingProxyType({owner_id: (username, count) for owner_id, username, count in rows})
+        return self.cache.get_or_set('per_owner', load)
+
+    # Owners with the most assets, as (username, count) pairs
+    def top_owners_list(self):
+        owners = sorted(self.per_owner().values(), key=lambda item: (-item[1], item[0]))
+        return owners[:self.top_owners]
+
+    # {date: assets created that day} for the last DASHBOARD_DAYS days
+    def per_day(self):
+        def load():
+            since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=self.days - 1)
+            day = func.date(Asset.date_created)
+            rows = db.session.query(day, func.count(Asset.id)).filter(Asset.date_created >= since).group_by(day)
+            counts = {datetime.fromisoformat(str(value)).date(): count for value, count in rows}
+            return MappingProxyType({'since': since.date(), 'counts': MappingProxyType(counts)})
+        return self.cache.get_or_set('per_day', load)
+
+    # Daily counts in date order, including days without new assets
+    def daily_series(self):
+        per_day = self.per_day()
+        days = [per_day['since'] + timedelta(days=i) for i in range(self.days)]
+        return [(day, per_day['counts'].get(day, 0)) for day in days]
+
+    # Applies the deltas collected by the session listeners below for one commit
+    def apply(self, changes):
+        for kind, old, new in changes:
+            if kind != 'update':
+                self.cache.update('total', lambda total: total + (1 if kind == 'insert' else -1))
+            if old:
+                self._count(old, -1)
+            if new:
+                self._count(new, 1)
+            self._track_recent(kind, old, new)
+
+    def _count(self, row, delta):
+        def owners(per_owner):
+            entry = per_owner.get(row['owner_id'])
+            if entry is None:
+                # Unknown owner: the username isn't at hand, so recompute on next read
+                return MISSING
+            per_owner = dict(per_owner)
+            username, count = entry
+            if count + delta <= 0:
+                del per_owner[row['owner_id']]
+            else:
+                per_owner[row['owner_id']] = (username, count + delta)
+            return MappingProxyType(per_owner)
+        self.cache.update('per_owner', owners)
+
+        def days(per_day):
+            day = _day(row['date_created'])
+            if not day or day < per_day['since']:
+                return per_day
+            counts = dict(per_day['counts'])
+            counts[day] = counts.get(day, 0) + delta
+            return MappingProxyType({'since': per_day['since'], 'counts': MappingProxyType(counts)})
+        self.cache.update('per_day', days)
+
+    def _track_recent(self, kind, old, new):
+        def recent(current):
+            if current and old and current['id'] == old['id']:
+                # The newest asset was changed or removed; reload it through the index
+                return MISSING if kind == 'delete' or new.get('date_created') != current['date_created'] else _snapshot(new)
+            if not new or not new.get('date_created'):
+                return current
+            if current is None or current['date_created'] is None or \
+                    (new['date_created'], new['id']) > (current['date_created'], current['id']):
+                return _snapshot(new)
+            return current
+        self.cache.update('recent', recent)
+
+
+def get_stats():
+    return current_app.extensions['dashboard_stats']
+
+
+def _pending(session):
+    return session.info.setdefault('dashboard_stat_changes', [])
+
+
+# Values of the tracked columns as they were before the flush. None when an attribute
+# was never loaded, in which case the change can't be applied as a delta.
+def _previous(state):
+    row = {'id': state.identity[0] if state.identity else None}
+    for key in ('owner_id', 'date_created', 'name', 'description'):
+        attr = state.attrs[key]
+        if key not in state.dict and not attr.history.deleted:
+            return None
+        history = attr.history
+        row[key] = history.deleted[0] if history.deleted else (history.unchanged[0] if history.unchanged else None)
+    return row
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changes = _pending(session)
+    for obj in session.new:
+        if isinstance(obj, Asset):
+            changes.append(('insert', None, dict(inspect(obj).dict)))
+    for obj in session.dirty:
+        if isinstance(obj, Asset) and session.is_modified(obj):
+            state = inspect(obj)
+            old = _previous(state)
+            if old is None:
+                session.info['dashboard_stats_stale'] = True
+                continue
+            changes.append(('update', old, dict(state.dict, id=old['id'])))
+    for obj in session.deleted:
+        if isinstance(obj, Asset):
+            state = inspect(obj)
+            old = _previous(state)
+            if old is None:
+                session.info['dashboard_stats_stale'] = True
+                continue
+            changes.append(('delete', old, None))
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _bulk_statement(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE statements bypass the flush, so drop the cached aggregates
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['dashboard_stats_stale'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop('dashboard_stat_changes', [])
+    stale = session.info.pop('dashboard_stats_stale', False)
+    if not has_app_context() or 'dashboard_stats' not in current_app.extensions:
+        return
+    stats = get_stats()
+    if stale:
+        stats.clear()
+    elif changes:
+        stats.apply(changes)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    if previous_transaction.nested:
+        # Only a savepoint was undone; the collected deltas no longer match what the
+        # outer transaction will commit, so fall back to recomputing
+        session.info['dashboard_stats_stale'] = True
+        return
+    session.info.pop('dashboard_stat_changes', None)
+    session.info.pop('dashboard_stats_stale', None)
@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy.pool import StaticPool
+from werkzeug.security import generate_password_hash
+from app import create_app
+from models import db, User
+
+# Cheap hashes keep user setup fast; the cost itself is covered in test_passwords.py
+TEST_HASH_METHOD = 'pbkdf2:sha256:1000'
+
+@pytest.fixture
+def hash_method():
+    return TEST_HASH_METHOD
+
+@pytest.fixture
+def app_config(tmp_path):
+    # Settings for a test application: an in-memory database, and every file the app
+    # writes kept under tmp_path rather than the repository's instance folder
+    return {
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        # A test client used as a context manager re-pushes preserved contexts after the
+        # response is returned, which cannot interleave with the context a streamed page
+        # holds open; tests that check streaming turn it back on
+        'STREAM_TEMPLATES': False,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        # A single connection shared across threads keeps the in-memory database alive
+        'SQLALCHEMY_ENGINE_OPTIONS': {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}},
+        'PASSWORD_HASH_METHOD': TEST_HASH_METHOD,
+        'USER_CACHE_GENERATION_FILE': str(tmp_path / 'user-cache.generation'),
+        'JOB_DIR': str(tmp_path / 'jobs'),
+        'ATTACHMENT_DIR': str(tmp_path / 'attachments'),
+        'RATE_LIMIT_STORAGE': str(tmp_path / 'ratelimit.sqlite'),
+    }
+
+@pytest.fixture
+def app(app_config):
+    # A fresh application with its own in-memory database for every test, so tests share
+    # no state and can run in parallel with pytest-xdist
+    app = create_app(app_config)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def add_users(app):
+    # Adds users given as (username, password, role) tuples and returns their ids
+    def add(*users):
+        with app.app_context():
+            rows = [User(username=username, password=generate_password_hash(password, method=TEST_HASH_METHOD), role=role)
+                    for username, password, role in users]
+            db.session.add_all(rows)
+            db.session.commit()
+            return [user.id for user in rows]
+    return add
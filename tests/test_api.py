@@ -0,0 +1,113 @@
+import pytest
+from sqlalchemy import event
+from models import db, User, Asset
+from api import create_token
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def client(app):
+    # Configures the Flask test client with API tokens for an admin and a regular user
+    client = app.test_client()
+    with app.app_context():
+        admin = User(username='admin', password=generate_password_hash('adminpass', method='pbkdf2:sha256'), role='admin')
+        user = User(username='user', password=generate_password_hash('userpass', method='pbkdf2:sha256'), role='user')
+        db.session.add_all([admin, user])
+        db.session.commit()
+        client.tokens = {'admin': create_token(admin, 'tests'), 'user': create_token(user, 'tests')}
+    # Requests run outside the setup app context so each one authenticates on its own
+    yield client
+
+def auth(client, who='user', **headers):
+    headers['Authorization'] = 'Bearer ' + client.tokens[who]
+    return headers
+
+def test_requests_without_a_token_are_rejected(client):
+    response = client.get('/api/v1/assets')
+    assert response.status_code == 401
+    assert response.is_json
+    assert client.get('/api/v1/assets', headers={'Authorization': 'Bearer nope'}).status_code == 401
+
+def test_create_get_and_conditional_get(client):
+    response = client.post('/api/v1/assets', json={'name': 'Laptop', 'description': 'XPS'}, headers=auth(client))
+    assert response.status_code == 201
+    location, etag = response.headers['Location'], response.headers['ETag']
+    assert response.json['created_by'] == 'user'
+    # No session cookie is issued for token-authenticated calls
+    assert 'Set-Cookie' not in response.headers
+
+    response = client.get(location, headers=auth(client))
+    assert response.status_code == 200
+    assert response.json['name'] == 'Laptop'
+    assert response.headers['ETag'] == etag
+    assert response.headers['Last-Modified']
+
+    response = client.get(location, headers=auth(client, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+    assert response.data == b''
+
+def test_patch_bumps_version_and_honours_if_match(client):
+    created = client.post('/api/v1/assets', json={'name': 'Monitor'}, headers=auth(client))
+    location, etag = created.headers['Location'], created.headers['ETag']
+
+    response = client.patch(location, json={'description': 'ASUS 27-inch'}, headers=auth(client, **{'If-Match': etag}))
+    assert response.status_code == 200
+    assert response.json['version'] == 2
+    assert response.headers['ETag'] != etag
+
+    # The old ETag is now stale, both for writes and for revalidation
+    assert client.patch(location, json={'name': 'Other'}, headers=auth(client, **{'If-Match': etag})).status_code == 412
+    assert client.get(location, headers=auth(client, **{'If-None-Match': etag})).status_code == 200
+
+def test_validation_and_uniqueness(client):
+    assert client.post('/api/v1/assets', json={'name': ''}, headers=auth(client)).status_code == 400
+    assert client.post('/api/v1/assets', json={'name': 'x' * 201}, headers=auth(client)).status_code == 400
+    assert client.post('/api/v1/assets', json={'name': 'Dup'}, headers=auth(client)).status_code == 201
+    response = client.post('/api/v1/assets', json={'name': 'Dup'}, headers=auth(client))
+    assert response.status_code == 409
+    assert 'exists' in response.json['error']
+
+def test_bulk_create_and_paginated_list(client):
+    items = [{'name': 'Device %02d' % i} for i in range(12)] + [{'name': 'Device 00'}, {'description': 'no name'}]
+    response = client.post('/api/v1/assets/bulk', json=items, headers=auth(client))
+    assert response.status_code == 201
+    assert response.json['inserted'] == 12
+    assert [error['index'] for error in response.json['errors']] == [12, 13]
+
+    names, cursor = [], None
+    while True:
+        url = '/api/v1/assets?per_page=5&sort=name' + ('&cursor=' + cursor if cursor else '')
+        page = client.get(url, headers=auth(client))
+        names += [item['name'] for item in page.json['items']]
+        cursor = page.json['next_cursor']
+        if not cursor:
+            break
+    assert names == ['Device %02d' % i for i in range(12)]
+
+    first = client.get('/api/v1/assets?per_page=5', headers=auth(client))
+    again = client.get('/api/v1/assets?per_page=5', headers=auth(client, **{'If-None-Match': first.headers['ETag']}))
+    assert again.status_code == 304
+
+def test_delete_requires_admin(client, app):
+    location = client.post('/api/v1/assets', json={'name': 'Router'}, headers=auth(client)).headers['Location']
+    assert client.delete(location, headers=auth(client)).status_code == 403
+    assert client.delete(location, headers=auth(client, 'admin')).status_code == 204
+    assert client.get(location, headers=auth(client)).status_code == 404
+    with app.app_context():
+        assert Asset.query.count() == 0
+
+def test_concurrent_writes_conflict(client):
+    location = client.post('/api/v1/assets', json={'name': 'Laptop'}, headers=auth(client)).headers['Location']
+    etag = client.get(location, headers=auth(client)).headers['ETag']
+    # Another request writes the row between this one loading the asset and flushing its change
+    def bump(session, flush_context, instances):
+        session.execute(db.text('UPDATE asset SET version = version + 1'))
+    event.listen(db.session, 'before_flush', bump)
+    try:
+        response = client.patch(location, json={'name': 'Desktop'}, headers=auth(client))
+        assert response.status_code == 409 and 'changed by another request' in response.json['error']
+        assert client.patch(location, json={'name': 'Desktop'}, headers=auth(client, **{'If-Match': etag})).status_code == 412
+        assert client.delete(location, headers=auth(client, 'admin')).status_code == 409
+    finally:
+        event.remove(db.session, 'before_flush', bump)
+    response = client.get(location, headers=auth(client))
+    assert response.json['name'] == 'Laptop' and response.json['version'] == 1
@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+from app import create_app
+from models import db, User
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_importing_app_stays_light():
+    # Workers that import app (e.g. gunicorn without --preload) should not pay for the
+    # ORM, pandas or Pillow until create_app() runs
+    script = ('import json, sys, time\n'
+              'started = time.perf_counter()\n'
+              'import app\n'
+              'elapsed = time.perf_counter() - started\n'
+              "heavy = [name for name in ('sqlalchemy', 'flask_sqlalchemy', 'pandas', 'pyarrow', 'PIL', 'models') if name in sys.modules]\n"
+              "print(json.dumps([heavy, elapsed]))\n")
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True)
+    heavy, elapsed = json.loads(result.stdout.strip().splitlines()[-1])
+    assert heavy == []
+    assert elapsed < 2
+
+def test_create_app_returns_isolated_instances(app, app_config, add_users):
+    add_users(('admin', 'adminpass', 'admin'))
+    second = create_app(app_config)
+    assert second is not app
+    with second.app_context():
+        db.create_all()
+        assert User.query.count() == 0
+    with app.app_context():
+        assert User.query.count() == 1
+    assert {'auth.login', 'assets.list_assets', 'api.list_assets'} <= set(second.view_functions)
+    with second.app_context():
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,119 @@
+import io
+import re
+from datetime import datetime, timedelta
+import pytest
+from models import db, User, Asset, ArchivedAsset, Attachment, AssetChange
+from api import create_token
+from archive import archive_retired
+from attachments import collect_garbage, blob_path
+from bulk import bulk_delete, BulkError
+
+@pytest.fixture
+def client(app, add_users):
+    admin_id, user_id = add_users(('admin', 'adminpass', 'admin'), ('user', 'userpass', 'user'))
+    with app.app_context():
+        db.session.add_all([Asset(name='Asset %d' % i, description='old printer' if i == 3 else None,
+                                  owner_id=user_id, date_created=datetime(2026, 1, 1 + i)) for i in range(1, 7)])
+        db.session.commit()
+        client = app.test_client()
+        client.token = create_token(db.session.get(User, admin_id), 'tests')
+    client.post('/login', data=dict(username='admin', password='adminpass'))
+    return client
+
+def api(client, method, url, **kwargs):
+    return client.open('/api/v1' + url, method=method, headers={'Authorization': 'Bearer ' + client.token}, **kwargs)
+
+def listed(client, query=''):
+    html = client.get('/assets?' + query).get_data(as_text=True)
+    return re.findall(r'<td>(Asset \d)', html)
+
+# Retires assets 2 and 3 and moves them to the archive
+def archive(client, app):
+    for asset_id in (2, 3):
+        client.post('/assets/%d/retire' % asset_id)
+    with app.app_context():
+        return archive_retired(before=datetime.utcnow() + timedelta(seconds=1), chunk_size=1)
+
+def test_retired_assets_stay_listed_until_archived(client, app):
+    client.post('/assets/2/retire')
+    assert 'Retired</span>' in client.get('/assets').get_data(as_text=True)
+    assert api(client, 'GET', '/assets/2').get_json()['retired_at'] is not None
+    with app.app_context():
+        # Not due yet: the default grace period is ARCHIVE_AFTER_DAYS
+        assert archive_retired() == 0
+    client.post('/assets/2/unretire')
+    with app.app_context():
+        assert db.session.get(Asset, 2).retired_at is None
+
+def test_archive_moves_rows_out_of_the_live_table(client, app):
+    with app.app_context():
+        before = AssetChange.query.count()
+    assert archive(client, app) == 2
+    assert listed(client) == ['Asset 1', 'Asset 4', 'Asset 5', 'Asset 6']
+    # The FTS entries went with the rows
+    assert listed(client, 'q=printer') == []
+    assert listed(client, 'q=printer&archived=include') == ['Asset 3']
+    assert listed(client, 'archived=only') == ['Asset 2', 'Asset 3']
+    with app.app_context():
+        assert Asset.query.count() == 4 and ArchivedAsset.query.count() == 2
+        assert User.query.filter_by(username='user').one().asset_count == 4
+        changes = AssetChange.query.filter(AssetChange.id > before).all()
+        assert [(change.asset_id, change.operation) for change in changes] == [(2, 'delete'), (3, 'delete')]
+
+def test_include_archived_pages_through_both_tables(client, app):
+    archive(client, app)
+    for sort in ('date_created', '-date_created', 'name', '-name'):
+        names, url = [], '/api/v1/assets?per_page=2&archived=include&sort=' + sort
+        while url:
+            body = client.get(url, headers={'Authorization': 'Bearer ' + client.token}).get_json()
+            names.extend(item['name'] for item in body['items'])
+            url = body['next_cursor'] and url.split('&cursor=')[0] + '&cursor=' + body['next_cursor']
+        expected = ['Asset %d' % i for i in range(1, 7)]
+        assert names == (expected[::-1] if sort.startswith('-') else expected)
+    items = api(client, 'GET', '/assets?archived=only').get_json()['items']
+    assert [(item['id'], item['archived']) for item in items] == [(2, True), (3, True)]
+    assert api(client, 'GET', '/assets?archived=include&cursor=bogus').status_code == 400
+
+def test_restore_brings_back_attachments(client, app):
+    client.post('/assets/2/attachments', data={'file': (io.BytesIO(b'%PDF-1.4 manual'), 'manual.pdf')},
+                content_type='multipart/form-data')
+    with app.app_context():
+        sha256 = Attachment.query.one().sha256
+    archive(client, app)
+    with app.app_context():
+        assert Attachment.query.count() == 0
+        version = ArchivedAsset.query.filter_by(asset_id=2).one().version
+        # Archived assets keep their files
+        assert collect_garbage(grace=0) == 0
+        archive_id = ArchivedAsset.query.filter_by(asset_id=2).one().id
+    response = api(client, 'POST', '/archive/%d/restore' % archive_id)
+    assert response.status_code == 201 and response.headers['Location'].endswith('/api/v1/assets/2')
+    assert response.get_json()['version'] == version + 1 and response.get_json()['retired_at'] is None
+    with app.app_context():
+        assert [(a.asset_id, a.filename, a.sha256) for a in Attachment.query] == [(2, 'manual.pdf', sha256)]
+        assert ArchivedAsset.query.count() == 1
+        assert AssetChange.query.order_by(AssetChange.id.desc()).first().operation == 'create'
+        assert User.query.filter_by(username='user').one().asset_count == 5
+        with open(blob_path(sha256), 'rb') as f:
+            assert f.read() == b'%PDF-1.4 manual'
+    assert 'Asset 2' in listed(client)
+
+def test_restore_refuses_a_taken_name(client, app):
+    archive(client, app)
+    api(client, 'POST', '/assets', json={'name': 'Asset 3'})
+    with app.app_context():
+        archive_id = ArchivedAsset.query.filter_by(asset_id=3).one().id
+    response = api(client, 'POST', '/archive/%d/restore' % archive_id)
+    assert response.status_code == 409 and 'rename it' in response.get_json()['error']
+    response = client.post('/archive/%d/restore' % archive_id, follow_redirects=True)
+    assert 'already exists' in response.get_data(as_text=True)
+
+def test_bulk_actions_and_exports_with_archived_filter(client, app):
+    archive(client, app)
+    with app.app_context(), pytest.raises(BulkError):
+        bulk_delete(filters={'archived': 'only'})
+    csv = client.get('/assets/export?format=csv&archived=include').get_data(as_text=True)
+    assert [line.split(',')[1] for line in csv.splitlines()[1:]] == ['Asset %d' % i for i in range(1, 7)]
+    assert csv.splitlines()[2].startswith('2,Asset 2,')
+    result = app.test_cli_runner().invoke(args=['assets', 'archive', '--dry-run'])
+    assert 'Would archive 0 retired assets.' in result.output
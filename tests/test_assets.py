@@ -1,27 +1,12 @@
 # tests/test_assets.py
 import pytest
-from app import app as flask_app, db
-from app import User, Asset
-from werkzeug.security import generate_password_hash
+from models import db, Asset
 
 @pytest.fixture
-def client():
-    # Configures the Flask test client with specific settings for testing
-    flask_app.config['TESTING'] = True
-    flask_app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing ease
-    flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    with flask_app.test_client() as client:
-        with flask_app.app_context():
-            # Initialize empty database for each test
-            db.create_all()
-            yield client
-        with flask_app.app_context():
-            # Clean up database after tests
-            db.drop_all()
-
-@pytest.fixture
-def app():
-    return flask_app
+def client(app, add_users):
+    # Configures the Flask test client with a regular user
+    add_users(('testuser', 'testpass', 'user'))
+    return app.test_client()
 
 # Helper function to log in a user via POST request
 def login(client, username, password):
@@ -34,12 +19,6 @@ def login(client, username, password):
 
 # Tests the asset creation functionality
 def test_create_asset(client, app):
-    with app.app_context():
-        # Setup a test user in the database
-        user = User(username='testuser', password=generate_password_hash('testpass', method='pbkdf2:sha256'), role='user')
-        db.session.add(user)
-        db.session.commit()
-
     login(client, 'testuser', 'testpass')
 
     # Attempt to create a new asset with a POST request
@@ -57,11 +36,8 @@ def test_create_asset(client, app):
 # Tests the asset listing functionality
 def test_list_assets(client, app):
     with app.app_context():
-        # Setup a test user and asset in the database
-        user = User(username='testuser', password=generate_password_hash('testpass', method='pbkdf2:sha256'), role='user')
-        db.session.add(user)
-        db.session.commit()
-        asset = Asset(name='Test Asset', description='Test description', owner_id=user.id)
+        # Setup a test asset in the database
+        asset = Asset(name='Test Asset', description='Test description', owner_id=1)
         db.session.add(asset)
         db.session.commit()
 
@@ -71,4 +47,46 @@ def test_list_assets(client, app):
     response = client.get('/assets')
     # Check for successful response
     assert response.status_code == 200
-    assert b'Test Asset' in response.data
\ No newline at end of file
+    assert b'Test Asset' in response.data
+
+# Tests that a duplicate name slipping past the form pre-check is caught by the unique index
+def test_create_asset_duplicate_name_race(client, app, monkeypatch):
+    from forms import AssetForm
+    from sqlalchemy.exc import IntegrityError
+    with app.app_context():
+        db.session.add(Asset(name='Racy Asset', description='First', owner_id=1))
+        db.session.commit()
+        # The database itself refuses a second row with the same name
+        db.session.add(Asset(name='Racy Asset', description='Second', owner_id=1))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+    login(client, 'testuser', 'testpass')
+    # Simulate another worker creating the asset between the pre-check and the insert
+    monkeypatch.setattr(AssetForm, 'validate_name', lambda self, field: None)
+    response = client.post('/assets/new', data={'name': 'Racy Asset', 'description': 'Third'}, follow_redirects=True)
+    assert b'An asset with this name already exists.' in response.data
+    with app.app_context():
+        assert Asset.query.filter_by(name='Racy Asset').count() == 1
+
+# Tests that an edit losing a race with another save re-renders the form instead of failing
+def test_edit_asset_changed_meanwhile(client, app):
+    from sqlalchemy import event
+    with app.app_context():
+        db.session.add(Asset(name='Shared Asset', description='Original', owner_id=1))
+        db.session.commit()
+
+    login(client, 'testuser', 'testpass')
+    # Simulate another worker saving the asset between loading it and writing the edit
+    def bump(session, flush_context, instances):
+        session.execute(db.text('UPDATE asset SET version = version + 1'))
+    event.listen(db.session, 'before_flush', bump)
+    try:
+        response = client.post('/assets/edit/1', data={'name': 'Shared Asset', 'description': 'Mine'})
+    finally:
+        event.remove(db.session, 'before_flush', bump)
+    html = response.get_data(as_text=True)
+    assert response.status_code == 200 and 'changed by someone else' in html and 'Mine' in html
+    with app.app_context():
+        assert db.session.get(Asset, 1).description == 'Original'
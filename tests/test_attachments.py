@@ -0,0 +1,131 @@
+import io
+import os
+import pytest
+from PIL import Image
+from models import db, User, Asset, Attachment
+from api import create_token
+from attachments import CHUNK_SIZE, store_blob, blob_path, collect_garbage
+from bulk import bulk_delete
+
+@pytest.fixture
+def client(app, add_users):
+    admin_id, user_id = add_users(('admin', 'adminpass', 'admin'), ('user', 'userpass', 'user'))
+    with app.app_context():
+        db.session.add_all([Asset(name='Laptop', owner_id=user_id), Asset(name='Monitor', owner_id=user_id)])
+        db.session.commit()
+        client = app.test_client()
+        client.token = create_token(db.session.get(User, admin_id), 'tests')
+    client.post('/login', data=dict(username='user', password='userpass'))
+    return client
+
+def png(width, height):
+    data = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(data, 'PNG')
+    return data.getvalue()
+
+def upload(client, asset_id, content, filename):
+    return client.post('/assets/%d/attachments' % asset_id, data={'file': (io.BytesIO(content), filename)},
+                       content_type='multipart/form-data', follow_redirects=True)
+
+def blobs(app):
+    return sorted(name for _, _, files in os.walk(os.path.join(app.config['ATTACHMENT_DIR'], 'blobs')) for name in files)
+
+def test_identical_files_are_stored_once(client, app):
+    assert b'Attached invoice.pdf.' in upload(client, 1, b'%PDF-1.4 invoice', 'invoice.pdf').data
+    assert b'already attached as invoice.pdf' in upload(client, 1, b'%PDF-1.4 invoice', 'copy.pdf').data
+    upload(client, 2, b'%PDF-1.4 invoice', '../../etc/invoice.pdf')
+    with app.app_context():
+        attachments = Attachment.query.order_by(Attachment.id).all()
+        assert [(a.asset_id, a.filename, a.content_type, a.size) for a in attachments] == [
+            (1, 'invoice.pdf', 'application/pdf', 16), (2, 'invoice.pdf', 'application/pdf', 16)]
+        assert attachments[0].sha256 == attachments[1].sha256
+        assert blobs(app) == [attachments[0].sha256]
+    html = client.get('/assets/1/attachments').get_data(as_text=True)
+    assert 'invoice.pdf' in html and 'fa-file' in html
+
+def test_download_is_conditional_and_ranged(client, app):
+    upload(client, 1, b'0123456789' * 100, 'notes.txt')
+    upload(client, 1, b'<script>alert(1)</script>', 'page.html')
+    response = client.get('/attachments/1')
+    assert response.status_code == 200 and response.headers['Content-Disposition'].startswith('inline')
+    assert response.headers['Content-Length'] == '1000' and response.headers['X-Content-Type-Options'] == 'nosniff'
+    etag = response.headers['ETag']
+    assert 'private' in response.headers['Cache-Control']
+    assert client.get('/attachments/1', headers={'If-None-Match': etag}).status_code == 304
+    # Sent as stored, even to clients that accept compression
+    response = client.get('/attachments/1', headers={'Range': 'bytes=10-19', 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 206 and response.data == b'0123456789'
+    assert response.headers['Content-Range'] == 'bytes 10-19/1000' and 'Content-Encoding' not in response.headers
+    assert client.get('/attachments/1?download=1').headers['Content-Disposition'].startswith('attachment')
+    # Uploaded HTML is never rendered in the application's origin
+    response = client.get('/attachments/2')
+    assert response.headers['Content-Disposition'].startswith('attachment') and 'sandbox' in response.headers['Content-Security-Policy']
+
+def test_thumbnails_are_made_once(client, app):
+    upload(client, 1, png(1000, 500), 'photo.png')
+    upload(client, 1, b'not an image', 'broken.jpg')
+    response = client.get('/attachments/1/thumbnail/256')
+    assert response.status_code == 200 and response.mimetype == 'image/png'
+    assert Image.open(io.BytesIO(response.data)).size == (256, 128)
+    with app.app_context():
+        sha256 = db.session.get(Attachment, 1).sha256
+    path = os.path.join(app.config['ATTACHMENT_DIR'], 'thumbnails', sha256[:2], '%s-256.png' % sha256)
+    mtime = os.path.getmtime(path)
+    assert client.get('/attachments/1/thumbnail/256').status_code == 200 and os.path.getmtime(path) == mtime
+    assert client.get('/attachments/1/thumbnail/300').status_code == 404
+    assert client.get('/attachments/2/thumbnail/256').status_code == 404
+    assert 'thumbnail/256' in client.get('/assets/1/attachments').get_data(as_text=True)
+
+def test_uploads_are_streamed_in_chunks(app):
+    class Source(io.BytesIO):
+        reads = []
+        def read(self, size=-1):
+            self.reads.append(size)
+            return super().read(size)
+    content = os.urandom(3 * CHUNK_SIZE + 5)
+    with app.app_context():
+        sha256, size = store_blob(Source(content))
+        assert size == len(content) and Source.reads == [CHUNK_SIZE] * 5
+        with open(blob_path(sha256), 'rb') as f:
+            assert f.read() == content
+        app.config['ATTACHMENT_MAX_SIZE'] = CHUNK_SIZE
+        from attachments import AttachmentTooLarge
+        with pytest.raises(AttachmentTooLarge):
+            store_blob(io.BytesIO(content))
+    assert os.listdir(os.path.join(app.config['ATTACHMENT_DIR'], 'tmp')) == []
+
+def test_api_attachments(client, app):
+    headers = {'Authorization': 'Bearer ' + client.token}
+    response = client.post('/api/v1/assets/1/attachments?filename=warranty.pdf', data=b'%PDF warranty', headers=headers)
+    assert response.status_code == 201 and response.headers['Location'] == '/api/v1/attachments/1'
+    assert response.json['content_type'] == 'application/pdf' and response.json['size'] == 13
+    response = client.post('/api/v1/assets/1/attachments?filename=again.pdf', data=b'%PDF warranty', headers=headers)
+    assert response.status_code == 200 and response.json['id'] == 1
+    assert client.post('/api/v1/assets/1/attachments', data=b'x', headers=headers).status_code == 400
+    app.config['ATTACHMENT_MAX_SIZE'] = 4
+    assert client.post('/api/v1/assets/1/attachments?filename=big.bin', data=b'12345', headers=headers).status_code == 413
+    assert [item['filename'] for item in client.get('/api/v1/assets/1/attachments', headers=headers).json['items']] == ['warranty.pdf']
+    assert client.get('/api/v1/attachments/1/content', headers=headers).data == b'%PDF warranty'
+    assert client.delete('/api/v1/attachments/1', headers=headers).status_code == 204
+    assert client.get('/api/v1/attachments/1', headers=headers).status_code == 404
+
+def test_removal_and_garbage_collection(client, app, add_users):
+    upload(client, 1, b'receipt', 'receipt.txt')
+    upload(client, 2, b'manual', 'manual.txt')
+    upload(client, 2, b'receipt', 'receipt.txt')
+    add_users(('other', 'otherpass', 'user'))
+    other = app.test_client()
+    other.post('/login', data=dict(username='other', password='otherpass'))
+    assert other.post('/attachments/1/delete').status_code == 403
+    assert client.post('/attachments/1/delete', follow_redirects=True).status_code == 200
+    with app.app_context():
+        # Deleting assets drops their attachments, through the ORM or in bulk
+        db.session.delete(db.session.get(Asset, 1))
+        db.session.commit()
+        assert Attachment.query.count() == 2
+        bulk_delete(ids=[2])
+        assert Attachment.query.count() == 0
+        assert len(blobs(app)) == 2
+        assert collect_garbage() == 0
+        assert collect_garbage(grace=-1) == 2
+    assert blobs(app) == []
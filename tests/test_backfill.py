@@ -0,0 +1,92 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import update
+from models import db, Asset, AssetChange, BackfillCheckpoint
+from backfill import BackfillError, backfill_status, run_backfill
+from backfill import backfill as register, BACKFILLS
+
+@pytest.fixture
+def assets(app, add_users):
+    admin_id, user_id = add_users(('admin', 'adminpass', 'admin'), ('user', 'userpass', 'user'))
+    with app.app_context():
+        db.session.add_all([Asset(name='Asset %d' % i, owner_id=admin_id if i % 2 else user_id,
+                                  date_created=datetime(2026, 1, i + 1)) for i in range(10)])
+        db.session.commit()
+        # Rows written before the columns existed
+        db.session.execute(update(Asset).values(created_by=None, updated_at=None)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+    app.config['BACKFILL_THROTTLE'] = 0
+    return admin_id, user_id
+
+def test_backfill_resumes_from_checkpoint(app, assets):
+    with app.app_context():
+        seen = []
+        result = run_backfill('asset-updated-at', batch_size=3, max_batches=2, progress=lambda r: seen.append(r.seen))
+        assert seen == [3, 6] and result.changed == 6 and not result.finished
+        assert Asset.query.filter(Asset.updated_at.is_(None)).count() == 4
+        checkpoint = db.session.get(BackfillCheckpoint, 'asset-updated-at')
+        assert checkpoint.rows_seen == 6 and checkpoint.finished_at is None
+
+        result = run_backfill('asset-updated-at', batch_size=3)
+        assert result.finished and result.changed == 4 and result.total == 4
+        assert all(asset.updated_at == asset.date_created for asset in Asset.query)
+        # Nothing left to do, and the backfill doesn't run again
+        assert run_backfill('asset-updated-at').seen == 0
+        # Filling updated_at is not a change anyone needs to see
+        assert AssetChange.query.count() == 10
+
+def test_dry_run_writes_nothing(app, assets):
+    with app.app_context():
+        result = run_backfill('asset-created-by', batch_size=4, dry_run=True)
+        assert result.finished and result.changed == 10 and result.batches == 3
+        assert Asset.query.filter(Asset.created_by.isnot(None)).count() == 0
+        assert db.session.get(BackfillCheckpoint, 'asset-created-by') is None
+
+def test_logged_backfill_bumps_versions(app, assets):
+    admin_id, user_id = assets
+    with app.app_context():
+        before = AssetChange.query.count()
+        result = run_backfill('asset-created-by', batch_size=4)
+        assert result.changed == 10
+        assets = Asset.query.order_by(Asset.id).all()
+        assert [asset.created_by for asset in assets[:2]] == ['user', 'admin']
+        assert all(asset.version == 2 for asset in assets)
+        changes = AssetChange.query.filter(AssetChange.id > before).all()
+        assert len(changes) == 10 and {change.operation for change in changes} == {'update'}
+        assert changes[0].data['changes'] == {'created_by': [None, 'user']}
+        status = dict((spec.name, checkpoint) for spec, checkpoint in backfill_status())
+        assert status['asset-created-by'].finished_at is not None and status['asset-updated-at'] is None
+
+def test_moved_checkpoint_stops_runner(app, assets):
+    with app.app_context():
+        def move_checkpoint(result):
+            # Another process runs a batch meanwhile
+            db.session.execute(update(BackfillCheckpoint).values(last_id=BackfillCheckpoint.last_id + 2)
+                               .execution_options(synchronize_session=False))
+            db.session.commit()
+        with pytest.raises(BackfillError):
+            run_backfill('asset-updated-at', batch_size=2, progress=move_checkpoint)
+        assert Asset.query.filter(Asset.updated_at.isnot(None)).count() == 2
+
+def test_restart_and_cli(app, assets):
+    calls = []
+    @register('test-names', Asset, columns=[Asset.name])
+    def upper_names(rows):
+        calls.append(len(rows))
+        return [{'id': row['id'], 'name': row['name'].upper()} for row in rows]
+    try:
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['backfill', 'run', 'test-names', '--batch-size', '4', '--max-batches', '1'])
+        assert 'Changed 4 of 4 rows in 1 batches (stopped after id 4).' in result.output
+        result = runner.invoke(args=['backfill', 'run', 'test-names', '--batch-size', '4'])
+        assert 'Changed 6 of 6 rows' in result.output and '(finished)' in result.output
+        # Every row is visited again, but only changed values are written
+        result = runner.invoke(args=['backfill', 'run', 'test-names', '--restart'])
+        assert 'Changed 0 of 10 rows' in result.output
+        assert calls == [4, 4, 2, 10]
+        assert 'test-names\tfinished' in runner.invoke(args=['backfill', 'list']).output
+        result = runner.invoke(args=['backfill', 'run', 'no-such-backfill'])
+        assert result.exit_code == 1 and 'Unknown backfill' in result.output
+    finally:
+        del BACKFILLS['test-names']
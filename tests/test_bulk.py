@@ -0,0 +1,115 @@
+import pytest
+from sqlalchemy import event
+from models import db, User, Asset, AssetChange
+from api import create_token
+from bulk import bulk_delete, bulk_update, BulkError
+
+@pytest.fixture
+def client(app, add_users):
+    admin_id, user_id = add_users(('admin', 'adminpass', 'admin'), ('user', 'userpass', 'user'))
+    with app.app_context():
+        db.session.add_all([Asset(name='Rack %02d' % i, description='Site A' if i < 6 else 'Site B', owner_id=admin_id)
+                            for i in range(10)])
+        db.session.commit()
+        client = app.test_client()
+        client.token = create_token(db.session.get(User, admin_id), 'tests')
+        client.user_token = create_token(db.session.get(User, user_id), 'tests')
+    client.post('/login', data=dict(username='admin', password='adminpass'))
+    return client
+
+def names(app):
+    with app.app_context():
+        return [asset.name for asset in Asset.query.order_by(Asset.id)]
+
+def counts(app):
+    with app.app_context():
+        return {user.username: user.asset_count for user in User.query}
+
+def test_delete_by_filter_runs_one_statement_per_chunk(client, app):
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('DELETE FROM asset '):
+            statements.append(statement)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            preview = bulk_delete(filters={'q': 'Site A'}, dry_run=True, chunk_size=4)
+            assert (preview.matched, preview.changed, preview.dry_run) == (6, 6, True)
+            assert Asset.query.count() == 10 and statements == []
+            result = bulk_delete(filters={'q': 'Site A'}, chunk_size=4)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        assert (result.changed, result.batches) == (6, 2)
+        assert result.summary() == 'Deleted 6 assets.'
+        assert len(statements) == 2
+        assert [change.operation for change in AssetChange.query.filter_by(operation='delete')] == ['delete'] * 6
+    assert names(app) == ['Rack %02d' % i for i in range(6, 10)]
+    assert counts(app) == {'admin': 4, 'user': 0}
+
+def test_reassign_and_describe_bump_versions_and_log_changes(client, app):
+    with app.app_context():
+        result = bulk_update({'owner_id': 2}, ids=[1, 2, 3], chunk_size=2)
+        assert (result.action, result.changed, result.batches) == ('reassign', 3, 2)
+        # Rows that already have the value are skipped
+        result = bulk_update({'owner_id': 2}, ids=[1, 2, 3, 4])
+        assert (result.matched, result.changed) == (4, 1)
+        assert result.summary() == 'Reassigned 1 asset (3 already up to date).'
+        assert [asset.version for asset in Asset.query.order_by(Asset.id).limit(5)] == [2, 2, 2, 2, 1]
+        change = AssetChange.query.filter_by(operation='update').first()
+        assert change.data['changes'] == {'owner_id': [1, 2]} and change.version == 2
+
+        bulk_update({'description': '  Decommissioned '}, filters={'owner_id': 2})
+        assert {asset.description for asset in Asset.query.filter_by(owner_id=2)} == {'Decommissioned'}
+        with pytest.raises(BulkError):
+            bulk_update({'owner_id': 99}, ids=[1])
+        with pytest.raises(BulkError):
+            bulk_update({'name': 'x'}, ids=[1])
+        with pytest.raises(BulkError):
+            bulk_delete()
+    assert counts(app) == {'admin': 6, 'user': 4}
+
+def test_list_page_bulk_form(client, app):
+    html = client.get('/assets').get_data(as_text=True)
+    assert 'id="bulk-form"' in html and 'name="ids" value="1"' in html
+
+    response = client.post('/assets/bulk', data={'action': 'delete', 'scope': 'selected', 'ids': ['1', '2'], 'preview': 'Preview'})
+    html = response.get_data(as_text=True)
+    assert 'Would delete 2 assets.' in html and 'value="1" form="bulk-form" aria-label="Select Rack 00" checked' in html
+    assert len(names(app)) == 10
+
+    response = client.post('/assets/bulk', data={'action': 'delete', 'scope': 'selected', 'ids': ['1', '2'], 'apply': 'Apply'},
+                           follow_redirects=True)
+    assert b'Deleted 2 assets.' in response.data
+    assert len(names(app)) == 8
+
+    # "All matching" takes the list filters from the query string
+    response = client.post('/assets/bulk?q=Site+B', data={'action': 'reassign', 'scope': 'filtered', 'owner_id': '2', 'apply': 'Apply'},
+                           follow_redirects=True)
+    assert b'Reassigned 4 assets.' in response.data
+    assert counts(app) == {'admin': 4, 'user': 4}
+
+    response = client.post('/assets/bulk', data={'action': 'reassign', 'scope': 'selected', 'ids': ['3'], 'owner_id': '99', 'apply': 'Apply'})
+    assert b'No user has this ID.' in response.data
+
+def test_bulk_actions_need_an_admin(client, app):
+    client.get('/logout')
+    client.post('/login', data=dict(username='user', password='userpass'))
+    assert client.post('/assets/bulk', data={'action': 'delete', 'scope': 'selected', 'ids': ['1'], 'apply': 'Apply'}).status_code == 403
+    assert 'bulk-form' not in client.get('/assets').get_data(as_text=True)
+    response = client.post('/api/v1/assets/bulk-delete', json={'ids': [1]}, headers={'Authorization': 'Bearer ' + client.user_token})
+    assert response.status_code == 403
+    assert len(names(app)) == 10
+
+def test_api_bulk_endpoints(client, app):
+    headers = {'Authorization': 'Bearer ' + client.token}
+    response = client.post('/api/v1/assets/bulk-delete', json={'filter': {'name': 'Rack 0'}, 'dry_run': True}, headers=headers)
+    assert response.json == {'action': 'delete', 'dry_run': True, 'matched': 10, 'changed': 10, 'batches': 1}
+    response = client.post('/api/v1/assets/bulk-update', json={'ids': [1, 2], 'set': {'owner_id': 2, 'description': 'Spare'}},
+                           headers=headers)
+    assert response.json['action'] == 'update' and response.json['changed'] == 2
+    response = client.post('/api/v1/assets/bulk-delete', json={'ids': [1, 2, 3]}, headers=headers)
+    assert response.json['changed'] == 3
+    assert client.post('/api/v1/assets/bulk-delete', json={}, headers=headers).status_code == 400
+    assert client.post('/api/v1/assets/bulk-delete', json={'ids': 'all'}, headers=headers).status_code == 400
+    assert client.post('/api/v1/assets/bulk-update', json={'ids': [4], 'set': {'owner_id': 99}}, headers=headers).status_code == 400
+    assert counts(app) == {'admin': 7, 'user': 0}
@@ -0,0 +1,97 @@
+import io
+import json
+import threading
+import time
+import pytest
+from models import db, User, Asset, AssetChange
+from api import create_token
+from importer import import_assets
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def client(app):
+    # Configures the Flask test client with an admin session and API token
+    client = app.test_client()
+    with app.app_context():
+        admin = User(username='admin', password=generate_password_hash('adminpass', method='pbkdf2:sha256'), role='admin')
+        db.session.add(admin)
+        db.session.commit()
+        client.token = create_token(admin, 'tests')
+    yield client
+
+def auth(client, **headers):
+    headers['Authorization'] = 'Bearer ' + client.token
+    return headers
+
+def test_web_edits_are_logged(client, app):
+    client.post('/login', data=dict(username='admin', password='adminpass'))
+    client.post('/assets/new', data=dict(name='Laptop', description='XPS'))
+    with app.app_context():
+        asset_id = Asset.query.filter_by(name='Laptop').first().id
+    client.post('/assets/edit/%d' % asset_id, data=dict(name='Laptop', description='XPS 13'))
+    client.post('/assets/delete/%d' % asset_id)
+
+    response = client.get('/api/v1/changes', headers=auth(client))
+    changes = response.json['changes']
+    assert [change['operation'] for change in changes] == ['create', 'update', 'delete']
+    assert all(change['asset_id'] == asset_id for change in changes)
+    assert changes[0]['new']['name'] == 'Laptop' and changes[0]['changed_by'] == 'admin'
+    assert changes[1]['changes'] == {'description': ['XPS', 'XPS 13']}
+    assert changes[1]['version'] == 2 and changes[1]['new']['updated_at']
+    assert changes[2]['old']['description'] == 'XPS 13'
+    assert response.json['next_cursor'] == changes[-1]['cursor']
+
+    # Nothing after the last cursor, and "latest" skips the history
+    assert client.get('/api/v1/changes?cursor=%d' % changes[-1]['cursor'], headers=auth(client)).json['changes'] == []
+    assert client.get('/api/v1/changes?cursor=latest', headers=auth(client)).json['next_cursor'] == changes[-1]['cursor']
+    assert client.get('/api/v1/changes?cursor=x', headers=auth(client)).status_code == 400
+
+def test_unchanged_save_and_rollback_log_nothing(client, app):
+    with app.app_context():
+        asset = Asset(name='Router', owner_id=1)
+        db.session.add(asset)
+        db.session.commit()
+        asset.description = asset.description
+        db.session.commit()
+        asset.name = 'Renamed'
+        db.session.flush()
+        db.session.rollback()
+        assert [change.operation for change in AssetChange.query] == ['create']
+
+def test_bulk_import_is_logged(client, app):
+    with app.app_context():
+        admin = User.query.first()
+        import_assets(io.BytesIO(b'name\nA\nB\nC\n'), 'csv', admin, batch_size=2)
+        changes = AssetChange.query.order_by(AssetChange.id).all()
+        assert [change.data['new']['name'] for change in changes] == ['A', 'B', 'C']
+        assert [change.asset_id for change in changes] == [asset.id for asset in Asset.query.order_by(Asset.id)]
+
+def test_long_poll_returns_when_a_change_is_committed(client, app):
+    def create_later():
+        time.sleep(0.3)
+        with app.app_context():
+            db.session.add(Asset(name='Late', owner_id=1))
+            db.session.commit()
+    thread = threading.Thread(target=create_later)
+    thread.start()
+    started = time.monotonic()
+    response = client.get('/api/v1/changes?cursor=latest&wait=10', headers=auth(client))
+    thread.join()
+    assert [change['new']['name'] for change in response.json['changes']] == ['Late']
+    assert time.monotonic() - started < 5
+
+def test_server_sent_events_resume_from_last_event_id(client, app):
+    with app.app_context():
+        for name in ('One', 'Two', 'Three'):
+            db.session.add(Asset(name=name, owner_id=1))
+            db.session.commit()
+        first = AssetChange.query.order_by(AssetChange.id).first().id
+    # The stream is off unless configured
+    assert client.get('/api/v1/changes/stream', headers=auth(client)).status_code == 404
+    app.config['CHANGE_FEED_STREAM_SECONDS'] = 0.2
+    response = client.get('/api/v1/changes/stream', headers=auth(client, **{'Last-Event-ID': str(first)}))
+    body = response.get_data(as_text=True)
+    assert response.mimetype == 'text/event-stream'
+    events = [json.loads(line[len('data: '):]) for line in body.splitlines() if line.startswith('data: ')]
+    assert [event['new']['name'] for event in events] == ['Two', 'Three']
+    assert 'id: %d' % (first + 2) in body
@@ -0,0 +1,46 @@
+from flask import Flask, g
+from sqlalchemy import text
+from models import db, User
+from db_profiles import DatabaseProfiles, engine_options
+
+def test_postgres_profile_sizes_the_pool():
+    options = engine_options('postgresql+psycopg://app@db/assets', {'DATABASE_POOL_SIZE': 4})
+    assert options['pool_size'] == 4
+    assert options['pool_pre_ping'] is True
+    assert options['connect_args'] == {'prepare_threshold': 5}
+    assert 'connect_args' not in engine_options('postgresql://app@db/assets', {})
+    assert engine_options('sqlite:///assets.db', {}) == {}
+    assert engine_options('postgresql://app@db/assets', {}, profile='none') == {}
+
+def make_app(tmp_path, **config):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'primary.db')
+    app.config.update(config)
+    DatabaseProfiles(app, db)
+    return app
+
+def test_sqlite_connections_use_wal(tmp_path):
+    app = make_app(tmp_path, SQLITE_BUSY_TIMEOUT_MS=1234)
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 1234
+
+def test_read_only_views_query_the_replica(tmp_path):
+    app = make_app(tmp_path, DATABASE_REPLICA_URL='sqlite:///' + str(tmp_path / 'replica.db'))
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(app.extensions['db_profiles'].replica)
+        db.session.add(User(username='primary-only', password='x', role='user'))
+        db.session.commit()
+    with app.test_request_context():
+        assert User.query.count() == 1
+    with app.test_request_context():
+        g.db_read_only = True
+        assert User.query.count() == 0
+        # Writes still go to the primary
+        db.session.add(User(username='written', password='x', role='user'))
+        db.session.commit()
+    with app.app_context():
+        assert User.query.count() == 2
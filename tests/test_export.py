@@ -0,0 +1,65 @@
+import csv
+import gzip
+import io
+import json
+import pytest
+from models import db, User, Asset
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def client(app):
+    # Configures the Flask test client with a few assets to export
+    # Not used as a context manager so the export streams as in production
+    client = app.test_client()
+    with app.app_context():
+        user = User(username='auditor', password=generate_password_hash('auditorpass', method='pbkdf2:sha256'), role='user')
+        db.session.add(user)
+        db.session.commit()
+        for i in range(7):
+            db.session.add(Asset(name='Asset %d' % i, description='Rack %d' % (i % 2), owner_id=user.id, created_by='auditor'))
+        db.session.commit()
+        yield client
+
+def login(client):
+    response = client.post('/login', data=dict(username='auditor', password='auditorpass'), follow_redirects=True)
+    assert b'Logged in successfully.' in response.data
+
+def test_csv_export_streams_every_row(client, app):
+    login(client)
+    app.config['EXPORT_CHUNK_SIZE'] = 3
+    try:
+        response = client.get('/assets/export?format=csv')
+    finally:
+        app.config['EXPORT_CHUNK_SIZE'] = 5000
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert 'attachment' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row['name'] for row in rows] == ['Asset %d' % i for i in range(7)]
+    assert rows[0]['owner'] == 'auditor'
+
+def test_gzip_ndjson_export_applies_filters(client):
+    login(client)
+    response = client.get('/assets/export?format=ndjson&gzip=1&q=rack 1')
+    assert response.headers['Content-Type'] == 'application/gzip'
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert [json.loads(line)['name'] for line in lines] == ['Asset 1', 'Asset 3', 'Asset 5']
+
+def test_parquet_export(client):
+    pq = pytest.importorskip('pyarrow.parquet')
+    login(client)
+    response = client.get('/assets/export?format=parquet')
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.get_data()))
+    assert table.num_rows == 7
+    assert table.column('name').to_pylist()[0] == 'Asset 0'
+
+def test_unknown_format_is_rejected(client):
+    login(client)
+    assert client.get('/assets/export?format=xlsx').status_code == 400
+
+def test_cli_export(client, app, tmp_path):
+    path = tmp_path / 'assets.csv.gz'
+    result = app.test_cli_runner().invoke(args=['assets', 'export', '--gzip', '--name', 'asset', '-o', str(path)])
+    assert result.exit_code == 0, result.output
+    assert gzip.decompress(path.read_bytes()).decode().count('\n') == 8
@@ -0,0 +1,121 @@
+import re
+from datetime import datetime, timedelta
+import pytest
+from models import db, User, Asset, FacetCount
+from api import create_token
+from archive import archive_retired
+from bulk import bulk_delete
+from facets import recount_facets
+
+@pytest.fixture
+def client(app, add_users):
+    admin_id, = add_users(('admin', 'adminpass', 'admin'))
+    with app.app_context():
+        client = app.test_client()
+        client.token = create_token(db.session.get(User, admin_id), 'tests')
+    client.post('/login', data=dict(username='admin', password='adminpass'))
+    return client
+
+def api(client, method, url, **kwargs):
+    return client.open('/api/v1' + url, method=method, headers={'Authorization': 'Bearer ' + client.token}, **kwargs)
+
+def listed(client, query=''):
+    html = client.get('/assets?' + query).get_data(as_text=True)
+    return re.findall(r'<td>(Asset \d)', html)
+
+def counts(app):
+    with app.app_context():
+        return {(row.facet, row.value): row.assets for row in FacetCount.query}
+
+# The incrementally kept counts must match a full recount
+def assert_counts_consistent(app):
+    kept = counts(app)
+    with app.app_context():
+        recount_facets()
+    assert counts(app) == kept
+
+def add_assets(client):
+    api(client, 'POST', '/assets', json={'name': 'Asset 1', 'tags': ['Laptop', 'loaner'],
+                                         'attributes': {'location': 'Building 3', 'ram_gb': 16}})
+    api(client, 'POST', '/assets', json={'name': 'Asset 2', 'tags': 'laptop',
+                                         'attributes': {'location': 'Building 5', 'category': 'IT'}})
+    api(client, 'POST', '/assets', json={'name': 'Asset 3', 'tags': ['monitor'],
+                                         'attributes': {'location': 'Building 3'}})
+
+def test_form_sets_tags_and_attributes(client, app):
+    response = client.post('/assets/new', data={'name': 'Asset 1', 'tag_list': 'Laptop,  loaner ,',
+                                                'attribute_lines': 'Location: Building 3\nserial_number: ABC123'},
+                           follow_redirects=True)
+    html = response.get_data(as_text=True)
+    assert 'laptop</a>' in html and 'loaner</a>' in html
+    body = api(client, 'GET', '/assets/1').get_json()
+    assert body['tags'] == ['laptop', 'loaner']
+    assert body['attributes'] == {'location': 'Building 3', 'serial_number': 'ABC123'}
+    html = client.get('/assets/edit/1').get_data(as_text=True)
+    assert 'value="laptop, loaner"' in html and 'location: Building 3' in html
+    client.post('/assets/edit/1', data={'name': 'Asset 1', 'tag_list': 'laptop', 'attribute_lines': ''})
+    body = api(client, 'GET', '/assets/1').get_json()
+    assert body['tags'] == ['laptop'] and body['attributes'] == {} and body['version'] == 2
+    response = client.post('/assets/new', data={'name': 'Asset 2', 'attribute_lines': 'no separator'})
+    assert 'write attributes as' in response.get_data(as_text=True)
+
+def test_filters_and_facet_counts(client, app):
+    add_assets(client)
+    assert listed(client, 'tag=laptop') == ['Asset 1', 'Asset 2']
+    assert listed(client, 'tag=laptop&tag=loaner') == ['Asset 1']
+    assert listed(client, 'tag=laptop&attr.location=Building 3') == ['Asset 1']
+    assert listed(client, 'attr.ram_gb=16') == ['Asset 1']
+    assert counts(app) == {('tag', 'laptop'): 2, ('tag', 'loaner'): 1, ('tag', 'monitor'): 1,
+                           ('attr.location', 'Building 3'): 2, ('attr.location', 'Building 5'): 1,
+                           ('attr.category', 'IT'): 1}
+    facets = {facet['facet']: facet['values'] for facet in api(client, 'GET', '/facets?tag=monitor').get_json()['facets']}
+    assert facets['tag'][0] == {'value': 'laptop', 'assets': 2, 'selected': False}
+    assert {'value': 'monitor', 'assets': 1, 'selected': True} in facets['tag']
+    html = client.get('/assets?tag=laptop').get_data(as_text=True)
+    # The selected tag links to the list without it; the others add themselves to it
+    assert 'href="/assets?per_page=50"' in html and 'tag=laptop&amp;tag=monitor' in html
+
+def test_counts_follow_edits_deletes_and_the_archive(client, app):
+    add_assets(client)
+    api(client, 'PATCH', '/assets/1', json={'tags': ['laptop'], 'attributes': {'location': 'Building 5'}})
+    assert counts(app)[('attr.location', 'Building 5')] == 2 and ('tag', 'loaner') not in counts(app)
+    client.post('/assets/delete/3')
+    assert ('tag', 'monitor') not in counts(app)
+    assert_counts_consistent(app)
+    client.post('/assets/2/retire')
+    with app.app_context():
+        assert archive_retired(before=datetime.utcnow() + timedelta(seconds=1)) == 1
+    assert counts(app) == {('tag', 'laptop'): 1, ('attr.location', 'Building 5'): 1}
+    assert listed(client, 'tag=laptop&archived=only') == ['Asset 2']
+    assert listed(client, 'attr.category=IT&archived=include') == ['Asset 2']
+    archived = api(client, 'GET', '/assets?archived=only').get_json()['items'][0]
+    assert archived['tags'] == ['laptop'] and archived['attributes'] == {'location': 'Building 5', 'category': 'IT'}
+    assert api(client, 'POST', '/archive/%d/restore' % archived['archive_id']).status_code == 201
+    assert counts(app)[('tag', 'laptop')] == 2 and counts(app)[('attr.category', 'IT')] == 1
+    with app.app_context():
+        bulk_delete(filters={'tag': ['laptop']})
+        assert Asset.query.count() == 0
+    assert counts(app) == {}
+    assert_counts_consistent(app)
+
+def test_api_values_keep_their_type(client, app):
+    response = api(client, 'POST', '/assets', json={'name': 'Asset 1', 'attributes': {
+        'ram_gb': 16, 'weight_kg': 1.25, 'leased': False, 'location': ' Building 3 ', 'note': None}})
+    assert response.status_code == 201
+    assert response.get_json()['attributes'] == {'ram_gb': 16, 'weight_kg': 1.25, 'leased': False,
+                                                 'location': 'Building 3'}
+    response = api(client, 'POST', '/assets', json={'name': 'Asset 2', 'tags': ['<bad>']})
+    assert response.status_code == 400 and 'Invalid tag' in response.get_json()['error']
+    response = api(client, 'PATCH', '/assets/1', json={'attributes': {'Bad Key': 1}})
+    assert response.status_code == 400
+    with app.app_context():
+        assert Asset.query.count() == 1
+    # A tag change alone still bumps the version, so cached copies see it
+    response = api(client, 'PATCH', '/assets/1', json={'tags': ['spare']})
+    assert response.get_json()['version'] == 2 and response.get_json()['tags'] == ['spare']
+    result = api(client, 'POST', '/assets/bulk-delete', json={'filter': {'tag': ['spare'], 'attr.leased': 'false'},
+                                                               'dry_run': True}).get_json()
+    assert result['matched'] == 1
+    result = app.test_cli_runner().invoke(args=['assets', 'recount-facets'])
+    # The spare tag and the location; the other attributes are not in FACET_ATTRIBUTES
+    assert 'Counted 2 facet values.' in result.output
@@ -1,25 +1,16 @@
 import pytest
 from forms import RegistrationForm, AssetForm
-from app import app, db, Asset
-from werkzeug.security import generate_password_hash
+from models import db, Asset
 from wtforms.validators import ValidationError
 
-# Setup and teardown for database state
-@pytest.fixture(scope='module', autouse=True)
-def setup_database():
-    with app.app_context():
-        db.create_all()  # Ensure the database and tables are created before tests
-        yield  # Run tests
-        db.drop_all()  # Clean-up after tests
-
 # Helper function to provide app context for form validation
-def validate_registration_form(username, password, confirm_password):
+def validate_registration_form(app, username, password, confirm_password):
     with app.app_context():
         form = RegistrationForm(data={'username': username, 'password': password, 'confirm_password': confirm_password})
         form.validate()
         return form
 
-def test_password_complexity():
+def test_password_complexity(app):
     username = "testuser"
     simple_password = "password"
     complex_password = "Passw0rd$"
@@ -32,7 +23,7 @@ def test_password_complexity():
         assert form.validate()  # Expect this to pass
 
 # Test username length rules
-def test_username_length():
+def test_username_length(app):
     short_username = "ab"
     valid_username = "validuser"
 
@@ -45,7 +36,7 @@ def test_username_length():
 
 # Fixture for setting up a test asset in the database
 @pytest.fixture
-def test_asset():
+def test_asset(app):
     with app.app_context():
         asset = Asset(name='Test Asset', description='Description', owner_id=1)
         db.session.add(asset)
@@ -55,7 +46,7 @@ def test_asset():
         db.session.commit()
 
 # Test asset name uniqueness
-def test_asset_name_uniqueness(test_asset):
+def test_asset_name_uniqueness(app, test_asset):
     with app.app_context():
         form = AssetForm(data={'name': 'Test Asset', 'description': 'Another Description'})
         assert not form.validate()  # Expect this to fail due to duplicate name
@@ -0,0 +1,125 @@
+import re
+import pytest
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from app import create_app
+from cache import TTLCache
+from models import db, User, Asset
+import fragments
+from fragments import get_fragment_cache
+
+@pytest.fixture
+def client(app, add_users):
+    admin_id, user_id = add_users(('admin', 'adminpass', 'admin'), ('user', 'userpass', 'user'))
+    with app.app_context():
+        db.session.add_all([Asset(name='Asset %d' % i, owner_id=user_id) for i in range(1, 4)])
+        db.session.commit()
+    client = app.test_client()
+    client.post('/login', data=dict(username='admin', password='adminpass'))
+    return client
+
+@pytest.fixture
+def renders(monkeypatch):
+    # Counts rows actually rendered, as opposed to served from the cache
+    rendered = []
+    render = fragments._render_row
+    def counting(asset, *args, **kwargs):
+        rendered.append(asset.name)
+        return render(asset, *args, **kwargs)
+    monkeypatch.setattr(fragments, '_render_row', counting)
+    return rendered
+
+def listed(client, query=''):
+    return re.findall(r'<td>(Asset \d[^<]*)', client.get('/assets?' + query).get_data(as_text=True))
+
+# Changes rows the way another worker would: no session events reach this worker's cache
+def raw_sql(app, statement):
+    with app.app_context():
+        db.session.connection().execute(db.text(statement))
+        db.session.commit()
+
+def test_rows_are_rendered_once_until_they_change(client, app, renders):
+    assert listed(client) == ['Asset 1', 'Asset 2', 'Asset 3']
+    assert len(renders) == 3
+    assert listed(client) == ['Asset 1', 'Asset 2', 'Asset 3'] and len(renders) == 3
+    client.post('/assets/edit/2', data={'name': 'Asset 2b'})
+    assert listed(client) == ['Asset 1', 'Asset 2b', 'Asset 3'] and renders[3:] == ['Asset 2b']
+    raw_sql(app, "UPDATE asset SET name = 'Asset 3c', version = version + 1 WHERE id = 3")
+    assert listed(client) == ['Asset 1', 'Asset 2b', 'Asset 3c']
+    # Owner names are part of the stamp too
+    raw_sql(app, "UPDATE user SET username = 'renamed' WHERE username = 'user'")
+    assert client.get('/assets').get_data(as_text=True).count('>renamed</a>') == 3
+
+def test_rows_are_cached_per_role(client, app):
+    assert 'Delete</button>' in client.get('/assets').get_data(as_text=True)
+    other = app.test_client()
+    other.post('/login', data=dict(username='user', password='userpass'))
+    html = other.get('/assets').get_data(as_text=True)
+    assert 'Delete</button>' not in html and 'type="checkbox"' not in html
+    with app.app_context():
+        assert len(get_fragment_cache().rows) == 3
+
+def test_checked_rows_are_not_cached(client, app, renders):
+    client.get('/assets')
+    response = client.post('/assets/bulk', data={'action': 'delete', 'scope': 'selected', 'ids': ['2'], 'preview': 'y'})
+    assert 'value="2" form="bulk-form" aria-label="Select Asset 2" checked' in response.get_data(as_text=True)
+    assert renders[3:] == ['Asset 2']
+    assert 'checked>' not in client.get('/assets').get_data(as_text=True)
+
+def test_cache_size_is_bounded(client, app):
+    with app.app_context():
+        get_fragment_cache().rows = TTLCache(maxsize=2, ttl=60)
+    assert listed(client) == ['Asset 1', 'Asset 2', 'Asset 3']
+    with app.app_context():
+        assert len(get_fragment_cache().rows) == 2
+
+def test_page_cache_skips_the_page_query(client, app):
+    with app.app_context():
+        get_fragment_cache().pages = TTLCache(maxsize=10, ttl=60)
+        engine = db.engine
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    listed(client)
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        assert listed(client) == ['Asset 1', 'Asset 2', 'Asset 3']
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert not any('FROM asset ' in statement for statement in statements)
+    # A commit in this worker clears the cached pages
+    client.post('/assets/new', data={'name': 'Asset 4'})
+    assert listed(client) == ['Asset 1', 'Asset 2', 'Asset 3', 'Asset 4']
+    client.post('/assets/delete/1')
+    assert listed(client) == ['Asset 2', 'Asset 3', 'Asset 4']
+
+# Two workers sharing a database file: a new asset that takes a deleted asset's id (SQLite
+# reuses the highest one) starts at version 1 again, and must not hit the old row's entry
+def test_reused_ids_are_not_served_from_the_cache(tmp_path, hash_method):
+    config = {'TESTING': True, 'WTF_CSRF_ENABLED': False, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path / 'shared.db'),
+              'PASSWORD_HASH_METHOD': hash_method, 'RATE_LIMIT_ENABLED': False,
+              'USER_CACHE_GENERATION_FILE': str(tmp_path / 'user-cache.generation'),
+              'JOB_DIR': str(tmp_path / 'jobs'), 'ATTACHMENT_DIR': str(tmp_path / 'attachments')}
+    first, second = create_app(config), create_app(config)
+    with first.app_context():
+        db.create_all()
+        admin = User(username='admin', password=generate_password_hash('adminpass', method=hash_method), role='admin')
+        db.session.add(admin)
+        db.session.commit()
+        db.session.add(Asset(name='Asset 1 old', owner_id=admin.id))
+        db.session.commit()
+    clients = []
+    for app in (first, second):
+        client = app.test_client()
+        client.post('/login', data=dict(username='admin', password='adminpass'))
+        clients.append(client)
+    assert listed(clients[0]) == ['Asset 1 old']
+    clients[1].post('/assets/delete/1')
+    clients[1].post('/assets/new', data={'name': 'Asset 1 new'})
+    with second.app_context():
+        assert Asset.query.one().id == 1 and Asset.query.one().version == 1
+    assert listed(clients[0]) == ['Asset 1 new']
+    for app in (first, second):
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
@@ -0,0 +1,123 @@
+import io
+import json
+import pytest
+from models import db, User, Asset
+from importer import import_assets, read_records, ImportFailed
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def client(app):
+    # Configures the Flask test client with an admin user and one existing asset
+    with app.test_client() as client:
+        with app.app_context():
+            admin = User(username='admin', password=generate_password_hash('adminpass', method='pbkdf2:sha256'), role='admin')
+            user = User(username='user', password=generate_password_hash('userpass', method='pbkdf2:sha256'), role='user')
+            db.session.add_all([admin, user])
+            db.session.commit()
+            db.session.add(Asset(name='Existing', description='Already here', owner_id=admin.id))
+            db.session.commit()
+            yield client
+
+def login(client, username, password):
+    response = client.post('/login', data=dict(username=username, password=password), follow_redirects=True)
+    assert b'Logged in successfully.' in response.data
+
+CSV = (
+    'name,description,owner\n'
+    'Laptop,Dell XPS 13,user\n'
+    ',Missing name,\n'
+    'Existing,Duplicate of a stored asset,\n'
+    'Laptop,Duplicate within the file,\n'
+    'Monitor,ASUS 27-inch,nobody\n'
+    'Keyboard,Mechanical,\n'
+)
+
+def test_csv_import_validates_rows(client, app):
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        result = import_assets(io.BytesIO(CSV.encode()), 'csv', admin, batch_size=1)
+        assert result.inserted == 2
+        assert [line for line, _ in result.errors] == [3, 4, 5, 6]
+        assert 'required' in result.errors[0][1]
+        assert 'exists' in result.errors[1][1] and 'exists' in result.errors[2][1]
+        assert 'Unknown owner' in result.errors[3][1]
+        laptop = Asset.query.filter_by(name='Laptop').first()
+        assert laptop.owner.username == 'user'
+        assert laptop.created_by == 'admin'
+        assert laptop.date_created is not None
+
+def test_json_array_is_parsed_across_chunk_boundaries():
+    records = [{'name': 'Asset %d' % i, 'description': 'x' * (i % 7)} for i in range(50)]
+    stream = io.BytesIO(json.dumps(records, indent=2).encode())
+    parsed = [record for _, record in read_records(stream, 'json')]
+    assert parsed == records
+    # A tiny chunk size forces objects to be split between reads
+    from importer import _read_json_array
+    stream.seek(0)
+    assert [record for _, record in _read_json_array(stream, chunk_size=7)] == records
+
+def test_invalid_json_is_reported():
+    with pytest.raises(ImportFailed):
+        list(read_records(io.BytesIO(b'{"name": "not an array"}'), 'json'))
+    _, record = next(read_records(io.BytesIO(b'{"name": \n'), 'ndjson'))
+    assert isinstance(record, ValueError)
+
+def test_admin_upload(client, app):
+    login(client, 'admin', 'adminpass')
+    payload = '\n'.join(json.dumps({'name': 'Device %d' % i}) for i in range(25)).encode()
+    response = client.post('/assets/import', data={'file': (io.BytesIO(payload), 'devices.ndjson')},
+                           content_type='multipart/form-data', follow_redirects=True)
+    assert response.status_code == 200
+    assert b'25 assets imported, 0 rows rejected' in response.data
+    with app.app_context():
+        assert Asset.query.count() == 26
+
+def test_regular_user_cannot_import(client):
+    login(client, 'user', 'userpass')
+    response = client.post('/assets/import', data={'file': (io.BytesIO(b'name\nA\n'), 'a.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 403
+
+def test_cli_import(client, app, tmp_path):
+    path = tmp_path / 'assets.csv'
+    path.write_text('name,description\nRouter,Core switch\nFirewall,Edge\n')
+    result = app.test_cli_runner().invoke(args=['assets', 'import', str(path), '--owner', 'admin'])
+    assert result.exit_code == 0, result.output
+    assert '2 assets imported' in result.output
+
+def test_batch_conflict_falls_back_to_row_inserts(client, app, monkeypatch):
+    import importer
+    original = importer.AssetValidator.__init__
+    # Pretend "Existing" was created by another worker after the names were loaded
+    def stale_names(self, owner):
+        original(self, owner)
+        self.names.discard('Existing')
+    monkeypatch.setattr(importer.AssetValidator, '__init__', stale_names)
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        result = import_assets(io.BytesIO(b'name\nFresh\nExisting\nAlso fresh\n'), 'csv', admin, batch_size=10)
+        assert result.inserted == 2
+        assert result.errors == [(3, 'An asset with this name already exists.')]
+        assert Asset.query.count() == 3
+
+def test_limits_match_the_columns():
+    from forms import ASSET_NAME_MAX_LENGTH, ASSET_DESCRIPTION_MAX_LENGTH
+    assert ASSET_NAME_MAX_LENGTH == Asset.__table__.c.name.type.length == 100
+    assert ASSET_DESCRIPTION_MAX_LENGTH == Asset.__table__.c.description.type.length == 200
+
+def test_rejected_values_fall_back_to_row_inserts(client, app, monkeypatch):
+    import importer
+    from sqlalchemy.exc import DataError
+    insert = importer._insert
+    # SQLite does not enforce column lengths; fail the way a stricter database would
+    def strict(batch):
+        if any(values['name'] == 'Too long' for values in batch):
+            raise DataError('INSERT INTO asset', {}, Exception('value too long for type character varying(100)'))
+        insert(batch)
+    monkeypatch.setattr(importer, '_insert', strict)
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        result = import_assets(io.BytesIO(b'name\nFresh\nToo long\nAlso fresh\n'), 'csv', admin, batch_size=10)
+        assert result.inserted == 2
+        assert result.errors == [(3, 'A value does not fit its column.')]
+        assert Asset.query.count() == 3
@@ -0,0 +1,205 @@
+import io
+import os
+import gzip
+from datetime import datetime, timedelta
+import pytest
+from models import db, User, Asset, Job
+from api import create_token
+from jobs import HANDLERS, JobFailed, handler, enqueue, work, claim_next, recover_stale, prune_jobs
+
+@pytest.fixture
+def client(app, add_users):
+    admin_id, user_id = add_users(('admin', 'adminpass', 'admin'), ('user', 'userpass', 'user'))
+    with app.app_context():
+        db.session.add_all([Asset(name='Laptop %d' % i, owner_id=user_id) for i in range(5)])
+        db.session.commit()
+        client = app.test_client()
+        client.token = create_token(db.session.get(User, admin_id), 'tests')
+    client.post('/login', data=dict(username='user', password='userpass'))
+    return client
+
+@pytest.fixture
+def flaky():
+    # A handler failing on its first attempts and raising JobFailed on request
+    @handler('flaky')
+    def flaky_job(context):
+        if context.payload.get('fatal'):
+            raise JobFailed('Bad input')
+        if context.attempt < context.payload['succeed_on']:
+            raise RuntimeError('attempt %d failed' % context.attempt)
+        return {'attempt': context.attempt}
+    yield
+    del HANDLERS['flaky']
+
+def run_jobs(app):
+    with app.app_context():
+        return work(processes=0, once=True)
+
+def test_background_export(client, app):
+    response = client.get('/assets/export?format=csv&q=Laptop&background=1')
+    assert response.status_code == 302 and response.headers['Location'] == '/jobs/1'
+    assert client.get('/jobs/1.json').json['status'] == 'queued'
+    assert b'<td>queued</td>' in client.get('/jobs/1').data
+    assert client.get('/jobs/1/result').status_code == 404
+
+    assert run_jobs(app) == 1
+    status = client.get('/jobs/1.json').json
+    assert (status['status'], status['progress'], status['has_result_file']) == ('succeeded', 100, True)
+    response = client.get('/jobs/1/result')
+    assert response.headers['Content-Disposition'] == 'attachment; filename=assets-1.csv'
+    assert response.data.decode().count('Laptop') == 5
+    assert b'Download' in client.get('/jobs/1').data
+
+def test_background_import(client, app):
+    client.get('/logout')
+    client.post('/login', data=dict(username='admin', password='adminpass'))
+    data = {'file': (io.BytesIO(b'name,description\nDock,USB-C\nDock,dupe\n'), 'assets.csv'), 'background': 'y'}
+    response = client.post('/assets/import', data=data, content_type='multipart/form-data')
+    assert response.headers['Location'] == '/jobs/1'
+    with app.app_context():
+        upload = db.session.get(Job, 1).payload['path']
+    run_jobs(app)
+    result = client.get('/jobs/1.json').json['result']
+    assert (result['inserted'], result['failed']) == (1, 1)
+    with app.app_context():
+        assert Asset.query.filter_by(name='Dock').one().owner.username == 'admin'
+    # The uploaded copy is removed once imported
+    assert not os.path.exists(upload)
+
+def test_retries_back_off_then_fail(app, flaky):
+    app.config['JOB_MAX_ATTEMPTS'] = 2
+    with app.app_context():
+        retried = enqueue('flaky', {'succeed_on': 2}).id
+        failing = enqueue('flaky', {'succeed_on': 3}).id
+        fatal = enqueue('flaky', {'fatal': True}).id
+        assert work(processes=0, once=True) == 3
+        job = db.session.get(Job, retried)
+        assert (job.status, job.attempts) == ('queued', 1) and 'attempt 1 failed' in job.error
+        # Retries wait JOB_RETRY_BACKOFF seconds, doubling each attempt
+        assert abs((job.run_after - datetime.utcnow()).total_seconds() - 10) < 2
+        assert db.session.get(Job, fatal).status == 'failed' and db.session.get(Job, fatal).attempts == 1
+        assert work(processes=0, once=True) == 0
+
+        Job.query.update({'run_after': datetime.utcnow()})
+        db.session.commit()
+        assert work(processes=0, once=True) == 2
+        job = db.session.get(Job, retried)
+        assert (job.status, job.result, job.error) == ('succeeded', {'attempt': 2}, None)
+        job = db.session.get(Job, failing)
+        assert (job.status, job.attempts) == ('failed', 2) and job.finished_at is not None
+
+def test_jobs_are_private_to_their_creator(client, app, add_users):
+    client.get('/assets/export?format=csv&background=1')
+    run_jobs(app)
+    add_users(('other', 'otherpass', 'user'))
+    other = app.test_client()
+    other.post('/login', data=dict(username='other', password='otherpass'))
+    assert other.get('/jobs/1').status_code == 404
+    assert other.get('/jobs/1/result').status_code == 404
+    # Admins see every job
+    headers = {'Authorization': 'Bearer ' + client.token}
+    response = client.get('/api/v1/jobs/1', headers=headers)
+    assert response.json['status'] == 'succeeded' and response.json['result_url'] == '/api/v1/jobs/1/result'
+
+def test_api_export_job(client, app):
+    headers = {'Authorization': 'Bearer ' + client.token}
+    response = client.post('/api/v1/jobs/export', json={'format': 'ndjson', 'filter': {'q': 'Laptop'}, 'gzip': True},
+                           headers=headers)
+    assert response.status_code == 202 and response.headers['Location'] == '/api/v1/jobs/1'
+    assert client.get('/api/v1/jobs/1/result', headers=headers).status_code == 404
+    run_jobs(app)
+    response = client.get('/api/v1/jobs/1/result', headers=headers)
+    assert len(gzip.decompress(response.data).splitlines()) == 5
+    assert client.post('/api/v1/jobs/export', json={'format': 'pdf'}, headers=headers).status_code == 400
+
+def test_stale_jobs_are_requeued(app, flaky):
+    with app.app_context():
+        job_id = enqueue('flaky', {'succeed_on': 1}).id
+        assert claim_next('gone:1') == job_id
+        assert claim_next('other:2') is None
+        assert recover_stale() == 0
+        Job.query.update({'heartbeat_at': datetime.utcnow() - timedelta(hours=1)})
+        db.session.commit()
+        assert recover_stale() == 1
+        job = db.session.get(Job, job_id)
+        assert (job.status, job.worker) == ('queued', None) and 'stopped responding' in job.error
+
+def test_prune_removes_old_jobs_and_files(client, app):
+    client.get('/assets/export?format=csv&background=1')
+    run_jobs(app)
+    with app.app_context():
+        assert prune_jobs(1) == 0
+        Job.query.update({'finished_at': datetime.utcnow() - timedelta(days=2)})
+        db.session.commit()
+        assert prune_jobs(1) == 1 and Job.query.count() == 0
+    assert not os.path.exists(os.path.join(app.config['JOB_DIR'], '1'))
+
+def test_worker_runs_jobs_in_a_process_pool(tmp_path):
+    from app import create_app
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path / 'jobs.db'),
+                      'JOB_DIR': str(tmp_path / 'jobs'),
+                      'USER_CACHE_GENERATION_FILE': str(tmp_path / 'user-cache.generation')})
+    with app.app_context():
+        db.create_all()
+        owner = User(username='admin', password='x', role='admin')
+        db.session.add_all([Asset(name='Asset %d' % i, owner=owner) for i in range(3)])
+        db.session.commit()
+        ids = [enqueue('export', {'format': 'csv'}).id for _ in range(3)]
+        assert work(processes=2, once=True, poll_interval=0.1) == 3
+        db.session.expire_all()
+        assert [job.status for job in Job.query.order_by(Job.id)] == ['succeeded'] * 3
+        assert {job.result['filename'] for job in Job.query} == {'assets-%d.csv' % job_id for job_id in ids}
+        db.session.remove()
+        db.engine.dispose()
+
+def test_report_job(client, app):
+    assert client.post('/api/v1/jobs/report').status_code == 403
+    client.get('/logout')
+    assert client.post('/api/v1/jobs/report').status_code == 401
+    headers = {'Authorization': 'Bearer ' + client.token}
+    response = client.post('/api/v1/jobs/report', json={'rebuild': True}, headers=headers)
+    assert response.status_code == 202 and response.json['kind'] == 'report'
+    run_jobs(app)
+    assert client.get('/api/v1/jobs/1', headers=headers).json['result'] == {'assets': 5}
+    client.post('/api/v1/jobs/report', headers=headers)
+    run_jobs(app)
+    assert client.get('/api/v1/jobs/2', headers=headers).json['result'] == {'changes': 0}
+
+def test_import_without_its_user_fails_for_good(app):
+    with app.app_context():
+        path = os.path.join(app.config['JOB_DIR'], 'orphan.csv')
+        os.makedirs(app.config['JOB_DIR'])
+        with open(path, 'wb') as f:
+            f.write(b'name\nDock\n')
+        job_id = enqueue('import', {'path': path, 'format': 'csv'}).id
+        run_jobs(app)
+        job = db.session.get(Job, job_id)
+        assert (job.status, job.attempts) == ('failed', 1) and 'no longer exists' in job.error
+
+def test_retried_import_resumes_after_its_last_batch(client, app, monkeypatch):
+    import importer
+    client.get('/logout')
+    client.post('/login', data=dict(username='admin', password='adminpass'))
+    rows = b'name\n' + b''.join(b'Cable %d\n' % i for i in range(7)) + b'Laptop 0\n'
+    app.config['IMPORT_BATCH_SIZE'] = 2
+    data = {'file': (io.BytesIO(rows), 'assets.csv'), 'background': 'y'}
+    client.post('/assets/import', data=data, content_type='multipart/form-data')
+    insert = importer._insert
+    calls = []
+    # The worker dies (as far as the job is concerned) while writing the third batch
+    def failing(batch):
+        calls.append(batch)
+        if len(calls) == 3:
+            raise RuntimeError('connection lost')
+        return insert(batch)
+    monkeypatch.setattr(importer, '_insert', failing)
+    run_jobs(app)
+    with app.app_context():
+        job = db.session.get(Job, 1)
+        assert job.status == 'queued' and job.checkpoint['line'] == 5 and job.checkpoint['inserted'] == 4
+        Job.query.update({'run_after': datetime.utcnow()})
+        db.session.commit()
+    run_jobs(app)
+    result = client.get('/jobs/1.json').json['result']
+    assert (result['inserted'], result['failed']) == (7, 1)
+    assert result['errors'] == [[9, 'An asset with this name already exists.']]
@@ -0,0 +1,91 @@
+import logging
+import pytest
+from sqlalchemy.exc import OperationalError
+from models import db, User, Asset
+from api import create_token
+from metrics import Histogram
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def client(app):
+    # Configures the Flask test client with an admin, a user and a few assets
+    app.config['METRICS_ENABLED'] = True
+    client = app.test_client()
+    with app.app_context():
+        admin = User(username='admin', password=generate_password_hash('adminpass', method='pbkdf2:sha256'), role='admin')
+        user = User(username='user', password=generate_password_hash('userpass', method='pbkdf2:sha256'), role='user')
+        db.session.add_all([admin, user])
+        db.session.commit()
+        for i in range(3):
+            db.session.add(Asset(name='Asset %d' % i, owner_id=user.id, created_by='user'))
+        db.session.commit()
+        client.token = create_token(admin, 'prometheus')
+    yield client
+
+def login(client, username='admin', password='adminpass'):
+    response = client.post('/login', data=dict(username=username, password=password), follow_redirects=True)
+    assert b'Logged in successfully.' in response.data
+
+def sample(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix):
+            return float(line.rsplit(' ', 1)[1])
+    return 0.0
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('demo_seconds', 'Demo.', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, route='x')
+    lines = histogram.render()
+    assert 'demo_seconds_bucket{route="x",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{route="x",le="1.0"} 3' in lines
+    assert 'demo_seconds_bucket{route="x",le="+Inf"} 4' in lines
+    assert 'demo_seconds_count{route="x"} 4' in lines
+    assert 'demo_seconds_sum{route="x"} 4.05' in lines
+
+def test_metrics_record_requests_sql_templates_and_hashing(client):
+    login(client)
+    before = client.get('/metrics').get_data(as_text=True)
+    login(client)
+    response = client.get('/assets')
+    assert response.status_code == 200
+    # The list page is streamed; its render is only timed once the body is consumed
+    assert b'Asset 0' in response.get_data()
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+
+    prefix = 'http_request_duration_seconds_count{endpoint="assets.list_assets",method="GET",status="200"}'
+    assert sample(text, prefix) == sample(before, prefix) + 1
+    assert sample(text, 'http_request_sql_queries_sum{endpoint="assets.list_assets"}') > sample(before, 'http_request_sql_queries_sum{endpoint="assets.list_assets"}')
+    assert sample(text, 'template_render_seconds_count{template="list_assets.html"}') >= 1
+    assert sample(text, 'password_hash_seconds_count{operation="check"}') == sample(before, 'password_hash_seconds_count{operation="check"}') + 1
+    # Scrapes are not counted as requests
+    assert 'endpoint="metrics"' not in text
+
+def test_slow_request_log_includes_sql(client, app, caplog):
+    login(client)
+    app.config['SLOW_REQUEST_MS'] = 0.0001
+    with caplog.at_level(logging.WARNING, logger='asset_manager.slow'):
+        client.get('/assets').close()
+    messages = [record.getMessage() for record in caplog.records if record.name == 'asset_manager.slow']
+    assert any('Slow request GET /assets' in message and 'FROM asset' in message for message in messages)
+
+def test_metrics_are_for_admins_only(client, app):
+    assert client.get('/metrics').status_code == 401
+    scrape = client.get('/metrics', headers={'Authorization': 'Bearer ' + client.token})
+    assert scrape.status_code == 200 and 'http_request_duration_seconds' in scrape.get_data(as_text=True)
+    login(client, 'user', 'userpass')
+    assert client.get('/metrics').status_code == 403
+    app.config['METRICS_ENABLED'] = False
+    assert client.get('/metrics', headers={'Authorization': 'Bearer ' + client.token}).status_code == 404
+
+def test_failed_statements_do_not_leak_timers(app):
+    with app.app_context():
+        connection = db.session.connection()
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(db.text('SELECT * FROM no_such_table'))
+            db.session.rollback()
+            connection = db.session.connection()
+        assert connection.info.get('query_started') == []
@@ -0,0 +1,100 @@
+import io
+import pytest
+from sqlalchemy import event
+from models import db, User, Asset
+from api import create_token
+from importer import import_assets
+from owners import recount_assets
+
+@pytest.fixture
+def client(app, add_users):
+    add_users(('admin', 'adminpass', 'admin'), ('user', 'userpass', 'user'))
+    client = app.test_client()
+    client.post('/login', data=dict(username='admin', password='adminpass'))
+    return client
+
+def counts(app):
+    with app.app_context():
+        return {user.username: user.asset_count for user in User.query}
+
+def add_assets(app, owners):
+    # Creates one asset per entry of owners, each entry being an owner id
+    with app.app_context():
+        db.session.add_all([Asset(name='Asset %d' % i, owner_id=owner_id) for i, owner_id in enumerate(owners)])
+        db.session.commit()
+
+# Counts the statements a request runs
+def query_count(app, client, url):
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+        assert response.status_code == 200
+        response.get_data()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return len(statements)
+
+def test_counts_follow_creates_owner_changes_and_deletes(client, app):
+    client.post('/assets/new', data=dict(name='Laptop', description='XPS'))
+    client.post('/assets/new', data=dict(name='Monitor', description='ASUS'))
+    assert counts(app) == {'admin': 2, 'user': 0}
+
+    with app.app_context():
+        token = create_token(User.query.filter_by(username='admin').first(), 'tests')
+        laptop = Asset.query.filter_by(name='Laptop').first().id
+    headers = {'Authorization': 'Bearer ' + token}
+    assert client.patch('/api/v1/assets/%d' % laptop, json={'owner_id': 2}, headers=headers).status_code == 200
+    assert counts(app) == {'admin': 1, 'user': 1}
+
+    client.post('/assets/delete/%d' % laptop)
+    assert counts(app) == {'admin': 1, 'user': 0}
+
+def test_bulk_imports_and_rollbacks(client, app):
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        import_assets(io.BytesIO(b'name,owner\nA,admin\nB,user\nC,user\n'), 'csv', admin, batch_size=2)
+        assert admin.asset_count == 1
+        db.session.add(Asset(name='D', owner_id=admin.id))
+        db.session.flush()
+        assert admin.asset_count == 2
+        db.session.rollback()
+    assert counts(app) == {'admin': 1, 'user': 2}
+
+def test_recount_repairs_drift(client, app):
+    add_assets(app, [1, 1, 2])
+    with app.app_context():
+        db.session.execute(db.text('UPDATE user SET asset_count = 0'))
+        db.session.commit()
+        assert recount_assets() == 2
+        assert recount_assets() == 0
+    assert counts(app) == {'admin': 2, 'user': 1}
+
+def test_owner_pages(client, app):
+    add_assets(app, [1, 2, 2])
+    response = client.get('/owners')
+    html = response.get_data(as_text=True)
+    assert html.index('>user</a>') < html.index('>admin</a>') and '<td>2</td>' in html
+    html = client.get('/owners/2').get_data(as_text=True)
+    assert 'Assets owned by user' in html and 'Asset 1' in html and 'Asset 0' not in html
+    html = client.get('/assets/mine').get_data(as_text=True)
+    assert 'My Assets' in html and 'Asset 0' in html and 'Asset 1' not in html
+    assert client.get('/owners/99').status_code == 404
+
+def test_lists_take_a_fixed_number_of_queries(client, app, add_users):
+    ids = add_users(*[('owner%d' % i, 'ownerpass', 'user') for i in range(30)])
+    urls = ('/assets', '/owners', '/owners/%d' % ids[0])
+    add_assets(app, ids[:3])
+    # The first request also checks once whether the full text index exists
+    client.get('/assets').get_data()
+    small = [query_count(app, client, url) for url in urls]
+    with app.app_context():
+        db.session.add_all([Asset(name='More %d' % i, owner_id=owner_id) for i, owner_id in enumerate(ids)])
+        db.session.commit()
+    large = [query_count(app, client, url) for url in urls]
+    # Asset lists add one query each for tags and attributes; /assets also one for the facets
+    assert small == large == [4, 1, 4]
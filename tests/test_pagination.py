@@ -0,0 +1,62 @@
+import re
+from datetime import datetime, timedelta
+import pytest
+from models import db, User, Asset
+from pagination import encode_cursor, decode_cursor, InvalidCursor
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def client(app):
+    # Configures the Flask test client with an empty database
+    # Not used as a context manager so responses are streamed as in production
+    app.config['STREAM_TEMPLATES'] = True
+    client = app.test_client()
+    with app.app_context():
+        user = User(username='pager', password=generate_password_hash('pagerpass', method='pbkdf2:sha256'), role='user')
+        db.session.add(user)
+        db.session.commit()
+        # Two assets share a timestamp so the id tie-breaker is exercised
+        start = datetime(2024, 1, 1)
+        stamps = [start, start + timedelta(days=1), start + timedelta(days=1), start + timedelta(days=2), None]
+        for i, stamp in enumerate(stamps):
+            db.session.add(Asset(name=f'Asset {i}', description='paged', owner_id=user.id, date_created=stamp))
+        db.session.commit()
+        # The model default fills date_created, so clear it explicitly for the NULL case
+        Asset.query.filter_by(name='Asset 4').update({'date_created': None})
+        db.session.commit()
+        yield client
+
+def login(client):
+    response = client.post('/login', data=dict(username='pager', password='pagerpass'), follow_redirects=True)
+    assert b'Logged in successfully.' in response.data
+
+# Walks every page of the list and collects the asset names in display order
+def collect_pages(client, per_page):
+    names, url, pages = [], f'/assets?per_page={per_page}', 0
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.is_streamed
+        html = response.get_data(as_text=True)
+        names.extend(re.findall(r'<td>(Asset \d)</td>', html))
+        match = re.search(r'href="(/assets\?cursor=[^"]+)"', html)
+        url = match.group(1).replace('&amp;', '&') if match else None
+        pages += 1
+    return names, pages
+
+def test_pages_cover_every_asset_once(client):
+    login(client)
+    names, pages = collect_pages(client, per_page=2)
+    # NULL dates sort first, then (date_created, id) ascending
+    assert names == ['Asset 4', 'Asset 0', 'Asset 1', 'Asset 2', 'Asset 3']
+    assert pages == 3
+
+def test_invalid_cursor_is_rejected(client):
+    login(client)
+    assert client.get('/assets?cursor=not-a-cursor').status_code == 400
+
+def test_cursor_round_trip():
+    values = [datetime(2024, 5, 1, 12, 30), 42]
+    assert decode_cursor(encode_cursor(values), 2) == values
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor(values), 3)
@@ -0,0 +1,61 @@
+import threading
+import pytest
+from models import db, User
+from passwords import DEFAULT_METHOD, get_hasher, HashingBusy
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def client(app):
+    # Configures the Flask test client with a user whose hash predates the configured method
+    client = app.test_client()
+    with app.app_context():
+        db.session.add(User(username='legacy', password=generate_password_hash('legacypass', method='pbkdf2:sha256'), role='user'))
+        db.session.commit()
+    yield client
+
+def test_login_rehashes_outdated_hashes(client, app):
+    response = client.post('/login', data=dict(username='legacy', password='legacypass'), follow_redirects=True)
+    assert b'Logged in successfully.' in response.data
+    with app.app_context():
+        stored = User.query.filter_by(username='legacy').first().password
+        assert stored.startswith(app.config['PASSWORD_HASH_METHOD'] + '$')
+        assert not get_hasher().needs_rehash(stored)
+        assert get_hasher().verify(stored, 'legacypass')
+    # The upgraded hash still logs the user in
+    client.get('/logout')
+    response = client.post('/login', data=dict(username='legacy', password='legacypass'), follow_redirects=True)
+    assert b'Logged in successfully.' in response.data
+
+def test_wrong_password_does_not_rehash(client, app):
+    response = client.post('/login', data=dict(username='legacy', password='nope'), follow_redirects=True)
+    assert b'Invalid credentials.' in response.data
+    with app.app_context():
+        assert User.query.filter_by(username='legacy').first().password.startswith('pbkdf2:sha256')
+
+def test_register_uses_configured_method(client, app):
+    response = client.post('/register', data=dict(username='newuser', password='Str0ngPass!', confirm_password='Str0ngPass!'),
+                           follow_redirects=True)
+    assert b'Registration successful.' in response.data
+    with app.app_context():
+        assert not get_hasher().needs_rehash(User.query.filter_by(username='newuser').first().password)
+
+def test_login_is_turned_away_when_hashing_is_saturated(client, app):
+    with app.app_context():
+        hasher = get_hasher()
+    slots, timeout = hasher.slots, hasher.timeout
+    hasher.slots, hasher.timeout = threading.BoundedSemaphore(1), 0
+    hasher.slots.acquire()
+    try:
+        with app.app_context(), pytest.raises(HashingBusy):
+            hasher.hash('anything')
+        response = client.post('/login', data=dict(username='legacy', password='legacypass'))
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+    finally:
+        hasher.slots, hasher.timeout = slots, timeout
+
+# Logins rehash old passwords with the default method, so its hashes must fit the column
+# (PostgreSQL rejects longer values where SQLite would store them anyway)
+def test_default_method_hashes_fit_the_password_column():
+    stored = generate_password_hash('x' * 200, method=DEFAULT_METHOD)
+    assert len(stored) <= User.__table__.c.password.type.length
@@ -0,0 +1,101 @@
+import pytest
+from app import create_app
+from models import db
+from passwords import get_hasher
+from ratelimit import RateLimiter, parse_limit, parse_limits, get_rate_limiter
+
+@pytest.fixture
+def verifications(app, monkeypatch):
+    # Counts password checks, which are what the limiter protects
+    calls = []
+    with app.app_context():
+        hasher = get_hasher()
+    verify = hasher.verify
+    monkeypatch.setattr(hasher, 'verify', lambda stored, password: calls.append(password) or verify(stored, password))
+    return calls
+
+def login(client, username, password='wrong'):
+    return client.post('/login', data=dict(username=username, password=password))
+
+def test_parse_limits():
+    assert parse_limit('5/minute') == (5, 5 / 60.0)
+    assert parse_limit('100 / 10 minutes') == (100, 100 / 600.0)
+    assert parse_limits('ip=20/minute, username=5/hour') == {'ip': '20/minute', 'username': '5/hour'}
+    with pytest.raises(ValueError):
+        parse_limit('5 per minute')
+    with pytest.raises(ValueError):
+        parse_limit('0/minute')
+
+def test_buckets_refill_at_the_rate(app):
+    with app.app_context():
+        limiter = get_rate_limiter()
+    bucket = {'k': parse_limit('2/minute')}
+    assert limiter.take(bucket, now=0) == 0
+    assert limiter.take(bucket, now=0) == 0
+    assert limiter.take(bucket, now=0) == pytest.approx(30)
+    # Half a token is back after 15 seconds, a whole one after 30
+    assert limiter.take(bucket, now=15) == pytest.approx(15)
+    assert limiter.take(bucket, now=30) == 0
+    # A rejection takes nothing from the other buckets of the attempt
+    other = {'other': parse_limit('1/minute')}
+    assert limiter.take(dict(bucket, **other), now=30) == pytest.approx(30)
+    assert limiter.take(other, now=30) == 0
+
+def test_login_is_throttled_per_username_before_hashing(app, client, add_users, verifications):
+    add_users(('admin', 'adminpass', 'admin'))
+    for _ in range(5):
+        assert login(client, 'admin').status_code == 200
+    response = login(client, 'Admin', 'adminpass')
+    assert response.status_code == 429 and 0 < int(response.headers['Retry-After']) <= 12
+    assert b'Too many attempts' in response.data
+    assert len(verifications) == 5
+    # Other accounts are still reachable from the same address
+    assert login(client, 'user').status_code == 200
+
+def test_login_is_throttled_per_address(app, client, verifications):
+    statuses = [login(client, 'user%d' % i).status_code for i in range(21)]
+    assert statuses == [200] * 20 + [429]
+    assert len(verifications) == 0  # unknown users are never hashed either
+    other = app.test_client()
+    response = other.post('/login', data=dict(username='user99', password='x'), environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert response.status_code == 200
+
+def test_register_limit_is_configurable(app, client):
+    app.config['RATE_LIMITS'] = {'register': 'ip=1/hour', 'login': {'ip': None, 'username': '1/minute'}}
+    RateLimiter(app)
+    assert client.post('/register', data=dict(username='a', password='x')).status_code == 200
+    response = client.post('/register', data=dict(username='b', password='x'))
+    assert response.status_code == 429 and int(response.headers['Retry-After']) == 3600
+    assert login(client, 'a').status_code == 200 and login(client, 'a').status_code == 429
+
+def test_workers_share_buckets(app):
+    # Another app on the same host stands in for a second gunicorn worker
+    other = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                        'RATE_LIMIT_STORAGE': app.config['RATE_LIMIT_STORAGE']})
+    bucket = {'shared': parse_limit('3/hour')}
+    with app.app_context():
+        assert [get_rate_limiter().take(bucket, now=0) for _ in range(2)] == [0, 0]
+    with other.app_context():
+        assert get_rate_limiter().take(bucket, now=0) == 0
+        assert get_rate_limiter().take(bucket, now=0) > 0
+
+def test_disabled_or_broken_store_lets_requests_through(app, client, tmp_path):
+    app.extensions['rate_limiter'].path = str(tmp_path)  # a directory, which sqlite cannot open
+    assert all(login(client, 'admin').status_code == 200 for _ in range(10))
+    app.config['RATE_LIMIT_ENABLED'] = False
+    RateLimiter(app)
+    assert all(login(client, 'admin').status_code == 200 for _ in range(10))
+
+def test_client_address_from_trusted_proxy(app):
+    proxied = create_app(dict(app.config, PROXY_FIX_X_FOR=1))
+    with proxied.app_context():
+        db.create_all()
+    client = proxied.test_client()
+    def attempt(address):
+        return client.post('/login', data=dict(username='user', password='x'), headers={'X-Forwarded-For': address})
+    assert [attempt('203.0.113.7').status_code for _ in range(6)] == [200] * 5 + [429]
+    # Each forwarded address gets a bucket of its own
+    proxied.config['RATE_LIMITS'] = {'login': 'ip=1/minute'}
+    RateLimiter(proxied)
+    assert attempt('203.0.113.7').status_code == 200 and attempt('203.0.113.7').status_code == 429
+    assert attempt('203.0.113.8').status_code == 200
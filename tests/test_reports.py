@@ -0,0 +1,116 @@
+import io
+from datetime import date, datetime, timedelta
+import pytest
+from models import db, User, Asset, AssetChange, ReportState, ReportAssetDay, ReportAssetCreator
+from api import create_token
+from bulk import bulk_delete, bulk_update
+from importer import import_assets
+from changes import latest_cursor
+from reports import asset_report, rebuild, refresh
+
+TODAY = date(2026, 10, 14)  # a Wednesday
+
+@pytest.fixture
+def client(app, add_users):
+    admin_id, user_id = add_users(('admin', 'adminpass', 'admin'), ('user', 'userpass', 'user'))
+    # Small chunks make every read below span several round trips
+    app.config['REPORT_CHUNK_SIZE'] = 2
+    with app.app_context():
+        db.session.add_all([
+            Asset(name='Old server', owner_id=admin_id, created_by='admin', date_created=datetime(2023, 1, 5, 9)),
+            Asset(name='Switch', owner_id=admin_id, created_by='admin', date_created=datetime(2026, 3, 1, 12)),
+            Asset(name='Laptop', owner_id=user_id, created_by='user', date_created=datetime(2026, 10, 13, 8)),
+            Asset(name='Dock', owner_id=user_id, created_by='admin', date_created=datetime(2026, 10, 5, 17)),
+            Asset(name='Mouse', owner_id=user_id, date_created=datetime(2026, 10, 14, 7)),
+        ])
+        db.session.commit()
+        client = app.test_client()
+        client.token = create_token(db.session.get(User, admin_id), 'tests')
+    client.post('/login', data=dict(username='user', password='userpass'))
+    return client
+
+def summaries():
+    return ({row.day: row.assets for row in ReportAssetDay.query},
+            {row.created_by: row.assets for row in ReportAssetCreator.query})
+
+def test_report_aggregates(client, app):
+    with app.app_context():
+        assert asset_report(today=TODAY) is None
+        rebuild()
+        report = asset_report(today=TODAY)
+    assert report['total'] == 5 and report['undated'] == 0
+    weekly = report['weekly']
+    assert len(weekly) == 26 and weekly[-1] == {'week': '2026-10-12', 'assets': 2}
+    assert weekly[-2] == {'week': '2026-10-05', 'assets': 1} and sum(week['assets'] for week in weekly) == 3
+    assert [bucket['assets'] for bucket in report['aging']] == [3, 0, 1, 0, 1]
+    assert report['creators'] == [{'created_by': 'admin', 'assets': 3}, {'created_by': None, 'assets': 1},
+                                  {'created_by': 'user', 'assets': 1}]
+    owners = report['owners']
+    assert (owners['users'], owners['owners'], owners['median'], owners['max']) == (2, 2, 2, 3)
+    assert [owner['username'] for owner in owners['top']] == ['user', 'admin']
+
+def test_refresh_matches_a_rebuild(client, app):
+    with app.app_context():
+        rebuild()
+        admin = User.query.filter_by(username='admin').first()
+        # ORM create, update and delete
+        db.session.add(Asset(name='Printer', owner_id=admin.id, created_by='user', date_created=datetime(2026, 9, 1)))
+        laptop = Asset.query.filter_by(name='Laptop').first()
+        laptop.date_created, laptop.created_by = datetime(2025, 6, 1), 'admin'
+        db.session.delete(Asset.query.filter_by(name='Switch').first())
+        db.session.commit()
+        # Bulk statements log their changes too
+        import_assets(io.BytesIO(b'name\nCable 1\nCable 2\nCable 3\n'), 'csv', admin, batch_size=2)
+        bulk_update({'description': 'Spare'}, filters={'q': 'Cable'})
+        bulk_delete(filters={'name': 'Cable 1'})
+
+        assert refresh() == 10
+        assert refresh() == 0
+        incremental = summaries()
+        rebuild()
+        assert summaries() == incremental
+        days, creators = incremental
+        assert creators == {'admin': 5, 'user': 1, '': 1}
+        assert date(2026, 3, 1) not in days and days[date(2025, 6, 1)] == 1
+
+def test_pruned_feed_forces_a_rebuild(client, app):
+    with app.app_context():
+        rebuild()
+        db.session.add(Asset(name='Hub', owner_id=1, date_created=datetime(2026, 10, 1)))
+        db.session.commit()
+        db.session.add(Asset(name='Hub 2', owner_id=1, date_created=datetime(2026, 10, 1)))
+        db.session.commit()
+        # Only the last change is left, so the first Hub would be missed by a refresh
+        AssetChange.query.filter(AssetChange.id < latest_cursor()).delete()
+        db.session.commit()
+        assert refresh() == 0
+        assert summaries()[0][date(2026, 10, 1)] == 2
+        assert asset_report(today=TODAY)['total'] == 7
+
+def test_reports_only_read_the_summaries(client, app):
+    with app.app_context():
+        refresh()
+        admin_id = User.query.filter_by(username='admin').first().id
+        db.session.add(Asset(name='Hub', owner_id=admin_id, created_by='admin', date_created=datetime(2026, 10, 1)))
+        db.session.commit()
+        cursor = db.session.get(ReportState, 'assets').cursor
+    html = client.get('/reports').get_data(as_text=True)
+    # The new asset is left to the next refresh, owners included
+    assert '5 assets' in html and '2 of 2 users own assets' in html
+    with app.app_context():
+        assert db.session.get(ReportState, 'assets').cursor == cursor
+        assert refresh() == 1
+        report = asset_report(today=TODAY)
+    assert report['total'] == 6 and report['owners']['top'][0] == {'id': admin_id, 'username': 'admin', 'assets': 3}
+
+def test_reports_page_and_api(client, app):
+    headers = {'Authorization': 'Bearer ' + client.token}
+    assert 'have not been built yet' in client.get('/reports').get_data(as_text=True)
+    assert client.get('/api/v1/reports/assets', headers=headers).status_code == 503
+    app.test_cli_runner().invoke(args=['reports', 'refresh'])
+    html = client.get('/reports').get_data(as_text=True)
+    assert 'Assets Created per Week' in html and '(not recorded)' in html and '5 assets' in html
+    response = client.get('/api/v1/reports/assets', headers=headers)
+    assert response.json['total'] == 5 and response.json['owners']['top'][0]['username'] == 'user'
+    client.get('/logout')
+    assert client.get('/reports').status_code == 302
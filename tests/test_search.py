@@ -0,0 +1,78 @@
+import re
+from datetime import datetime
+import pytest
+from models import db, User, Asset
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def client(app):
+    # Configures the Flask test client with a small inventory to search
+    with app.test_client() as client:
+        with app.app_context():
+            alice = User(username='alice', password=generate_password_hash('alicepass', method='pbkdf2:sha256'), role='user')
+            bob = User(username='bob', password=generate_password_hash('bobpass', method='pbkdf2:sha256'), role='user')
+            db.session.add_all([alice, bob])
+            db.session.commit()
+            db.session.add_all([
+                Asset(name='Laptop Dell', description='XPS 13 in Building 3', owner_id=alice.id, created_by='alice', date_created=datetime(2024, 1, 10)),
+                Asset(name='laptop Lenovo', description='ThinkPad', owner_id=bob.id, created_by='bob', date_created=datetime(2024, 2, 10)),
+                Asset(name='Monitor', description='ASUS 27-inch', owner_id=alice.id, created_by='bob', date_created=datetime(2024, 3, 10)),
+                Asset(name='Keyboard', description='Mechanical, building 5', owner_id=bob.id, created_by='alice', date_created=datetime(2024, 4, 10)),
+            ])
+            db.session.commit()
+            yield client
+
+def login(client):
+    response = client.post('/login', data=dict(username='alice', password='alicepass'), follow_redirects=True)
+    assert b'Logged in successfully.' in response.data
+
+# Returns the asset names shown for the given query string
+def listed(client, query):
+    response = client.get('/assets?' + query)
+    assert response.status_code == 200
+    return re.findall(r'<tr>\s*<td>([^<]+)</td>', response.get_data(as_text=True))
+
+def test_fulltext_search_covers_name_and_description(client):
+    login(client)
+    assert listed(client, 'q=building') == ['Laptop Dell', 'Keyboard']
+    assert listed(client, 'q=think') == ['laptop Lenovo']
+
+def test_name_prefix_is_case_insensitive(client):
+    login(client)
+    assert listed(client, 'name=LAP') == ['Laptop Dell', 'laptop Lenovo']
+
+def test_equality_and_date_filters(client, app):
+    login(client)
+    with app.app_context():
+        bob = User.query.filter_by(username='bob').first()
+    assert listed(client, f'owner_id={bob.id}') == ['laptop Lenovo', 'Keyboard']
+    assert listed(client, 'created_by=bob') == ['laptop Lenovo', 'Monitor']
+    assert listed(client, 'created_from=2024-02-10&created_to=2024-03-10') == ['laptop Lenovo', 'Monitor']
+
+def test_sort_orders(client):
+    login(client)
+    assert listed(client, 'sort=-date_created') == ['Keyboard', 'Monitor', 'laptop Lenovo', 'Laptop Dell']
+    assert listed(client, 'sort=name&per_page=2') == ['Keyboard', 'Laptop Dell']
+
+def test_prefix_search_uses_index(client, app):
+    with app.app_context():
+        plan = db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN SELECT id FROM asset WHERE lower(name) >= 'lap' AND lower(name) < 'laq'"
+        )).all()
+    assert any('ix_asset_name_lower' in row[-1] for row in plan)
+
+# Tests that autogenerate leaves the FTS5 table and its shadow tables alone after a full upgrade
+def test_migrations_match_the_models(tmp_path):
+    import os
+    from flask_migrate import upgrade, check
+    from app import create_app
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path / 'migrated.db'),
+                      'USER_CACHE_GENERATION_FILE': str(tmp_path / 'user-cache.generation'),
+                      'RATE_LIMIT_STORAGE': str(tmp_path / 'ratelimit.sqlite')})
+    directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+    with app.app_context():
+        upgrade(directory=directory)
+        assert db.inspect(db.engine).has_table('asset_fts')
+        # Raises SystemExit when autogenerate would change the schema
+        check(directory=directory)
+        db.engine.dispose()
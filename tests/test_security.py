@@ -1,20 +1,11 @@
 import pytest
 from werkzeug.security import generate_password_hash, check_password_hash
-from app import app, db, User
 
 @pytest.fixture
-def client():
-    app.config['TESTING'] = True
-    app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
-    with app.test_client() as client:
-        with app.app_context():
-            # Create a test user in the db
-            db.create_all()
-            user = User(username='testuser', password=generate_password_hash('testpass', method='pbkdf2:sha256'), role='user')
-            db.session.add(user)
-            db.session.commit()
-            yield client
-            db.drop_all()
+def client(app, add_users):
+    # Create a test user in the db
+    add_users(('testuser', 'testpass', 'user'))
+    return app.test_client()
 
 def login(client, username, password):
     return client.post('/login', data=dict(
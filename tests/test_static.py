@@ -0,0 +1,99 @@
+import base64
+import gzip
+import hashlib
+import os
+import re
+import pytest
+from models import db, Asset
+from static_assets import integrity_of, precompress, VENDOR
+
+@pytest.fixture
+def client(app, add_users, tmp_path):
+    # Serves a throwaway static folder so precompressed files do not land in the repository
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    (static / 'css' / 'styles.css').write_text('body { font-family: Arial, sans-serif; }\n' * 40)
+    app.static_folder = str(static)
+    user_id, = add_users(('user', 'userpass', 'user'))
+    with app.app_context():
+        db.session.add_all([Asset(name='Asset %d' % i, description='Rack %d' % (i % 4), owner_id=user_id)
+                            for i in range(60)])
+        db.session.commit()
+    client = app.test_client()
+    client.post('/login', data=dict(username='user', password='userpass'))
+    return client
+
+def stylesheet_url(client):
+    html = client.get('/assets').get_data(as_text=True)
+    return re.search(r'href="(/static/css/styles\.[0-9a-f]{12}\.css)"', html).group(1)
+
+def test_pages_link_fingerprinted_static_files(client):
+    html = client.get('/assets').get_data(as_text=True)
+    assert re.search(r'/static/css/styles\.[0-9a-f]{12}\.css', html)
+    # Vendored files that have not been fetched come from the CDN, pinned by their integrity hash
+    source, integrity = VENDOR['vendor/bootstrap/bootstrap.min.css']
+    assert '<link href="%s" rel="stylesheet" integrity="%s" crossorigin="anonymous">' % (source, integrity) in html
+    assert html.count('crossorigin="anonymous"') == 5
+
+def test_fetched_vendor_files_are_served_locally(client, app):
+    filename = 'vendor/jquery/jquery.slim.min.js'
+    path = os.path.join(app.static_folder, filename)
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write('/* jQuery */')
+    html = client.get('/assets').get_data(as_text=True)
+    assert re.search(r'<script src="/static/vendor/jquery/jquery\.slim\.min\.[0-9a-f]{12}\.js"></script>', html)
+    assert VENDOR[filename][0] not in html
+
+def test_integrity_values_use_the_pinned_algorithm():
+    assert integrity_of(b'alert(1)', 'sha384-x') == 'sha384-' + base64.b64encode(hashlib.sha384(b'alert(1)').digest()).decode()
+
+def test_fingerprinted_urls_are_cached_as_immutable(client, app):
+    url = stylesheet_url(client)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert b'font-family' in response.data
+    assert response.cache_control.immutable and response.cache_control.max_age == 365 * 24 * 3600
+
+    # Editing the file changes its URL; the old URL still works but is no longer immutable
+    path = os.path.join(app.static_folder, 'css', 'styles.css')
+    with open(path, 'a') as f:
+        f.write('h2 { font-size: 1.5rem; }\n')
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+    assert stylesheet_url(client) != url
+    response = client.get(url)
+    assert response.status_code == 200 and not response.cache_control.immutable
+    assert client.get('/static/css/missing.0123456789ab.css').status_code == 404
+
+def test_precompressed_siblings_are_sent_to_clients_that_accept_them(client, app):
+    written = precompress(app.static_folder)
+    assert os.path.join(app.static_folder, 'css', 'styles.css.gz') in written
+    assert precompress(app.static_folder) == []
+
+    url = stylesheet_url(client)
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert 'Accept-Encoding' in response.vary
+    assert b'font-family' in gzip.decompress(response.data)
+    # Plain clients get the original file
+    response = client.get(url)
+    assert 'Content-Encoding' not in response.headers and b'font-family' in response.data
+
+def test_streamed_html_is_gzipped(client, app):
+    app.config['STREAM_TEMPLATES'] = True
+    plain = client.get('/assets?per_page=60').get_data()
+    response = client.get('/assets?per_page=60', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    body = gzip.decompress(response.get_data())
+    assert b'Asset 59' in body
+    assert len(response.get_data()) < len(plain) / 3
+
+def test_strong_etags_and_disabled_compression_are_left_alone(client, app):
+    response = client.get('/api/v1/assets/1', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200 and response.get_etag() == ('1-1', False)
+    assert 'Content-Encoding' not in response.headers
+    app.config['COMPRESS_ENABLED'] = False
+    response = client.get('/assets', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
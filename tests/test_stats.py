@@ -0,0 +1,106 @@
+import pytest
+from sqlalchemy import event
+from models import db, User, Asset
+from stats import get_stats
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def client(app):
+    # Configures the Flask test client with an admin user and a cold stats cache
+    with app.test_client() as client:
+        with app.app_context():
+            get_stats().clear()
+            admin = User(username='admin', password=generate_password_hash('adminpass', method='pbkdf2:sha256'), role='admin')
+            db.session.add(admin)
+            db.session.commit()
+            yield client
+
+def login(client):
+    response = client.post('/login', data=dict(username='admin', password='adminpass'), follow_redirects=True)
+    assert b'Logged in successfully.' in response.data
+
+# Records the SQL statements that touch the asset table while the block runs
+class AssetQueries:
+    def __enter__(self):
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.record)
+        return self.statements
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if 'asset' in statement.lower():
+            self.statements.append(statement)
+
+def test_home_is_served_from_cache(client):
+    login(client)
+    client.post('/assets/new', data={'name': 'Laptop', 'description': 'XPS'})
+    client.get('/')
+    with AssetQueries() as statements:
+        response = client.get('/')
+    assert response.status_code == 200
+    assert b'Laptop' in response.data
+    assert statements == []
+
+def test_aggregates_follow_inserts_updates_and_deletes(client, app):
+    login(client)
+    client.post('/assets/new', data={'name': 'Laptop', 'description': 'XPS'})
+    with app.app_context():
+        stats = get_stats()
+        # Warm every aggregate, then change the table through the normal routes
+        assert stats.total() == 1
+        assert stats.top_owners_list() == [('admin', 1)]
+        assert stats.recent()['name'] == 'Laptop'
+        assert sum(count for _, count in stats.daily_series()) == 1
+
+    client.post('/assets/new', data={'name': 'Monitor', 'description': 'ASUS'})
+    with app.app_context():
+        monitor = Asset.query.filter_by(name='Monitor').first()
+        monitor_id = monitor.id
+    client.post(f'/assets/edit/{monitor_id}', data={'name': 'Monitor 27', 'description': 'ASUS'})
+
+    with app.app_context():
+        stats = get_stats()
+        assert stats.total() == 2
+        assert stats.recent()['name'] == 'Monitor 27'
+        assert stats.top_owners_list() == [('admin', 2)]
+
+    client.post(f'/assets/delete/{monitor_id}')
+    with app.app_context():
+        stats = get_stats()
+        assert stats.total() == 1
+        assert stats.recent()['name'] == 'Laptop'
+        assert sum(count for _, count in stats.daily_series()) == 1
+
+def test_owner_counts_come_from_the_user_table(client, app):
+    login(client)
+    client.post('/assets/new', data={'name': 'Laptop', 'description': 'XPS'})
+    client.post('/assets/new', data={'name': 'Monitor', 'description': 'ASUS'})
+    with app.app_context():
+        stats = get_stats()
+        stats.clear()
+        with AssetQueries() as statements:
+            assert stats.top_owners_list() == [('admin', 2)]
+            assert stats.total() == 2
+        assert not any('FROM asset' in statement for statement in statements)
+
+def test_cached_values_are_read_only(client, app):
+    login(client)
+    client.post('/assets/new', data={'name': 'Laptop', 'description': 'XPS'})
+    with app.app_context():
+        stats = get_stats()
+        per_owner, per_day, recent = stats.per_owner(), stats.per_day(), stats.recent()
+        with pytest.raises(TypeError):
+            del per_owner[1]
+        with pytest.raises(TypeError):
+            per_day['counts'][per_day['since']] = 10
+        with pytest.raises(TypeError):
+            recent['name'] = 'Other'
+    client.post('/assets/new', data={'name': 'Monitor', 'description': 'ASUS'})
+    with app.app_context():
+        stats = get_stats()
+        # Commits replace the cached values; copies already handed out keep what they showed
+        assert [count for _, count in per_owner.values()] == [1]
+        assert [count for _, count in stats.per_owner().values()] == [2]
+        assert sum(per_day['counts'].values()) == 1 and sum(stats.per_day()['counts'].values()) == 2
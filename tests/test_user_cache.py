@@ -0,0 +1,85 @@
+import os
+import pytest
+from sqlalchemy import event
+from models import db, User
+from user_cache import get_user_cache
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def client(app):
+    # Configures the Flask test client with an admin and a regular user
+    client = app.test_client()
+    with app.app_context():
+        admin = User(username='admin', password=generate_password_hash('adminpass', method='pbkdf2:sha256'), role='admin')
+        user = User(username='user', password=generate_password_hash('userpass', method='pbkdf2:sha256'), role='user')
+        db.session.add_all([admin, user])
+        db.session.commit()
+    yield client
+
+@pytest.fixture
+def user_queries(app):
+    # Collects the statements that read the user table
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if 'FROM user' in statement:
+            statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
+
+def login(client, username, password):
+    response = client.post('/login', data=dict(username=username, password=password), follow_redirects=True)
+    assert b'Logged in successfully.' in response.data
+
+def test_page_views_do_not_query_users(client, user_queries):
+    login(client, 'admin', 'adminpass')
+    client.get('/assets').close()
+    del user_queries[:]
+    for _ in range(3):
+        response = client.get('/assets')
+        assert b'Import Assets' in response.data
+        response.close()
+    assert user_queries == []
+
+def test_role_change_is_seen_on_next_request(client, app):
+    login(client, 'user', 'userpass')
+    assert client.get('/assets/import').status_code == 403
+    with app.app_context():
+        User.query.filter_by(username='user').first().role = 'admin'
+        db.session.commit()
+    assert client.get('/assets/import').status_code == 200
+
+def test_deleted_user_is_logged_out(client, app):
+    login(client, 'user', 'userpass')
+    with app.app_context():
+        db.session.delete(User.query.filter_by(username='user').first())
+        db.session.commit()
+    assert client.get('/assets').status_code == 302
+
+def test_generation_file_invalidates_other_workers(client, app, user_queries):
+    login(client, 'user', 'userpass')
+    client.get('/assets').close()
+    cache = app.extensions['user_cache']
+    # Another worker changed a user and rewrote the generation file
+    with app.app_context():
+        db.session.execute(db.text("UPDATE user SET role = 'admin' WHERE username = 'user'"))
+        db.session.commit()
+    assert client.get('/assets/import').status_code == 403
+    cache.bump_generation()
+    os.utime(cache.generation_file, ns=(cache.generation + 1000, cache.generation + 1000))
+    assert client.get('/assets/import').status_code == 200
+
+def test_core_statements_on_the_user_table_clear_the_cache(client, app):
+    login(client, 'user', 'userpass')
+    assert client.get('/assets/import').status_code == 403
+    table = User.__table__
+    with app.app_context():
+        db.session.execute(table.update().where(table.c.username == 'user').values(role='admin'))
+        db.session.commit()
+    assert client.get('/assets/import').status_code == 200
+    with app.app_context():
+        db.session.execute(table.delete().where(table.c.username == 'user'))
+        db.session.commit()
+    assert client.get('/assets').status_code == 302
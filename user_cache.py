@@ -0,0 +1,125 @@
+import os
+import time
+from flask import current_app, has_app_context
+from flask_login import UserMixin
+from sqlalchemy import event, inspect
+from cache import TTLCache
+from models import db, User
+
+# Per-worker cache of the logged-in user's identity, so session-authenticated requests
+# don't query the user table. Entries are dropped when a user's username or role changes
+# or the user is deleted. Other workers learn about changes through a generation file in
+# the instance folder: every change rewrites it, and a worker that sees a new mtime
+# clears its whole cache. The TTL bounds staleness when several hosts share a database.
+
+IDENTITY_FIELDS = ('username', 'role')
+
+
+# Detached stand-in for User carrying only what requests need. Code that has to modify
+# the user loads the real row with db.session.get(User, current_user.id).
+class CachedUser(UserMixin):
+    def __init__(self, id, username, role):
+        self.id = id
+        self.username = username
+        self.role = role
+
+    def __repr__(self):
+        return '<CachedUser %d %s>' % (self.id, self.username)
+
+
+class UserCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USER_CACHE_SIZE', 10000)
+        app.config.setdefault('USER_CACHE_TTL', 300)
+        app.config.setdefault('USER_CACHE_GENERATION_FILE', os.path.join(app.instance_path, 'user-cache.generation'))
+        self.cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+        self.generation_file = app.config['USER_CACHE_GENERATION_FILE']
+        self.generation = self._read_generation()
+        app.extensions['user_cache'] = self
+
+    def _read_generation(self):
+        try:
+            return os.stat(self.generation_file).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    # Tells every worker sharing the instance folder to drop its cached users
+    def bump_generation(self):
+        os.makedirs(os.path.dirname(self.generation_file), exist_ok=True)
+        with open(self.generation_file, 'w') as f:
+            f.write('%d\n' % time.time_ns())
+
+    def _check_generation(self):
+        generation = self._read_generation()
+        if generation != self.generation:
+            self.cache.clear()
+            self.generation = generation
+
+    # Returns a CachedUser for user_id, or None when no such user exists
+    def load(self, user_id):
+        self._check_generation()
+        def fetch():
+            row = db.session.query(User.id, User.username, User.role).filter(User.id == user_id).first()
+            return CachedUser(*row) if row else None
+        return self.cache.get_or_set(user_id, fetch)
+
+    def invalidate(self, user_ids):
+        for user_id in user_ids:
+            self.cache.pop(user_id)
+        self.bump_generation()
+
+    def clear(self):
+        self.cache.clear()
+        self.bump_generation()
+
+
+def get_user_cache():
+    return current_app.extensions['user_cache']
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault('user_cache_changed', set())
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            if any(state.attrs[key].history.has_changes() for key in IDENTITY_FIELDS):
+                changed.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _bulk_user_statement(orm_execute_state):
+    # Bulk UPDATE/DELETE statements on users bypass the flush, so drop everything. Core
+    # statements on User.__table__ have no mappers, so their target table is checked too.
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if getattr(orm_execute_state.statement, 'table', None) is User.__table__ or \
+            any(mapper.class_ is User for mapper in orm_execute_state.all_mappers):
+        orm_execute_state.session.info['user_cache_stale'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_users(session):
+    changed = session.info.pop('user_cache_changed', set())
+    stale = session.info.pop('user_cache_stale', False)
+    if not (changed or stale) or not has_app_context() or 'user_cache' not in current_app.extensions:
+        return
+    if stale:
+        get_user_cache().clear()
+    else:
+        get_user_cache().invalidate(changed)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_changed_users(session, previous_transaction):
+    # After a savepoint rollback the collected ids are kept; invalidating too much is harmless
+    if not previous_transaction.nested:
+        session.info.pop('user_cache_changed', None)
+        session.info.pop('user_cache_stale', None)